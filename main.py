@@ -1,9 +1,17 @@
 from fasthtml.common import *
 from monsterui.all import *
 from pathlib import Path
-from src.floorplan import ar, floorplans
+from src.floorplan import ar, floorplans, list_floorplans, FLOORPLAN_SORTS, FLOORPLAN_PAGE_SIZE
 from src.element_routes import er
+from src.collab import cr
+from src.search import sr
+from src.notifications import nr, start_scheduler
+from src.risk_dashboard import dr
+from src.document_uploads import ur
+from src.thumbnails import (thumbnail_revisions, thumbnail_url, refresh_thumbnails,
+                            THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT)
 from datetime import datetime
+from urllib.parse import urlencode
 
 # Initialize FastHTML app with blue theme
 app, rt = fast_app(live=True,
@@ -11,9 +19,16 @@ app, rt = fast_app(live=True,
         Theme.zinc.headers(),
         Link(rel="stylesheet", href="/static/css/floorplanner.css"),
     ),
+    # Materializes due maintenance and expiring trainings for /notifications
+    on_startup=[start_scheduler],
 )
 ar.to_app(app)
 er.to_app(app)
+cr.to_app(app)
+sr.to_app(app)
+nr.to_app(app)
+dr.to_app(app)
+ur.to_app(app)
 # Home route
 @app.get("/")
 def index():
@@ -378,37 +393,86 @@ def index():
            )
 
 # Display floorplans page
+def floorplan_rows(sort, order, q, after=None, after_id=None):
+    """One page of overview rows and the task rendering their missing thumbnails.
+    The last row loads the next page once it scrolls into view."""
+    plans = list_floorplans(1, sort, order == "desc", q, after, after_id)
+    thumbnails = thumbnail_revisions(plan['id'] for plan in plans)
+    
+    rows = []
+    for plan in plans:
+        # Format the date
+        updated_date = datetime.fromisoformat(plan['updated_at']).strftime("%d.%m.%Y %H:%M")
+        
+        # Thumbnails are rendered after saving; until then the row shows a placeholder
+        thumbnail = (Img(src=thumbnail_url(plan['id'], thumbnails[plan['id']]), alt=plan['name'], loading="lazy",
+                         width=THUMBNAIL_WIDTH // 2, height=THUMBNAIL_HEIGHT // 2)
+                     if plan['id'] in thumbnails else Span("Vorschau wird erstellt", cls="text-muted"))
+        
+        # Create row with actions
+        rows.append(Tr(
+            Td(thumbnail),
+            Td(plan['name']),
+            Td(f"{plan['width']}m × {plan['height']}m"),
+            Td(updated_date),
+            Td(
+                A("Bearbeiten", href=f"/edit-floorplan/{plan['id']}", cls=ButtonT.default),
+                A("Anzeigen", href=f"/show-floorplan/{plan['id']}", cls=ButtonT.default),
+                Button("Löschen", hx_delete=f"/delete-floorplan/{plan['id']}", hx_target="closest tr", hx_swap="outerHTML", cls=ButtonT.destructive)
+            )
+        ))
+    
+    if len(plans) == FLOORPLAN_PAGE_SIZE:
+        last = plans[-1]
+        next_page = urlencode(dict(sort=sort, order=order, q=q, after=last[sort], after_id=last['id']))
+        rows[-1] = rows[-1](hx_get=f"/floorplans/rows?{next_page}", hx_trigger="revealed", hx_swap="afterend")
+    elif not rows and after_id is None:
+        rows.append(Tr(Td("Keine Grundrisse gefunden", colspan="5", cls="uk-text-center")))
+    
+    # Plans without an up-to-date thumbnail get one after the response is sent
+    return rows, BackgroundTask(refresh_thumbnails, *[plan['id'] for plan in plans
+                                                      if thumbnails.get(plan['id'], -1) < plan['revision']])
+
+def _listing_params(sort, order):
+    return (sort if sort in FLOORPLAN_SORTS else "updated_at"), (order if order in ("asc", "desc") else "desc")
+
+@app.get("/floorplans/rows")
+def floorplans_rows(sort: str = "updated_at", order: str = "desc", q: str = "", after: str = None, after_id: int = None):
+    sort, order = _listing_params(sort, order)
+    rows, thumbnail_task = floorplan_rows(sort, order, q, after, after_id)
+    return *rows, thumbnail_task
+
 @app.get("/floorplans")
-def floorplans_page():
-    # Get list of floor plans from database
-    db_floorplans = floorplans(where='user_id=?', where_args=(1,))
+def floorplans_page(sort: str = "updated_at", order: str = "desc", q: str = ""):
+    sort, order = _listing_params(sort, order)
+    rows, thumbnail_task = floorplan_rows(sort, order, q)
     
-    table_content = []
-    if db_floorplans:
-        for plan in db_floorplans:
-            # Format the date
-            updated_date = datetime.fromisoformat(plan.updated_at).strftime("%d.%m.%Y %H:%M")
-            
-            # Create row with actions
-            table_content.append(Tr(
-                Td(plan.name),
-                Td(f"{plan.width}m × {plan.height}m"),
-                Td(updated_date),
-                Td(
-                    A("Bearbeiten", href=f"/edit-floorplan/{plan.id}", cls=ButtonT.default),
-                    A("Anzeigen", href=f"/show-floorplan/{plan.id}", cls=ButtonT.default),
-                    Button("Löschen", hx_delete=f"/delete-floorplan/{plan.id}", hx_target="closest tr", hx_swap="outerHTML", cls=ButtonT.destructive)
-                )
-            ))
+    # Column headers sort the list; clicking the active column reverses the order
+    def sort_header(label, column):
+        if column != sort:
+            return Th(A(label, href=f"/floorplans?{urlencode(dict(sort=column, order='desc' if column == 'updated_at' else 'asc', q=q))}"))
+        return Th(A(f"{label} {'↓' if order == 'desc' else '↑'}",
+                    href=f"/floorplans?{urlencode(dict(sort=column, order='asc' if order == 'desc' else 'desc', q=q))}"))
+    
+    # Typing in the search field replaces the rows with the first matching page
+    search = Form(
+        Input(type="hidden", name="sort", value=sort),
+        Input(type="hidden", name="order", value=order),
+        Input(type="search", name="q", value=q, placeholder="Grundrisse nach Name suchen",
+              hx_get="/floorplans/rows", hx_trigger="input changed delay:300ms, search",
+              hx_target="#floorplan-rows", hx_include="#floorplan-filter"),
+        id="floorplan-filter", cls="mb-4", onsubmit="return false"
+    )
     
     floorplan_table = Table(
         Thead(Tr(
-            Th("Name"),
+            Th("Vorschau"),
+            sort_header("Name", "name"),
             Th("Abmessungen"),
-            Th("Zuletzt aktualisiert"),
+            sort_header("Zuletzt aktualisiert", "updated_at"),
             Th("Aktionen")
         )),
-        Tbody(*table_content if table_content else [Tr(Td("Keine Grundrisse gefunden", colspan="4", cls="uk-text-center"))]),
+        Tbody(*rows, id="floorplan-rows"),
         cls="uk-table uk-table-divider uk-table-hover"
     )
     
@@ -417,16 +481,18 @@ def floorplans_page():
         NavBar(
             A("Home", href="/"),
             A('Benachrichtigungen', href="/notifications"),
+            A("Suche", href="/search"),
+            A("Risiken", href="/risks"),
             A("Neuer Grundriss", href="/create_floorplan", cls="uk-button uk-button-primary"),
         ),
         Container(
             Card(
                 CardHeader(H3("Meine Grundrisse")),
-                CardBody(floorplan_table),
+                CardBody(search, floorplan_table),
                 CardFooter(P("Klicken Sie auf 'Bearbeiten', um einen Grundriss zu ändern oder 'Anzeigen' für eine schreibgeschützte Ansicht."))
             ),
             cls=("mt-5", "uk-container-xl")
         )
-    )
+    ), thumbnail_task
 
 serve(reload=True)
@@ -0,0 +1,175 @@
+"""
+Real-time collaboration on the floor plan editor.
+
+Every editor of a plan connects to ``/floorplan_editor/{floorplan_id}/ws``.
+Connections of the same plan share a ``Room`` in this worker. Messages are
+JSON objects with a ``type``:
+
+- ``ops`` (client -> server -> other clients): ``{"upsert": [elements],
+  "delete": [ids]}``, relayed to the other editors right away
+- ``select`` (client -> server): the element id the user selected, or null
+- ``presence`` (server -> clients): who is connected, with colour and selection
+- ``sync`` (server -> new client): operations not yet written to the database
+- ``saved`` (server -> clients): a batch was written as ``revision``, with
+  the element ids it contained
+
+Operations are not written one by one. The room collects them and writes
+them as one patch every ``FLUSH_INTERVAL`` seconds, and when the last editor
+leaves. Each batch advances the plan's revision, but batches within
+``REVISION_WINDOW`` seconds are merged into one history revision, and the
+thumbnails are drawn once per such revision and when the last editor leaves,
+so a long session does not push older history out of ``KEEP_REVISIONS``.
+"""
+from fasthtml.common import *
+import asyncio
+import json
+import time
+from src.db import db, floorplans
+from src.floorplan import write_floorplan_patch
+from src.thumbnails import refresh_thumbnails
+
+cr = APIRouter()
+
+FLUSH_INTERVAL = 2.0
+REVISION_WINDOW = 60.0
+COLORS = ["#e6194b", "#3cb44b", "#4363d8", "#f58231", "#911eb4", "#46f0f0", "#f032e6", "#bcf60c",
+          "#008080", "#9a6324", "#800000", "#808000", "#000075", "#fabebe"]
+
+class Room:
+    """Editors connected to one floor plan and their not yet persisted operations"""
+    def __init__(self, floorplan_id):
+        self.floorplan_id = floorplan_id
+        self.clients = {}  # WebSocket -> {"id", "name", "color", "selection"}
+        self.upserts = {}  # element id -> latest element
+        self.deletes = set()
+        self.next_client = 1
+        self.flusher = None
+        self.flush_lock = asyncio.Lock()  # One batch is written at a time
+        self.revision = None  # Revision of the last batch written
+        self.merged = False  # Whether that batch was merged into the history revision before it
+        self.window_start = None  # Monotonic time the history revision being merged into began
+        self.drawn = None  # Revision the thumbnails were last drawn for
+
+    def join(self, ws, name):
+        client_id = self.next_client
+        self.next_client += 1
+        self.clients[ws] = {"id": client_id, "name": name or f"Bearbeiter {client_id}",
+                            "color": COLORS[(client_id - 1) % len(COLORS)], "selection": None}
+        if self.flusher is None: self.flusher = asyncio.create_task(self._flush_periodically())
+        return self.clients[ws]
+
+    def apply(self, upserts, deletes):
+        for element_id in deletes:
+            self.upserts.pop(element_id, None)
+            self.deletes.add(element_id)
+        for element in upserts:
+            self.deletes.discard(element["id"])
+            self.upserts[element["id"]] = element
+
+    def pending(self):
+        return {"upsert": list(self.upserts.values()), "delete": sorted(self.deletes)}
+
+    async def flush(self):
+        """Write the collected operations as one patch. Returns the ``saved`` message or None."""
+        async with self.flush_lock:
+            if not (self.upserts or self.deletes): return None
+            upserts, deletes = self.upserts, sorted(self.deletes)
+            merge_into = self.revision if self.window_start is not None and \
+                time.monotonic() - self.window_start < REVISION_WINDOW else None
+            # Operations arriving while the batch is written are collected for the next one
+            self.upserts, self.deletes = {}, set()
+            try:
+                # Operations are the editors' latest intent, so they are applied on top of
+                # whatever revision is stored, like a patch without a base revision. The write
+                # runs on a worker thread, so the event loop keeps serving the editors.
+                revision = await asyncio.to_thread(write_floorplan_patch, self.floorplan_id,
+                                                   {"update": list(upserts.values()), "delete": deletes}, None,
+                                                   merge_into)
+            except Exception:
+                self._requeue(upserts, deletes)
+                raise
+            # A save by someone else in between starts a new history revision
+            self.merged = merge_into is not None and revision == merge_into + 1
+            if not self.merged: self.window_start = time.monotonic()
+            self.revision = revision
+        print(f'floorplan {self.floorplan_id} collaborative batch saved as revision {revision} '
+              f'({len(upserts)} upserted, {len(deletes)} deleted)')
+        return {"type": "saved", "revision": revision, "upsert": list(upserts), "delete": deletes}
+
+    def _requeue(self, upserts, deletes):
+        """Put a batch that failed to save back, under operations received since"""
+        newer = set(self.upserts) | self.deletes
+        self.deletes.update(element_id for element_id in deletes if element_id not in newer)
+        self.upserts.update({element_id: element for element_id, element in upserts.items() if element_id not in newer})
+
+    async def _flush_periodically(self):
+        while self.clients:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush_and_announce()
+
+    async def flush_and_announce(self, closing=False):
+        try:
+            saved = await self.flush()
+        except Exception as e:
+            print(f"Error saving collaborative edits of floorplan {self.floorplan_id}: {str(e)}")
+            return
+        if saved: await self.broadcast(saved)
+        # Thumbnails follow history revisions, not every batch merged into one
+        if self.revision != self.drawn and (closing or not self.merged):
+            self.drawn = self.revision
+            await asyncio.to_thread(refresh_thumbnails, self.floorplan_id)
+
+    def presence(self):
+        return {"type": "presence", "clients": list(self.clients.values())}
+
+    async def broadcast(self, message, exclude=None):
+        text = json.dumps(message)
+        targets = [ws for ws in self.clients if ws is not exclude]
+        results = await asyncio.gather(*(ws.send_text(text) for ws in targets), return_exceptions=True)
+        # Connections that fail are closed; their disconnect handler removes them
+        for ws, result in zip(targets, results):
+            if isinstance(result, Exception): print(f"Error sending to editor: {str(result)}")
+
+rooms = {}
+
+def _room(ws):
+    return rooms.get(int(ws.path_params["floorplan_id"]))
+
+async def on_connect(ws, session):
+    floorplan_id = int(ws.path_params["floorplan_id"])
+    if not floorplans(where='id=?', where_args=(floorplan_id,)):
+        await ws.close(code=4404)
+        return
+    room = rooms.setdefault(floorplan_id, Room(floorplan_id))
+    client = room.join(ws, ws.query_params.get("name") or session.get("username"))
+    revision = db.execute("SELECT revision FROM floorplans WHERE id=?", (floorplan_id,)).fetchone()[0]
+    await ws.send_text(json.dumps({"type": "sync", "client_id": client["id"], "revision": revision,
+                                   **room.pending()}))
+    await room.broadcast(room.presence())
+
+async def on_disconnect(ws):
+    room = _room(ws)
+    if room is None or ws not in room.clients: return
+    del room.clients[ws]
+    if room.clients:
+        await room.broadcast(room.presence())
+        return
+    # Last editor left: persist what is pending and drop the room
+    rooms.pop(room.floorplan_id, None)
+    if room.flusher: room.flusher.cancel()
+    await room.flush_and_announce(closing=True)
+
+@cr.ws('/floorplan_editor/{floorplan_id}/ws', conn=on_connect, disconn=on_disconnect)
+async def on_message(ws, data):
+    room = _room(ws)
+    if room is None or ws not in room.clients: return
+    client = room.clients[ws]
+    if data.get("type") == "ops":
+        upserts = [e for e in data.get("upsert", []) if isinstance(e, dict) and e.get("id")]
+        deletes = [i for i in data.get("delete", []) if isinstance(i, str)]
+        room.apply(upserts, deletes)
+        await room.broadcast({"type": "ops", "client_id": client["id"], "upsert": upserts, "delete": deletes},
+                             exclude=ws)
+    elif data.get("type") == "select":
+        client["selection"] = data.get("element_id")
+        await room.broadcast(room.presence(), exclude=ws)
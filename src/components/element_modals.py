@@ -6,6 +6,8 @@ from monsterui.all import *
 import json
 import datetime
 from src.db import elements, risk_assessments, operating_instructions, training_records, documents
+from src.document_uploads import DIRECT_UPLOADS
+from src.s3 import document_urls
 
 def modal_wrapper(title, content, modal_id="modal"):
     """Generic modal wrapper for all modals"""
@@ -132,7 +134,7 @@ def risk_assessment_form(floorplan_id, element_id, risk_id=None):
             H5("Technische Maßnahmen"),
             Div(id="technical-measures-container", cls="measures-container"),
             *[Div(
-                Input(type="text", value=measure, name=f"technical_measures[]", cls="uk-input uk-margin-small-bottom"),
+                Input(type="text", value=measure, name="technical_measures", cls="uk-input uk-margin-small-bottom"),
                 Button("×", cls="uk-button uk-button-small uk-button-danger", 
                       onclick="this.parentNode.remove();"),
                 cls="measure-input uk-flex"
@@ -143,7 +145,7 @@ def risk_assessment_form(floorplan_id, element_id, risk_id=None):
                   const div = document.createElement('div');
                   div.className = 'measure-input uk-flex';
                   div.innerHTML = `
-                      <input type="text" name="technical_measures[]" class="uk-input uk-margin-small-bottom">
+                      <input type="text" name="technical_measures" class="uk-input uk-margin-small-bottom">
                       <button class="uk-button uk-button-small uk-button-danger" onclick="this.parentNode.remove();">×</button>
                   `;
                   container.appendChild(div);
@@ -155,7 +157,7 @@ def risk_assessment_form(floorplan_id, element_id, risk_id=None):
             H5("Organisatorische Maßnahmen"),
             Div(id="organizational-measures-container", cls="measures-container"),
             *[Div(
-                Input(type="text", value=measure, name=f"organizational_measures[]", cls="uk-input uk-margin-small-bottom"),
+                Input(type="text", value=measure, name="organizational_measures", cls="uk-input uk-margin-small-bottom"),
                 Button("×", cls="uk-button uk-button-small uk-button-danger", 
                       onclick="this.parentNode.remove();"),
                 cls="measure-input uk-flex"
@@ -166,7 +168,7 @@ def risk_assessment_form(floorplan_id, element_id, risk_id=None):
                   const div = document.createElement('div');
                   div.className = 'measure-input uk-flex';
                   div.innerHTML = `
-                      <input type="text" name="organizational_measures[]" class="uk-input uk-margin-small-bottom">
+                      <input type="text" name="organizational_measures" class="uk-input uk-margin-small-bottom">
                       <button class="uk-button uk-button-small uk-button-danger" onclick="this.parentNode.remove();">×</button>
                   `;
                   container.appendChild(div);
@@ -178,7 +180,7 @@ def risk_assessment_form(floorplan_id, element_id, risk_id=None):
             H5("Persönliche Maßnahmen"),
             Div(id="personal-measures-container", cls="measures-container"),
             *[Div(
-                Input(type="text", value=measure, name=f"personal_measures[]", cls="uk-input uk-margin-small-bottom"),
+                Input(type="text", value=measure, name="personal_measures", cls="uk-input uk-margin-small-bottom"),
                 Button("×", cls="uk-button uk-button-small uk-button-danger", 
                       onclick="this.parentNode.remove();"),
                 cls="measure-input uk-flex"
@@ -189,7 +191,7 @@ def risk_assessment_form(floorplan_id, element_id, risk_id=None):
                   const div = document.createElement('div');
                   div.className = 'measure-input uk-flex';
                   div.innerHTML = `
-                      <input type="text" name="personal_measures[]" class="uk-input uk-margin-small-bottom">
+                      <input type="text" name="personal_measures" class="uk-input uk-margin-small-bottom">
                       <button class="uk-button uk-button-small uk-button-danger" onclick="this.parentNode.remove();">×</button>
                   `;
                   container.appendChild(div);
@@ -377,6 +379,18 @@ def training_records_modal(floorplan_id, element_id):
             where_args=(element.id,)
         )
         
+        # File names of all listed documents in one query; links go through the download
+        # route, which signs a URL when clicked, so a modal left open does not go stale
+        listed = {doc_id for record in records for doc_id in json.loads(record.document_ids or '[]')}
+        docs = {doc.id: doc for doc in documents(where=f"id IN ({','.join('?' * len(listed))})",
+                                                 where_args=tuple(listed))} if listed else {}
+        # Sign the listed documents in one pass, so the route redirects from the cache
+        document_urls([doc.s3_key for doc in docs.values()])
+        
+        def document_link(i, doc_id):
+            doc = docs.get(int(doc_id)) if str(doc_id).isdigit() else None
+            return A(doc.filename if doc else f"Dokument {i+1}", href=f"/document/{doc_id}", target="_blank")
+        
         records_table = Table(
             Thead(
                 Tr(
@@ -395,8 +409,7 @@ def training_records_modal(floorplan_id, element_id):
                         Td(record.training_date),
                         Td(
                             Div(
-                                *[A(f"Dokument {i+1}", href=f"/document/{doc_id}", target="_blank") 
-                                  for i, doc_id in enumerate(json.loads(record.document_ids))]
+                                *[document_link(i, doc_id) for i, doc_id in enumerate(json.loads(record.document_ids))]
                                 if record.document_ids else [Span("Keine Dokumente")]
                             )
                         ),
@@ -471,7 +484,7 @@ def training_record_form(floorplan_id, element_id, record_id=None):
                     Span(f"Dokument {i+1}"),
                     Button("×", cls="uk-button uk-button-small uk-button-danger", 
                            onclick="this.parentNode.remove();"),
-                    Input(type="hidden", name="document_ids[]", value=doc_id),
+                    Input(type="hidden", name="document_ids", value=doc_id),
                     cls="document-item uk-flex uk-flex-middle"
                 ) for i, doc_id in enumerate(document_ids)],
                 id="documents-container"
@@ -480,11 +493,13 @@ def training_record_form(floorplan_id, element_id, record_id=None):
                 Label("Neues Dokument hochladen", for_id="file-upload"),
                 Input(type="file", id="file-upload", name="document", cls="uk-input"),
                 Button("Hochladen", 
+                      type="button",
                       cls="uk-button uk-button-small uk-button-default",
-                      hx_post=f"/element/{floorplan_id}/{element_id}/document/upload",
-                      hx_target="#upload-status",
-                      hx_swap="outerHTML",
-                      hx_trigger="click"),
+                      data_url=f"/element/{floorplan_id}/{element_id}/document/uploads",
+                      data_uploaded=f"/element/{floorplan_id}/{element_id}/document",
+                      data_presign=f"/element/{floorplan_id}/{element_id}/document/presign" if DIRECT_UPLOADS else None,
+                      data_complete=f"/element/{floorplan_id}/{element_id}/document/complete",
+                      onclick="uploadDocument(this)"),
                 Div(id="upload-status"),
                 cls="uk-margin"
             ),
@@ -1,12 +1,32 @@
 import json
+import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 from dataclasses import dataclass
 from typing import Optional, Dict, Any, Union, List
 from fasthtml.common import database
+from fastcore.utils import flexiclass
+from src import migrations
 
 # Initialize database
-db = database('data/floorplan.db')
-modify = True
+db = database(os.getenv('EASE_DB_PATH', 'data/floorplan.db'))
+# Apply pending migrations on boot; set EASE_AUTO_MIGRATE=0 to require
+# `python -m src.migrations upgrade` to be run offline instead
+AUTO_MIGRATE = os.getenv('EASE_AUTO_MIGRATE', '1') != '0'
+
+# The connection is shared by all request threads, and apsw refuses a call
+# while another thread's statement is running on it. Multi-statement writes
+# hold this lock for their whole transaction, so they never interleave: a
+# revision check and the write based on it are serialized against other saves.
+write_lock = threading.RLock()
+
+@contextmanager
+def write_transaction():
+    """Transaction on the shared connection, exclusive among the app's writers; may be nested"""
+    with write_lock, db.conn:
+        yield
+
 @dataclass
 class User:
     username: str
@@ -22,9 +42,59 @@ class FloorPlan:
     name: str
     width: float
     height: float
-    data: Union[str, Dict[str, Any]]  # Can be JSON string or dict
+    data: Optional[str] = None  # Legacy JSON document; geometry lives in floorplan_elements
     created_at: Optional[str] = None
     updated_at: Optional[str] = None
+    revision: Optional[int] = 0  # Bumped on every save
+    id: Optional[int] = None
+
+@dataclass
+class FloorPlanElement:
+    floorplan_id: int
+    element_id: str  # Client-side element id
+    element_type: str
+    seq: int  # Drawing order within the plan
+    start_x: Optional[float] = None
+    start_y: Optional[float] = None
+    end_x: Optional[float] = None
+    end_y: Optional[float] = None
+    width: Optional[float] = None
+    properties: Optional[str] = None  # JSON string with element properties
+    extra: Optional[str] = None  # JSON string with any other element keys
+    id: Optional[int] = None
+
+@dataclass
+class FloorPlanRevision:
+    floorplan_id: int
+    revision: int
+    kind: str  # 'keyframe' or 'delta'
+    elements: bytes  # plan_codec blob: all elements (keyframe) or upserted elements (delta)
+    deleted: Optional[str] = None  # JSON list of deleted element ids
+    ordering: Optional[str] = None  # JSON list of element ids if the order changed
+    changes: int = 0
+    created_at: Optional[str] = None
+    id: Optional[int] = None
+
+@dataclass
+class FloorPlanThumbnail:
+    floorplan_id: int  # One thumbnail per plan
+    revision: int  # Plan revision the thumbnail shows
+    media_type: str
+    image: bytes
+    created_at: Optional[str] = None
+
+@dataclass
+class Notification:
+    user_id: int
+    kind: str  # 'maintenance' or 'training'
+    record_id: int  # elements.id (maintenance) or training_records.id
+    element_id: int  # elements.id
+    floorplan_id: int
+    subject: str  # Element name
+    detail: str
+    due_date: Optional[str] = None
+    created_at: Optional[str] = None
+    refreshed_at: Optional[str] = None  # Last scheduler run that found it due
     id: Optional[int] = None
 
 @dataclass
@@ -32,10 +102,35 @@ class Document:
     floorplan_id: int
     element_id: str
     filename: str
-    s3_key: str
+    s3_key: str  # Shared by the documents with the same sha256
     upload_date: Optional[str] = None
+    sha256: Optional[str] = None  # Content hash, hex; None for documents stored before content addressing
+    size: Optional[int] = None
     id: Optional[int] = None
 
+@dataclass
+class DocumentUpload:
+    floorplan_id: int
+    element_id: str
+    filename: str
+    s3_key: str
+    upload_id: str  # S3 multipart upload
+    size: int  # Bytes announced by the client
+    parts: str  # JSON object of part number to ETag of the stored parts
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    id: Optional[str] = None  # Token of the session
+
+@dataclass
+class DirectUpload:
+    floorplan_id: int
+    element_id: str
+    filename: str
+    s3_key: str  # Key the presigned POST policy was issued for
+    size: int  # Bytes announced by the client
+    created_at: Optional[str] = None
+    id: Optional[str] = None  # Token the browser completes the upload with
+
 @dataclass
 class Element:
     floorplan_id: int
@@ -46,8 +141,12 @@ class Element:
     dangers: str
     safety_instructions: str
     trained_employees: str  # JSON string with employee IDs or names
-    maintenance_schedule: str
+    maintenance_schedule: str  # Readable schedule, e.g. "alle 6 Monate"
     last_maintenance: Optional[str] = None
+    maintenance_interval: Optional[int] = None  # Recurrence, see src/maintenance.py
+    maintenance_unit: Optional[str] = None  # 'days', 'weeks', 'months' or 'years'
+    maintenance_anchor: Optional[str] = None  # Date the first maintenance is due
+    next_maintenance_due: Optional[str] = None  # Denormalized from the recurrence and last_maintenance
     created_at: Optional[str] = None
     updated_at: Optional[str] = None
     id: Optional[int] = None
@@ -63,6 +162,7 @@ class RiskAssessment:
     technical_measures: str  # JSON string with measures
     organizational_measures: str  # JSON string with measures
     personal_measures: str  # JSON string with measures
+    measure_count: int = 0  # Measures of all three kinds, 0 if unmitigated
     created_at: Optional[str] = None
     updated_at: Optional[str] = None
     id: Optional[int] = None
@@ -89,19 +189,88 @@ class TrainingRecord:
     created_at: Optional[str] = None
     id: Optional[int] = None
 
+# Secondary indexes, {name: (table, columns)}. Kept in sync by migrations.sync_indexes;
+# only `idx_*` names are managed, anything not listed here is dropped.
+INDEXES = {
+    # Keyset pages of the overview, per sort column
+    'idx_floorplans_user_updated': ('floorplans', ('user_id', 'updated_at', 'id')),
+    'idx_floorplans_user_name': ('floorplans', ('user_id', 'name', 'id')),
+    'idx_floorplan_elements_seq': ('floorplan_elements', ('floorplan_id', 'seq')),
+    'idx_elements_floorplan_element': ('elements', ('floorplan_id', 'element_id')),
+    # Covers the per-plan risk aggregates of the dashboard
+    'idx_risk_assessments_element': ('risk_assessments', ('element_id', 'risk_score', 'measure_count')),
+    # Top risks across all plans, read from the highest score down
+    'idx_risk_assessments_score': ('risk_assessments', ('risk_score',)),
+    'idx_operating_instructions_element': ('operating_instructions', ('element_id',)),
+    # Also finds the newest record of a training per employee
+    'idx_training_records_element': ('training_records', ('element_id', 'employee_name', 'training_name', 'training_date')),
+    # Range scans of the notification scheduler
+    'idx_elements_next_maintenance': ('elements', ('next_maintenance_due',)),
+    'idx_training_records_date': ('training_records', ('training_date',)),
+    'idx_notifications_user_due': ('notifications', ('user_id', 'due_date')),
+    'idx_notifications_element': ('notifications', ('element_id',)),
+    'idx_document_uploads_updated': ('document_uploads', ('updated_at',)),
+    'idx_direct_uploads_created': ('direct_uploads', ('created_at',)),
+    'idx_documents_s3_key': ('documents', ('s3_key',)),
+    'idx_documents_sha256': ('documents', ('sha256', 'size')),
+}
+
+# Lookups issued by the routes and modals. `python -m src.migrations check-plans`
+# fails if any of these is planned as a full table SCAN.
+HOT_QUERIES = [
+    "SELECT * FROM floorplans WHERE id=?",
+    "SELECT * FROM floorplans WHERE user_id=?",
+    "SELECT * FROM floorplans WHERE user_id=? AND id=?",
+    "SELECT id, name, width, height, updated_at, revision FROM floorplans WHERE user_id=? AND (updated_at, id) < (?, ?) ORDER BY updated_at DESC, id DESC LIMIT ?",
+    "SELECT id, name, width, height, updated_at, revision FROM floorplans WHERE user_id=? AND (name, id) > (?, ?) ORDER BY name ASC, id ASC LIMIT ?",
+    "SELECT * FROM floorplan_elements WHERE floorplan_id=? ORDER BY seq",
+    "SELECT * FROM floorplan_elements WHERE floorplan_id=? AND element_id=?",
+    "SELECT * FROM floorplan_elements_rtree WHERE min_fp<=? AND max_fp>=? AND max_x>=? AND min_x<=? AND max_y>=? AND min_y<=?",
+    "SELECT * FROM floorplan_revisions WHERE floorplan_id=? AND revision=?",
+    "SELECT * FROM floorplan_revisions WHERE floorplan_id=? ORDER BY revision DESC",
+    "SELECT MAX(revision) FROM floorplan_revisions WHERE floorplan_id=? AND kind='keyframe' AND revision<=?",
+    "SELECT * FROM floorplan_thumbnails WHERE floorplan_id=?",
+    "SELECT * FROM search_index WHERE search_index MATCH ?",
+    "SELECT * FROM search_index WHERE rowid=?",
+    "SELECT * FROM elements WHERE floorplan_id=?",
+    "SELECT * FROM elements WHERE floorplan_id=? AND element_id=?",
+    "SELECT * FROM risk_assessments WHERE element_id=?",
+    "SELECT * FROM risk_assessments WHERE id=? AND element_id=?",
+    "SELECT * FROM risk_assessments WHERE risk_score >= ? ORDER BY risk_score DESC",
+    "SELECT * FROM operating_instructions WHERE element_id=?",
+    "SELECT * FROM training_records WHERE element_id=?",
+    "SELECT * FROM training_records WHERE id=? AND element_id=?",
+    "SELECT * FROM elements WHERE next_maintenance_due <= ?",
+    "SELECT * FROM training_records WHERE training_date < ?",
+    "SELECT 1 FROM training_records WHERE element_id=? AND employee_name=? AND training_name=? AND training_date > ?",
+    "SELECT * FROM notifications WHERE user_id=? ORDER BY due_date LIMIT ?",
+    "DELETE FROM notifications WHERE element_id=? AND refreshed_at < ?",
+    "SELECT * FROM document_uploads WHERE updated_at < ?",
+    "SELECT * FROM direct_uploads WHERE created_at < ?",
+    "SELECT * FROM documents WHERE s3_key=?",
+    "SELECT * FROM documents WHERE sha256=? AND size=?",
+]
+
+# Bring the schema up to date. Two catalog lookups when nothing is pending.
+migrations.ensure_current(db, INDEXES, apply=AUTO_MIGRATE)
+
+# Bind tables to their dataclasses; the schema itself is owned by src/migrations
+def _bind(name, cls):
+    flexiclass(cls)
+    table = db.t[name]
+    table.cls = cls
+    return table
 
-# Create tables if they don't exist
-users = db.t.users
-if users not in db.t or modify: users = db.create(User,name='users',pk='id',transform=True)
-floorplans = db.t.floorplans
-if floorplans not in db.t or modify: floorplans = db.create(FloorPlan,name='floorplans',pk='id',transform=True)
-documents = db.t.documents
-if documents not in db.t or modify: documents = db.create(Document,name='documents',pk='id',transform=True)
-elements = db.t.elements
-if elements not in db.t or modify: elements = db.create(Element,name='elements',pk='id',transform=True)
-risk_assessments = db.t.risk_assessments
-if risk_assessments not in db.t or modify: risk_assessments = db.create(RiskAssessment,name='risk_assessments',pk='id',transform=True)
-operating_instructions = db.t.operating_instructions
-if operating_instructions not in db.t or modify: operating_instructions = db.create(OperatingInstruction,name='operating_instructions',pk='id',transform=True)
-training_records = db.t.training_records
-if training_records not in db.t or modify: training_records = db.create(TrainingRecord,name='training_records',pk='id',transform=True)
+users = _bind('users', User)
+floorplans = _bind('floorplans', FloorPlan)
+floorplan_elements = _bind('floorplan_elements', FloorPlanElement)
+floorplan_revisions = _bind('floorplan_revisions', FloorPlanRevision)
+floorplan_thumbnails = _bind('floorplan_thumbnails', FloorPlanThumbnail)
+notifications = _bind('notifications', Notification)
+documents = _bind('documents', Document)
+document_uploads = _bind('document_uploads', DocumentUpload)
+direct_uploads = _bind('direct_uploads', DirectUpload)
+elements = _bind('elements', Element)
+risk_assessments = _bind('risk_assessments', RiskAssessment)
+operating_instructions = _bind('operating_instructions', OperatingInstruction)
+training_records = _bind('training_records', TrainingRecord)
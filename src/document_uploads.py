@@ -0,0 +1,519 @@
+"""
+Streaming and resumable document uploads into S3 multipart uploads.
+
+Request bodies are read chunk by chunk and cut into ``PART_SIZE`` parts that
+are uploaded as soon as they are full, up to ``PARALLEL_PARTS`` at a time on
+the S3 executor. An upload therefore holds at most
+``(PARALLEL_PARTS + 1) * PART_SIZE`` bytes in memory, whatever the file size.
+
+Resumable uploads follow the tus protocol in spirit:
+
+1. ``POST /element/{floorplan_id}/{element_id}/document/uploads`` with
+   ``filename`` and ``size`` starts a session (row in ``document_uploads``)
+   and the S3 multipart upload
+2. ``PATCH /document/uploads/{token}`` with an ``Upload-Offset`` header
+   streams bytes from that offset; one request may carry the whole file
+3. after a dropped connection ``GET /document/uploads/{token}`` returns the
+   offset to continue from: the bytes of all parts stored without a gap
+
+The request completing the file assembles the object and inserts the
+``documents`` row. Sessions not finished within ``UPLOAD_EXPIRY_HOURS`` are
+aborted when the next upload starts.
+
+Documents are content-addressed: objects are stored once under
+``documents/sha256/{hash}`` and shared by all ``documents`` rows with the
+same content; an object is deleted with the last row referencing it
+(``release_documents``). Documents no training record references are
+released once they are older than ``UPLOAD_EXPIRY_HOURS``, like unfinished
+uploads. Finding stored content and adding a row for it
+holds a lock per content, like removing rows and deleting their object, so
+a document is never added for an object that is about to be deleted. The SHA-256 is computed while the bytes stream
+through, each upload lands under its own key first and is then copied to
+its content key within S3, or dropped if the content is stored already.
+
+When the browser sends the hash of the file up front and the content is
+known, the hash is not taken on trust, as anybody could know it: the
+response carries a challenge next to the upload, a random nonce and byte
+range of the content. If the browser answers with the SHA-256 of the nonce
+followed by those bytes of its file (``POST /document/proofs/{token}``), the
+document is added without sending the file and the upload is dropped;
+otherwise the upload proceeds as usual.
+
+With ``DIRECT_UPLOADS`` the browser first tries to upload straight to the
+bucket, bypassing this process: ``POST .../document/presign`` returns a
+presigned POST policy for one key under ``documents/{floorplan_id}/{element_id}/``
+and at most the announced size, recorded in ``direct_uploads`` under a token.
+``POST .../document/complete`` with that token checks the object exists and
+inserts the ``documents`` row; keys the app did not issue, such as those of
+documents stored before content addressing, cannot be completed. Keys not
+completed within ``UPLOAD_EXPIRY_HOURS`` are deleted with their object. S3 verifies the upload
+against the hash announced with the policy, so the app does not read the
+file; without such a checksum it is read back once to hash it. This needs a CORS rule on
+the bucket allowing POST from the app's origin; without it the browser falls
+back to the resumable upload.
+"""
+import asyncio
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import hmac
+import re
+import secrets
+import time
+import weakref
+from fasthtml.common import *
+from monsterui.all import *
+from starlette.requests import ClientDisconnect
+from src.db import db, elements, documents, document_uploads, direct_uploads, write_transaction
+from src.s3 import (create_multipart_upload_async, upload_part_async, complete_multipart_upload_async,
+                    abort_multipart_upload_async, generate_presigned_document_post_async, document_info_async,
+                    document_sha256_async, document_range_async, copy_document_async, delete_document_async)
+
+ur = APIRouter()
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for every part but the last
+PART_SIZE = max(MIN_PART_SIZE, int(os.getenv('EASE_UPLOAD_PART_MB', '8')) * 1024 * 1024)
+PARALLEL_PARTS = int(os.getenv('EASE_UPLOAD_PARALLEL_PARTS', '4'))
+MAX_DOCUMENT_SIZE = int(os.getenv('EASE_MAX_DOCUMENT_MB', '2048')) * 1024 * 1024
+UPLOAD_EXPIRY_HOURS = int(os.getenv('EASE_UPLOAD_EXPIRY_HOURS', '24'))
+DIRECT_UPLOADS = os.getenv('EASE_DIRECT_UPLOADS', '1') == '1'
+PRESIGN_EXPIRY = 900  # Seconds a presigned POST policy is valid
+CHALLENGE_BYTES = 64 * 1024  # Bytes of known content a client has to hash to prove it has the file
+CHALLENGE_EXPIRY = 300  # Seconds a challenge can be answered
+
+_SHA256_RE = re.compile(r'[0-9a-f]{64}')
+
+class UploadError(ValueError): pass
+
+def document_prefix(floorplan_id, element_id):
+    return f"documents/{floorplan_id}/{element_id}/"
+
+def document_key(floorplan_id, element_id, filename):
+    """S3 key of a newly uploaded document"""
+    file_ext = os.path.splitext(filename)[1]
+    return f"{document_prefix(floorplan_id, element_id)}{datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')}{file_ext}"
+
+# Content-addressed storage
+
+def content_key(sha256):
+    """S3 key of the object holding the content with this hash"""
+    return f"documents/sha256/{sha256[:2]}/{sha256}"
+
+def valid_sha256(sha256):
+    """Lower-case hex SHA-256 from a client, None if it is none"""
+    sha256 = (sha256 or '').strip().lower()
+    return sha256 if _SHA256_RE.fullmatch(sha256) else None
+
+def stored_document(sha256, size):
+    """A document with this content, None if the content is not stored yet"""
+    found = documents(where="sha256=? AND size=?", where_args=(sha256, size), limit=1)
+    return found[0] if found else None
+
+def add_document(floorplan_id, element_id, filename, s3_key, sha256, size):
+    return documents.insert(floorplan_id=floorplan_id, element_id=element_id, filename=os.path.basename(filename),
+                            s3_key=s3_key, sha256=sha256, size=size, upload_date=datetime.datetime.now().isoformat())
+
+# Locks per content (its hash, the key of documents without one), held while stored content
+# is looked up and referenced or while documents are removed and their object deleted
+_content_locks = weakref.WeakValueDictionary()
+
+def _content_lock(content):
+    lock = _content_locks.get(content)
+    if lock is None: lock = _content_locks[content] = asyncio.Lock()
+    return lock
+
+def _referenced(s3_key):
+    return bool(documents(where="s3_key=?", where_args=(s3_key,), limit=1))
+
+async def store_upload(floorplan_id, element_id, filename, upload_key, sha256, size):
+    """Add a document for an uploaded object. The object is moved to its content key, or dropped
+    if that content is stored already."""
+    # The upload is deleted below, which must never hit an object a document uses
+    if _referenced(upload_key): raise UploadError("Die Datei gehört bereits zu einem Dokument")
+    async with _content_lock(sha256):
+        existing = stored_document(sha256, size)
+        s3_key = existing.s3_key if existing else await copy_document_async(upload_key, content_key(sha256))
+        doc = add_document(floorplan_id, element_id, filename, s3_key, sha256, size)
+    await delete_document_async(upload_key)
+    return doc
+
+def _delete_rows(docs, cascade):
+    """Delete the rows of ``docs`` and run ``cascade`` in one transaction.
+    Returns the keys no document references any more."""
+    with write_transaction():
+        for doc in docs: db.execute("DELETE FROM documents WHERE id=?", (doc.id,))
+        if cascade: cascade()
+        return {doc.s3_key for doc in docs if not _referenced(doc.s3_key)}
+
+async def release_documents(doc_ids, cascade=None):
+    """Delete documents; an object is deleted with the last document referencing it.
+    ``cascade`` runs in the same transaction, e.g. to delete what the documents belonged to.
+    Database work runs on a worker thread, so waiting for the write lock does not block the event loop."""
+    doc_ids = [int(doc_id) for doc_id in doc_ids if str(doc_id).isdigit()]
+    docs = await asyncio.to_thread(documents, where=f"id IN ({','.join('?' * len(doc_ids))})",
+                                   where_args=tuple(doc_ids)) if doc_ids else []
+    async with contextlib.AsyncExitStack() as stack:
+        # Always taken in the same order, so two releases cannot wait for each other
+        for content in sorted({doc.sha256 or doc.s3_key for doc in docs}):
+            await stack.enter_async_context(_content_lock(content))
+        orphaned = await asyncio.to_thread(_delete_rows, docs, cascade)
+        for s3_key in orphaned: await delete_document_async(s3_key)
+
+async def delete_floorplan_documents(floorplan_id, cascade):
+    """Drop a floor plan's unfinished uploads and release its documents, deleting the plan's
+    rows with ``cascade`` in the same transaction"""
+    for session in document_uploads(where="floorplan_id=?", where_args=(floorplan_id,)):
+        await _drop_session(session)
+    docs = await asyncio.to_thread(documents, where="floorplan_id=?", where_args=(floorplan_id,))
+    await release_documents([doc.id for doc in docs], cascade)
+
+class PartUploader:
+    """Cuts a byte stream into parts of a multipart upload and uploads them concurrently.
+
+    ``write`` waits while ``parallel`` parts are in flight, which bounds the
+    memory used. ``parts`` maps part numbers to ETags of the stored parts.
+    A ``hasher`` is updated with every part as it is cut, so it covers the
+    bytes up to the end of the last part submitted."""
+    def __init__(self, s3_key, upload_id, first_part=1, parts=None, parallel=PARALLEL_PARTS, hasher=None):
+        self.s3_key, self.upload_id = s3_key, upload_id
+        self.next_part = first_part
+        self.parts = dict(parts or {})
+        self.hasher = hasher
+        self.buffer = bytearray()
+        self.slots = asyncio.Semaphore(parallel)
+        self.tasks = []
+
+    async def write(self, chunk):
+        self.buffer += chunk
+        while len(self.buffer) >= PART_SIZE:
+            data = bytes(self.buffer[:PART_SIZE])
+            del self.buffer[:PART_SIZE]
+            await self._submit(data)
+
+    async def _submit(self, data):
+        if self.hasher: self.hasher.update(data)
+        await self.slots.acquire()
+        part_number = self.next_part
+        self.next_part += 1
+        self.tasks.append(asyncio.create_task(self._upload(part_number, data)))
+
+    async def _upload(self, part_number, data):
+        try:
+            self.parts[part_number] = await upload_part_async(self.s3_key, self.upload_id, part_number, data)
+        finally:
+            self.slots.release()
+
+    async def finish(self, last=False):
+        """Wait for the parts in flight; with ``last`` the buffered rest is uploaded as the final part.
+        Raises the first failed part's error after all parts have settled."""
+        if last and self.buffer:
+            await self._submit(bytes(self.buffer))
+            self.buffer.clear()
+        results = await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for result in results:
+            if isinstance(result, BaseException): raise result
+        return self.parts
+
+async def upload_file(floorplan_id, element_id, file):
+    """Store an ``UploadFile`` as a document. It is hashed from the spooled copy
+    first, so known content is not uploaded again."""
+    digest, size = hashlib.sha256(), 0
+    while chunk := await file.read(PART_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    sha256 = digest.hexdigest()
+    async with _content_lock(sha256):
+        existing = stored_document(sha256, size)
+        if existing:
+            s3_key = existing.s3_key
+        else:
+            await file.seek(0)
+            s3_key = await stream_to_s3(file.read, content_key(sha256))
+        return add_document(floorplan_id, element_id, file.filename, s3_key, sha256, size)
+
+async def stream_to_s3(read, s3_key):
+    """Upload everything ``read(size)`` returns to ``s3_key`` as a multipart upload"""
+    upload_id = await create_multipart_upload_async(s3_key)
+    uploader = PartUploader(s3_key, upload_id)
+    try:
+        while chunk := await read(PART_SIZE):
+            await uploader.write(chunk)
+        await complete_multipart_upload_async(s3_key, upload_id, await uploader.finish(last=True))
+        return s3_key
+    except BaseException:
+        await asyncio.gather(*uploader.tasks, return_exceptions=True)
+        await abort_multipart_upload_async(s3_key, upload_id)
+        raise
+
+def uploaded_document_item(floorplan_id, element_id, doc):
+    """Upload status with the new document, added to the training record form's documents"""
+    return Div(
+        Div(f"Datei hochgeladen: {doc.filename}", cls="uk-alert uk-alert-success"),
+        Div(
+            Span(f"Dokument: {doc.filename}"),
+            Button("×", cls="uk-button uk-button-small uk-button-danger",
+                  hx_get=f"/element/{floorplan_id}/{element_id}/remove-form-item",
+                  hx_target="closest .document-item",
+                  hx_swap="outerHTML"),
+            Input(type="hidden", name="document_ids", value=doc.id),
+            cls="document-item uk-flex uk-flex-middle",
+            hx_swap_oob="beforeend:#documents-container"
+        ),
+        id="upload-status"
+    )
+
+def _element_exists(floorplan_id, element_id):
+    return bool(elements(where="floorplan_id=? AND element_id=?", where_args=(floorplan_id, element_id), limit=1))
+
+# Resumable uploads
+
+def _committed(parts):
+    """Number of parts stored without a gap from the first"""
+    count = 0
+    while count + 1 in parts: count += 1
+    return count
+
+def _status(session, document_id=None, challenge=None):
+    parts = {int(n): etag for n, etag in json.loads(session.parts).items()}
+    offset = min(session.size, _committed(parts) * PART_SIZE)
+    return JSONResponse({"token": session.id, "offset": offset, "size": session.size, "part_size": PART_SIZE,
+                         "document_id": document_id, "challenge": challenge},
+                        headers={"Upload-Offset": str(offset), "Cache-Control": "no-store"})
+
+async def _drop_session(session):
+    await abort_multipart_upload_async(session.s3_key, session.upload_id)
+    document_uploads.delete(session.id)
+    _hashes.pop(session.id, None)
+
+def _unattached_documents(cutoff):
+    """Ids of documents uploaded before ``cutoff`` that no training record references"""
+    attached = {int(doc_id) for (doc_id,) in db.execute(
+        "SELECT DISTINCT j.value FROM training_records t, json_each(t.document_ids) j WHERE json_valid(t.document_ids)")
+        if str(doc_id).isdigit()}
+    return [doc_id for (doc_id,) in db.execute("SELECT id FROM documents WHERE upload_date < ?", (cutoff,))
+            if doc_id not in attached]
+
+# Monotonic time of the last collection of unattached documents in this process
+_documents_collected = None
+
+async def _expire_uploads():
+    """Drop unfinished uploads and documents never attached to a training record"""
+    global _documents_collected
+    cutoff = (datetime.datetime.now() - datetime.timedelta(hours=UPLOAD_EXPIRY_HOURS)).isoformat()
+    for session in document_uploads(where="updated_at < ?", where_args=(cutoff,)):
+        await _drop_session(session)
+    for upload in direct_uploads(where="created_at < ?", where_args=(cutoff,)):
+        if not _referenced(upload.s3_key): await delete_document_async(upload.s3_key)
+        direct_uploads.delete(upload.id)
+    # Reads every training record, so at most once an hour
+    if _documents_collected is None or time.monotonic() - _documents_collected > 3600:
+        _documents_collected = time.monotonic()
+        await release_documents(await asyncio.to_thread(_unattached_documents, cutoff))
+
+def _session(token):
+    found = document_uploads(where="id=?", where_args=(token,), limit=1)
+    return found[0] if found else None
+
+# Sessions receiving data in this process; a second PATCH of the same session is refused
+_active = set()
+# Hash state of sessions at their committed offset, ``{token: (offset, hasher)}``; sessions
+# resumed in another process are hashed by reading the object back once complete
+_hashes = {}
+
+# Open proof-of-possession challenges, ``{token: dict}``; like ``_hashes`` they live in this
+# process, a proof reaching another one is refused and the client uploads the file instead
+_challenges = {}
+
+def _challenge(floorplan_id, element_id, filename, sha256, size, upload_token=None):
+    """Challenge for content the client announced by hash, None if it is not stored.
+    ``upload_token`` is the upload to drop once the client proved it has the content."""
+    sha256 = valid_sha256(sha256)
+    if not (sha256 and stored_document(sha256, size)): return None
+    now = time.monotonic()
+    for token in [token for token, challenge in _challenges.items() if challenge['expires'] < now]:
+        del _challenges[token]
+    length = min(size, CHALLENGE_BYTES)
+    start = secrets.randbelow(size - length + 1)
+    token, nonce = secrets.token_urlsafe(16), secrets.token_hex(16)
+    _challenges[token] = dict(floorplan_id=floorplan_id, element_id=element_id, filename=filename, sha256=sha256,
+                              size=size, nonce=nonce, start=start, end=start + length, upload_token=upload_token,
+                              expires=now + CHALLENGE_EXPIRY)
+    return {"url": f"/document/proofs/{token}", "nonce": nonce, "start": start, "end": start + length}
+
+@ur.post('/element/{floorplan_id}/{element_id}/document/uploads')
+async def start_document_upload(floorplan_id: int, element_id: str, filename: str, size: int, sha256: str = None):
+    """Start a resumable upload of ``size`` bytes, with a challenge if content with ``sha256`` is stored"""
+    try:
+        if not _element_exists(floorplan_id, element_id):
+            return JSONResponse({"error": "Element nicht gefunden"}, status_code=404)
+        if not filename.strip():
+            return JSONResponse({"error": "Keine Datei ausgewählt"}, status_code=400)
+        if not 0 < size <= MAX_DOCUMENT_SIZE:
+            return JSONResponse({"error": f"Dateien dürfen höchstens {MAX_DOCUMENT_SIZE // 1024 // 1024} MB groß sein"},
+                                status_code=413)
+        await _expire_uploads()
+        s3_key = document_key(floorplan_id, element_id, filename)
+        now = datetime.datetime.now().isoformat()
+        session = document_uploads.insert(
+            id=secrets.token_urlsafe(16), floorplan_id=floorplan_id, element_id=element_id,
+            filename=os.path.basename(filename), s3_key=s3_key, upload_id=await create_multipart_upload_async(s3_key),
+            size=size, parts="{}", created_at=now, updated_at=now)
+        return _status(session, challenge=_challenge(floorplan_id, element_id, filename, sha256, size, session.id))
+    except Exception as e:
+        return JSONResponse({"error": f"Fehler beim Starten des Uploads: {str(e)}"}, status_code=500)
+
+@ur.get('/document/uploads/{token}')
+def document_upload_status(token: str):
+    """Offset to resume the upload from"""
+    session = _session(token)
+    if not session: return JSONResponse({"error": "Upload nicht gefunden"}, status_code=404)
+    return _status(session)
+
+@ur.patch('/document/uploads/{token}')
+async def continue_document_upload(request, token: str):
+    """Stream the request body into the upload, starting at the ``Upload-Offset`` header"""
+    session = _session(token)
+    if not session: return JSONResponse({"error": "Upload nicht gefunden"}, status_code=404)
+    if token in _active: return JSONResponse({"error": "Upload läuft bereits"}, status_code=409)
+    parts = {int(n): etag for n, etag in json.loads(session.parts).items()}
+    offset = min(session.size, _committed(parts) * PART_SIZE)
+    if request.headers.get('upload-offset') != str(offset):
+        # The client continues from the offset in this response
+        response = _status(session)
+        response.status_code = 409
+        return response
+    _active.add(token)
+    # Hashing continues from the committed offset if this process saw the bytes before it
+    stored_offset, hasher = _hashes.pop(token, (0, None))
+    if offset == 0: hasher = hashlib.sha256()
+    elif stored_offset != offset: hasher = None
+    uploader = PartUploader(session.s3_key, session.upload_id, first_part=_committed(parts) + 1, parts=parts,
+                            hasher=hasher)
+    received, error = offset, None
+    try:
+        async for chunk in request.stream():
+            if received + len(chunk) > session.size: raise UploadError("Mehr Daten als angekündigt")
+            received += len(chunk)
+            await uploader.write(chunk)
+        await uploader.finish(last=received == session.size)
+    except ClientDisconnect:
+        # Keep what was stored; the client resumes from the committed offset
+        await asyncio.gather(*uploader.tasks, return_exceptions=True)
+    except Exception as e:
+        await asyncio.gather(*uploader.tasks, return_exceptions=True)
+        error = e
+    finally:
+        _active.discard(token)
+        committed = _committed(uploader.parts)
+        if hasher and committed == uploader.next_part - 1:
+            _hashes[token] = (min(session.size, committed * PART_SIZE), hasher)
+        session.parts = json.dumps(uploader.parts)
+        session.updated_at = datetime.datetime.now().isoformat()
+        document_uploads.update(session)
+    if error is not None:
+        status = 400 if isinstance(error, UploadError) else 502
+        return JSONResponse({"error": f"Fehler beim Hochladen: {str(error)}"}, status_code=status)
+    if received < session.size: return _status(session)
+    try:
+        await complete_multipart_upload_async(session.s3_key, session.upload_id, uploader.parts)
+        _, hasher = _hashes.pop(token, (None, None))
+        sha256 = hasher.hexdigest() if hasher else await document_sha256_async(session.s3_key)
+        doc = await store_upload(session.floorplan_id, session.element_id, session.filename, session.s3_key,
+                                 sha256, session.size)
+        document_uploads.delete(token)
+        return _status(session, document_id=doc.id)
+    except Exception as e:
+        return JSONResponse({"error": f"Fehler beim Abschließen des Uploads: {str(e)}"}, status_code=502)
+
+@ur.delete('/document/uploads/{token}')
+async def cancel_document_upload(token: str):
+    session = _session(token)
+    if session: await _drop_session(session)
+    _hashes.pop(token, None)
+    return JSONResponse({"token": token, "cancelled": True})
+
+@ur.post('/document/proofs/{token}')
+async def prove_document(token: str, proof: str):
+    """Add the document of a challenge if ``proof`` is the SHA-256 of its nonce and byte range"""
+    challenge = _challenges.pop(token, None)
+    if not challenge or challenge['expires'] < time.monotonic():
+        return JSONResponse({"error": "Nachweis abgelaufen"}, status_code=404)
+    async with _content_lock(challenge['sha256']):
+        existing = stored_document(challenge['sha256'], challenge['size'])
+        if not existing: return JSONResponse({"error": "Inhalt nicht mehr vorhanden"}, status_code=409)
+        try:
+            data = await document_range_async(existing.s3_key, challenge['start'], challenge['end'])
+        except Exception as e:
+            return JSONResponse({"error": f"Fehler beim Prüfen: {str(e)}"}, status_code=502)
+        expected = hashlib.sha256(bytes.fromhex(challenge['nonce']) + data).hexdigest()
+        if not hmac.compare_digest(expected, (proof or '').strip().lower()):
+            return JSONResponse({"error": "Nachweis ungültig"}, status_code=403)
+        doc = add_document(challenge['floorplan_id'], challenge['element_id'], challenge['filename'],
+                           existing.s3_key, challenge['sha256'], challenge['size'])
+    session = challenge['upload_token'] and _session(challenge['upload_token'])
+    if session: await _drop_session(session)
+    return JSONResponse({"document_id": doc.id}, headers={"Cache-Control": "no-store"})
+
+# Direct uploads to the bucket
+
+@ur.post('/element/{floorplan_id}/{element_id}/document/presign')
+async def presign_document_upload(floorplan_id: int, element_id: str, filename: str, size: int, sha256: str = None):
+    """Presigned POST policy for uploading one document of ``size`` bytes straight to the bucket.
+    With ``sha256`` the upload must have that content; if the content is stored, a challenge
+    comes with the policy, and the upload is not needed once it is answered."""
+    if not DIRECT_UPLOADS:
+        return JSONResponse({"error": "Direkte Uploads sind deaktiviert"}, status_code=404)
+    if not _element_exists(floorplan_id, element_id):
+        return JSONResponse({"error": "Element nicht gefunden"}, status_code=404)
+    if not filename.strip():
+        return JSONResponse({"error": "Keine Datei ausgewählt"}, status_code=400)
+    if not 0 < size <= MAX_DOCUMENT_SIZE:
+        return JSONResponse({"error": f"Dateien dürfen höchstens {MAX_DOCUMENT_SIZE // 1024 // 1024} MB groß sein"},
+                            status_code=413)
+    s3_key = document_key(floorplan_id, element_id, filename)
+    try:
+        await _expire_uploads()
+        policy = await generate_presigned_document_post_async(s3_key, size, PRESIGN_EXPIRY, valid_sha256(sha256))
+        upload = direct_uploads.insert(id=secrets.token_urlsafe(16), floorplan_id=floorplan_id, element_id=element_id,
+                                       filename=os.path.basename(filename), s3_key=s3_key, size=size,
+                                       created_at=datetime.datetime.now().isoformat())
+    except Exception as e:
+        return JSONResponse({"error": f"Fehler beim Vorbereiten des Uploads: {str(e)}"}, status_code=500)
+    return JSONResponse({"url": policy['url'], "fields": policy['fields'], "token": upload.id,
+                         "challenge": _challenge(floorplan_id, element_id, filename, sha256, size)},
+                        headers={"Cache-Control": "no-store"})
+
+@ur.post('/element/{floorplan_id}/{element_id}/document/complete')
+async def complete_direct_upload(floorplan_id: int, element_id: str, token: str):
+    """Register a document the browser uploaded straight to the bucket with the policy of ``token``"""
+    try:
+        # Only keys issued by presign_document_upload for this element; they are moved to their content key here
+        found = direct_uploads(where="id=? AND floorplan_id=? AND element_id=?",
+                               where_args=(token, floorplan_id, element_id), limit=1)
+        if not found or _referenced(found[0].s3_key):
+            return Div("Ungültiger Upload", cls="error-message", id="upload-status")
+        upload = found[0]
+        if not _element_exists(floorplan_id, element_id):
+            return Div("Element nicht gefunden", cls="error-message", id="upload-status")
+        info = await document_info_async(upload.s3_key)
+        if not info:
+            return Div("Die Datei ist nicht im Speicher angekommen", cls="error-message", id="upload-status")
+        size, sha256 = info
+        # S3 verified the checksum announced with the policy; without one the object is read back
+        sha256 = sha256 or await document_sha256_async(upload.s3_key)
+        doc = await store_upload(floorplan_id, element_id, upload.filename, upload.s3_key, sha256, size)
+        direct_uploads.delete(upload.id)
+        return uploaded_document_item(floorplan_id, element_id, doc)
+    except Exception as e:
+        return Div(f"Fehler beim Hochladen: {str(e)}", cls="uk-alert uk-alert-danger", id="upload-status")
+
+@ur.get('/element/{floorplan_id}/{element_id}/document/{doc_id}/uploaded')
+def uploaded_document(floorplan_id: int, element_id: str, doc_id: int):
+    """Upload status fragment of a finished resumable upload"""
+    found = documents(where="id=? AND floorplan_id=? AND element_id=?",
+                      where_args=(doc_id, floorplan_id, element_id), limit=1)
+    if not found: return Div("Dokument nicht gefunden", cls="error-message", id="upload-status")
+    return uploaded_document_item(floorplan_id, element_id, found[0])
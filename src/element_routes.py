@@ -3,14 +3,16 @@ Routes for element-related functionality including:
 - Risk assessments
 - Operating instructions
 - Training records
-- Document uploads
+- Document uploads and downloads
 """
 from fasthtml.common import *
 from monsterui.all import *
 import json
 import datetime
 import os
-from src.db import elements, risk_assessments, operating_instructions, training_records, documents
+from src.db import db, write_transaction, elements, risk_assessments, operating_instructions, training_records, documents
+from src.search_index import index_element, index_record, unindex_record
+from src.notifications import refresh_element_notifications
 from src.components.element_modals import (
     risk_assessment_modal, 
     risk_assessment_form,
@@ -18,7 +20,8 @@ from src.components.element_modals import (
     training_records_modal,
     training_record_form
 )
-from src.s3 import upload_document_to_s3
+from src.document_uploads import upload_file, uploaded_document_item, release_documents
+from src.s3 import document_url
 from src.components.element_modals import modal_wrapper
 
 # Initialize APIRouter
@@ -41,7 +44,9 @@ def update_element_basic(floorplan_id: int, element_id: str, name: str, descript
         element.name = name
         element.description = description
         element.updated_at = datetime.datetime.now().isoformat()
-        elements.update(element)
+        with write_transaction():
+            elements.update(element)
+            index_element(db, element.id)
         
         # Return success message
         return Div(
@@ -69,13 +74,13 @@ def add_form_item(floorplan_id: int, element_id: str, item_type: str):
                         Option("Reizend", value="GHS07"),
                         Option("Gesundheitsgefährdend", value="GHS08"),
                         Option("Umweltgefährlich", value="GHS09"),
-                        name="hazard_symbols[]",
+                        name="hazard_symbols",
                         cls="uk-select"
                     ),
                     cls="uk-width-1-4"
                 ),
                 Div(
-                    Input(type="text", name="hazard_texts[]", cls="uk-input", placeholder="Beschreibung"),
+                    Input(type="text", name="hazard_texts", cls="uk-input", placeholder="Beschreibung"),
                     cls="uk-width-3-4"
                 ),
                 Button("×", cls="uk-button uk-button-small uk-button-danger", 
@@ -98,13 +103,13 @@ def add_form_item(floorplan_id: int, element_id: str, item_type: str):
                         Option("Atemschutz", value="P103"),
                         Option("Gehörschutz", value="P104"),
                         Option("Schutzkleidung", value="P105"),
-                        name="protection_symbols[]",
+                        name="protection_symbols",
                         cls="uk-select"
                     ),
                     cls="uk-width-1-4"
                 ),
                 Div(
-                    Input(type="text", name="protection_texts[]", cls="uk-input", placeholder="Beschreibung"),
+                    Input(type="text", name="protection_texts", cls="uk-input", placeholder="Beschreibung"),
                     cls="uk-width-3-4"
                 ),
                 Button("×", cls="uk-button uk-button-small uk-button-danger", 
@@ -125,13 +130,13 @@ def add_form_item(floorplan_id: int, element_id: str, item_type: str):
                         Option("Erste Hilfe", value="F101"),
                         Option("Augenspülung", value="F102"),
                         Option("Notdusche", value="F103"),
-                        name="first_aid_symbols[]",
+                        name="first_aid_symbols",
                         cls="uk-select"
                     ),
                     cls="uk-width-1-4"
                 ),
                 Div(
-                    Input(type="text", name="first_aid_texts[]", cls="uk-input", placeholder="Anweisung"),
+                    Input(type="text", name="first_aid_texts", cls="uk-input", placeholder="Anweisung"),
                     cls="uk-width-3-4"
                 ),
                 Button("×", cls="uk-button uk-button-small uk-button-danger", 
@@ -153,13 +158,13 @@ def add_form_item(floorplan_id: int, element_id: str, item_type: str):
                         Option("Notausgang", value="E102"),
                         Option("Sammelplatz", value="E103"),
                         Option("Telefon", value="E104"),
-                        name="emergency_symbols[]",
+                        name="emergency_symbols",
                         cls="uk-select"
                     ),
                     cls="uk-width-1-4"
                 ),
                 Div(
-                    Input(type="text", name="emergency_texts[]", cls="uk-input", placeholder="Anweisung"),
+                    Input(type="text", name="emergency_texts", cls="uk-input", placeholder="Anweisung"),
                     cls="uk-width-3-4"
                 ),
                 Button("×", cls="uk-button uk-button-small uk-button-danger", 
@@ -196,11 +201,15 @@ def edit_risk_form(floorplan_id: int, element_id: str, risk_id: int):
     """Show form for editing risk assessment"""
     return risk_assessment_form(floorplan_id, element_id, risk_id)
 
+def count_measures(*measures):
+    """Number of non-empty measures, stored with a risk assessment for the risk dashboard"""
+    return sum(1 for items in measures for item in items if str(item).strip())
+
 @er.post('/element/{floorplan_id}/{element_id}/risk/create')
 def create_risk(floorplan_id: int, element_id: str, description: str, 
                frequency: int, severity: int, probability: int, 
-               element_db_id: int, technical_measures: list = None, 
-               organizational_measures: list = None, personal_measures: list = None):
+               element_db_id: int, technical_measures: list[str] = None, 
+               organizational_measures: list[str] = None, personal_measures: list[str] = None):
     """Create new risk assessment"""
     try:
         # Calculate risk score
@@ -213,19 +222,22 @@ def create_risk(floorplan_id: int, element_id: str, description: str,
         
         # Create new risk assessment
         current_time = datetime.datetime.now().isoformat()
-        risk_assessments.insert(
-            element_id=element_db_id,
-            description=description,
-            frequency=frequency,
-            severity=severity,
-            probability=probability,
-            risk_score=risk_score,
-            technical_measures=json.dumps(technical_measures),
-            organizational_measures=json.dumps(organizational_measures),
-            personal_measures=json.dumps(personal_measures),
-            created_at=current_time,
-            updated_at=current_time
-        )
+        with write_transaction():
+            risk = risk_assessments.insert(
+                element_id=element_db_id,
+                description=description,
+                frequency=frequency,
+                severity=severity,
+                probability=probability,
+                risk_score=risk_score,
+                technical_measures=json.dumps(technical_measures),
+                organizational_measures=json.dumps(organizational_measures),
+                personal_measures=json.dumps(personal_measures),
+                measure_count=count_measures(technical_measures, organizational_measures, personal_measures),
+                created_at=current_time,
+                updated_at=current_time
+            )
+            index_record(db, 'risk', risk.id)
         
         # Return to risk assessment view
         return risk_assessment_modal(floorplan_id, element_id)
@@ -235,8 +247,8 @@ def create_risk(floorplan_id: int, element_id: str, description: str,
 @er.post('/element/{floorplan_id}/{element_id}/risk/update/{risk_id}')
 def update_risk(floorplan_id: int, element_id: str, risk_id: int, description: str, 
                frequency: int, severity: int, probability: int, 
-               element_db_id: int, technical_measures: list = None, 
-               organizational_measures: list = None, personal_measures: list = None):
+               element_db_id: int, technical_measures: list[str] = None, 
+               organizational_measures: list[str] = None, personal_measures: list[str] = None):
     """Update existing risk assessment"""
     try:
         # Get the risk assessment
@@ -265,8 +277,11 @@ def update_risk(floorplan_id: int, element_id: str, risk_id: int, description: s
         risk.technical_measures = json.dumps(technical_measures)
         risk.organizational_measures = json.dumps(organizational_measures)
         risk.personal_measures = json.dumps(personal_measures)
+        risk.measure_count = count_measures(technical_measures, organizational_measures, personal_measures)
         risk.updated_at = datetime.datetime.now().isoformat()
-        risk_assessments.update(risk)
+        with write_transaction():
+            risk_assessments.update(risk)
+            index_record(db, 'risk', risk.id)
         
         # Return to risk assessment view
         return risk_assessment_modal(floorplan_id, element_id)
@@ -287,7 +302,9 @@ def delete_risk(floorplan_id: int, element_id: str, risk_id: int):
             return Div("Element nicht gefunden", cls="error-message")
         
         # Delete the risk assessment
-        risk_assessments.delete(risk_id)
+        with write_transaction():
+            unindex_record(db, 'risk', risk_id)
+            risk_assessments.delete(risk_id)
         
         # Return to risk assessment view
         return risk_assessment_modal(floorplan_id, element_id)
@@ -413,13 +430,13 @@ def edit_instructions_form(floorplan_id: int, element_id: str):
                                 Option("Reizend", value="GHS07", selected=(item.get("symbol")=="GHS07")),
                                 Option("Gesundheitsgefährdend", value="GHS08", selected=(item.get("symbol")=="GHS08")),
                                 Option("Umweltgefährlich", value="GHS09", selected=(item.get("symbol")=="GHS09")),
-                                name="hazard_symbols[]",
+                                name="hazard_symbols",
                                 cls="uk-select"
                             ),
                             cls="uk-width-1-4"
                         ),
                         Div(
-                            Input(type="text", name="hazard_texts[]", value=item.get("text", ""), cls="uk-input"),
+                            Input(type="text", name="hazard_texts", value=item.get("text", ""), cls="uk-input"),
                             cls="uk-width-3-4"
                         ),
                         Button("×", cls="uk-button uk-button-small uk-button-danger", 
@@ -474,10 +491,10 @@ def edit_instructions_form(floorplan_id: int, element_id: str):
 
 @er.post('/element/{floorplan_id}/{element_id}/instructions/create')
 def create_instructions(floorplan_id: int, element_id: str, element_db_id: int,
-                       hazard_symbols: list = None, hazard_texts: list = None,
-                       protection_symbols: list = None, protection_texts: list = None,
-                       first_aid_symbols: list = None, first_aid_texts: list = None,
-                       emergency_symbols: list = None, emergency_texts: list = None,
+                       hazard_symbols: list[str] = None, hazard_texts: list[str] = None,
+                       protection_symbols: list[str] = None, protection_texts: list[str] = None,
+                       first_aid_symbols: list[str] = None, first_aid_texts: list[str] = None,
+                       emergency_symbols: list[str] = None, emergency_texts: list[str] = None,
                        maintenance_disposal: str = ""):
     """Create new operating instructions"""
     try:
@@ -508,16 +525,18 @@ def create_instructions(floorplan_id: int, element_id: str, element_db_id: int,
         
         # Create new instruction
         current_time = datetime.datetime.now().isoformat()
-        operating_instructions.insert(
-            element_id=element_db_id,
-            hazard_symbols=json.dumps(hazard_items),
-            protection_measures=json.dumps(protection_items),
-            first_aid=json.dumps(first_aid_items),
-            emergency_procedures=json.dumps(emergency_items),
-            maintenance_disposal=maintenance_disposal,
-            created_at=current_time,
-            updated_at=current_time
-        )
+        with write_transaction():
+            instruction = operating_instructions.insert(
+                element_id=element_db_id,
+                hazard_symbols=json.dumps(hazard_items),
+                protection_measures=json.dumps(protection_items),
+                first_aid=json.dumps(first_aid_items),
+                emergency_procedures=json.dumps(emergency_items),
+                maintenance_disposal=maintenance_disposal,
+                created_at=current_time,
+                updated_at=current_time
+            )
+            index_record(db, 'instructions', instruction.id)
         
         # Return to operating instructions view
         return operating_instructions_modal(floorplan_id, element_id)
@@ -579,7 +598,9 @@ def update_instructions(floorplan_id: int, element_id: str, element_db_id: int,
         instruction.emergency_procedures = json.dumps(emergency_items)
         instruction.maintenance_disposal = maintenance_disposal
         instruction.updated_at = datetime.datetime.now().isoformat()
-        operating_instructions.update(instruction)
+        with write_transaction():
+            operating_instructions.update(instruction)
+            index_record(db, 'instructions', instruction.id)
         
         # Return to operating instructions view
         return operating_instructions_modal(floorplan_id, element_id)
@@ -613,14 +634,17 @@ def create_training(floorplan_id: int, element_id: str, employee_name: str,
         
         # Create new training record
         current_time = datetime.datetime.now().isoformat()
-        training_records.insert(
-            element_id=element_db_id,
-            employee_name=employee_name,
-            training_name=training_name,
-            training_date=training_date,
-            document_ids=json.dumps(document_ids),
-            created_at=current_time
-        )
+        with write_transaction():
+            record = training_records.insert(
+                element_id=element_db_id,
+                employee_name=employee_name,
+                training_name=training_name,
+                training_date=training_date,
+                document_ids=json.dumps(document_ids),
+                created_at=current_time
+            )
+            index_record(db, 'training', record.id)
+        refresh_element_notifications(element_db_id)
         
         # Return to training records view
         return training_records_modal(floorplan_id, element_id)
@@ -628,7 +652,7 @@ def create_training(floorplan_id: int, element_id: str, employee_name: str,
         return Div(f"Fehler beim Speichern: {str(e)}", cls="error-message")
 
 @er.post('/element/{floorplan_id}/{element_id}/training/update/{record_id}')
-def update_training(floorplan_id: int, element_id: str, record_id: int, 
+async def update_training(floorplan_id: int, element_id: str, record_id: int, 
                    employee_name: str, training_name: str, training_date: str, 
                    element_db_id: int, document_ids: list[int] = None):
     """Update existing training record"""
@@ -649,8 +673,14 @@ def update_training(floorplan_id: int, element_id: str, record_id: int,
         record.employee_name = employee_name
         record.training_name = training_name
         record.training_date = training_date
+        dropped = set(json.loads(record.document_ids or '[]')) - set(document_ids)
         record.document_ids = json.dumps(document_ids)
-        training_records.update(record)
+        def save():
+            training_records.update(record)
+            index_record(db, 'training', record.id)
+        # Documents removed from the record are released in the transaction saving it
+        await release_documents(dropped, save)
+        refresh_element_notifications(element_db_id)
         
         # Return to training records view
         return training_records_modal(floorplan_id, element_id)
@@ -658,7 +688,7 @@ def update_training(floorplan_id: int, element_id: str, record_id: int,
         return Div(f"Fehler beim Speichern: {str(e)}", cls="error-message")
 
 @er.delete('/element/{floorplan_id}/{element_id}/training/{record_id}')
-def delete_training(floorplan_id: int, element_id: str, record_id: int):
+async def delete_training(floorplan_id: int, element_id: str, record_id: int):
     """Delete training record"""
     try:
         # Get element to verify element_id
@@ -670,8 +700,13 @@ def delete_training(floorplan_id: int, element_id: str, record_id: int):
         if not element:
             return Div("Element nicht gefunden", cls="error-message")
         
-        # Delete the training record
-        training_records.delete(record_id)
+        # Delete the training record and its documents
+        record = training_records[record_id]
+        def delete():
+            unindex_record(db, 'training', record_id)
+            training_records.delete(record_id)
+        await release_documents(json.loads(record.document_ids or '[]'), delete)
+        refresh_element_notifications(element.id)
         
         # Return to training records view
         return training_records_modal(floorplan_id, element_id)
@@ -680,7 +715,7 @@ def delete_training(floorplan_id: int, element_id: str, record_id: int):
 
 # Document Upload
 @er.post('/element/{floorplan_id}/{element_id}/document/upload')
-def upload_document(floorplan_id: int, element_id: str, document: dict):
+async def upload_document(floorplan_id: int, element_id: str, document: UploadFile = None):
     """Upload document for training records"""
     try:
         element = elements.fetchone(
@@ -691,42 +726,24 @@ def upload_document(floorplan_id: int, element_id: str, document: dict):
         if not element:
             return Div("Element nicht gefunden", cls="error-message", id="upload-status")
         
-        if not document or not document.get('filename'):
+        if not document or not document.filename:
             return Div("Keine Datei ausgewählt", cls="uk-alert uk-alert-warning", id="upload-status")
         
-        # Generate a unique filename
-        file_ext = os.path.splitext(document['filename'])[1]
-        s3_key = f"documents/{floorplan_id}/{element_id}/{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}{file_ext}"
+        # Store by content hash, streamed to S3 part by part unless the content is stored already
+        doc = await upload_file(floorplan_id, element_id, document)
         
-        # Upload file to S3
-        upload_success = upload_document_to_s3(document['content'], s3_key)
-        
-        if not upload_success:
-            return Div("Fehler beim Hochladen der Datei", cls="uk-alert uk-alert-danger", id="upload-status")
-        
-        # Save document reference in database
-        doc = documents.insert(
-            floorplan_id=floorplan_id,
-            element_id=element_id,
-            filename=document['filename'],
-            s3_key=s3_key,
-            upload_date=datetime.datetime.now().isoformat()
-        )
-        
-        # Return success with document info
-        return Div(
-            Div(f"Datei hochgeladen: {document['filename']}", cls="uk-alert uk-alert-success"),
-            Div(
-                Span(f"Dokument: {document['filename']}"),
-                Button("×", cls="uk-button uk-button-small uk-button-danger",
-                      hx_get=f"/element/{floorplan_id}/{element_id}/remove-form-item",
-                      hx_target="closest .document-item",
-                      hx_swap="outerHTML"),
-                Input(type="hidden", name="document_ids[]", value=doc.id),
-                cls="document-item uk-flex uk-flex-middle",
-                hx_swap_oob="beforeend:#documents-container"
-            ),
-            id="upload-status"
-        )
+        return uploaded_document_item(floorplan_id, element_id, doc)
     except Exception as e:
         return Div(f"Fehler beim Hochladen: {str(e)}", cls="uk-alert uk-alert-danger", id="upload-status")
+
+# Document Download
+@er.get('/document/{doc_id}')
+def download_document(doc_id: int):
+    """Redirect to a presigned URL of the document; URLs are cached per document in src.s3"""
+    found = documents(where="id=?", where_args=(doc_id,), limit=1)
+    if not found:
+        return Response("Dokument nicht gefunden", status_code=404)
+    url = document_url(found[0].s3_key)
+    if not url:
+        return Response("Dokument ist nicht verfügbar", status_code=502)
+    return RedirectResponse(url, status_code=302, headers={"Cache-Control": "no-store"})
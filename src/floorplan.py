@@ -3,7 +3,22 @@ from monsterui.all import *
 import json
 from pathlib import Path
 import datetime
-from src.db import floorplans, elements
+from email.utils import format_datetime, parsedate_to_datetime
+from src.db import db, floorplans, elements, write_transaction
+from src.plan_elements import (load_elements, load_elements_by_id, replace_elements, upsert_elements,
+                                delete_elements, query_bbox, element_bbox, query_tile, count_elements)
+from src.plan_revisions import (diff_elements, record_revision, list_revisions, load_revision,
+                                three_way_merge, patch_conflicts)
+from src.plan_codec import CodecUnavailable
+from src.plan_render import FORMATS, RenderError, RenderUnavailable, cached_render, clear_cache
+from src.thumbnails import refresh_thumbnails, thumbnail_url
+from src.risk_heatmap import risk_stamp, cached_heatmap
+from src.search_index import index_element, unindex_element
+from src.notifications import refresh_element_notifications
+from src.document_uploads import delete_floorplan_documents
+from src.maintenance import (UNITS, MAX_INTERVAL, RecurrenceError, parse_schedule, schedule_label, to_date,
+                             validate_recurrence, apply_recurrence)
+import math
 
 # Initialize FastHTML ar with blue theme
 ar = APIRouter()
@@ -48,7 +63,6 @@ def initialize_floorplan(sess, name: str, width: float, height: float):
         name=name,
         width=float(width),
         height=float(height),
-        data="[]",
         created_at=current_time,
         updated_at=current_time)
     
@@ -56,18 +70,59 @@ def initialize_floorplan(sess, name: str, width: float, height: float):
     return Redirect(f"/edit-floorplan/{floorplan.id}")
 
 # Load existing floor plans
+# The overview lists plans a page at a time, sorted by one of these columns with
+# id as tie-breaker; each page continues after the last row of the previous one
+FLOORPLAN_SORTS = ("updated_at", "name")
+FLOORPLAN_PAGE_SIZE = 50
 
+def list_floorplans(user_id, sort="updated_at", descending=True, search=None, after=None, after_id=None,
+                    limit=FLOORPLAN_PAGE_SIZE):
+    """Summary rows of a user's floor plans without the ``data`` document, one keyset page.
+    Pass the sort value and id of the last row of a page as ``after``/``after_id`` for the next."""
+    if sort not in FLOORPLAN_SORTS: raise ValueError(f"Unknown sort column {sort!r}")
+    sql = "SELECT id, name, width, height, updated_at, revision FROM floorplans WHERE user_id=?"
+    args = [user_id]
+    if search:
+        sql += " AND name LIKE ? ESCAPE '\\'"
+        args.append("%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    if after_id is not None:
+        sql += f" AND ({sort}, id) {'<' if descending else '>'} (?, ?)"
+        args += [after, after_id]
+    direction = "DESC" if descending else "ASC"
+    return db.q(sql + f" ORDER BY {sort} {direction}, id {direction} LIMIT ?", (*args, limit))
 
 
-def editor(floorplan_id: int, width, height, data):
+
+# Plans with more elements than this are not inlined into the page;
+# tiles.js fetches the tiles covering the visible area instead
+INLINE_ELEMENT_LIMIT = 2000
+# Tile edge in metres at zoom 0, halved with every zoom level
+TILE_SIZE = 4096.0
+MAX_TILE_ZOOM = 12
+# Tiles are picked to be about this many pixels wide on screen; elements
+# smaller than one pixel of a tile are left out of it
+TILE_PIXELS = 256
+
+def editor_data(floorplan_id):
+    """Elements JSON to inline into the page, or None if the plan is loaded per tile"""
+    if count_elements(db, floorplan_id) > INLINE_ELEMENT_LIMIT: return None
+    return json.dumps(load_elements(db, floorplan_id))
+
+def editor(floorplan_id: int, width, height, data, revision=0):
+    tiled = data is None
     return Div(
             Div(
                 Canvas(
                     width=900, height=800, id="floorplan-canvas",
                     data_floorplan_id=floorplan_id,
                     data_floorplan_elements=data,
+                    data_revision=revision,
                     data_width=width,
-                    data_height=height
+                    data_height=height,
+                    data_tiled="true" if tiled else None,
+                    data_tile_size=TILE_SIZE if tiled else None,
+                    data_tile_pixels=TILE_PIXELS if tiled else None,
+                    data_max_tile_zoom=MAX_TILE_ZOOM if tiled else None
                 ),
                 cls=""
             ),
@@ -80,10 +135,18 @@ def floorplan_properties():
     
 def controls(floorplan_id:int):
     return DivHStacked(
-            Button("Speichern", hx_post=f'/save_floorplan/{floorplan_id}', hx_target="#save-status", hx_vals="js:{elements: JSON.stringify(currentState.elements)}"),
+            # saveFloorplan() (core.js) sends a patch and falls back to the full save route
+            Button("Speichern", onclick="saveFloorplan()", submit=False),
             Button("Als PNG exportieren", id="export-png"),
+            A("Als PDF exportieren", href=f"/floorplan/{floorplan_id}/render/pdf", target="_blank",
+              cls="uk-button uk-button-default"),
+            # heatmap.js draws the risk density over the plan
+            Button("Risiko-Heatmap", id="heatmap-toggle", onclick="toggleHeatmap()", submit=False),
+            Button("Versionen", hx_get=f"/floorplan_editor/{floorplan_id}/revisions",
+                   hx_target="#revision-history", hx_swap="outerHTML", submit=False),
             A("Zurück zur Startseite", href='/', hx_target="#main-content"),
-            Div(id="save-status"))
+            Div(id="save-status"),
+            Div(id="collab-presence", cls="collab-presence"))
     
     
 def tools():
@@ -117,9 +180,7 @@ def get_element_properties(floorplan_id: int, element_id: str):
         if not props:
             return Div("Element nicht gefunden", cls="error-message")
         
-        special_types = ["machine", "closet", "emergency-kit"]
-        
-        if props.element_type in special_types:
+        if props.element_type in SPECIAL_TYPES:
             return Div(
                 Card(
                     H4("Eigenschaften"),
@@ -175,75 +236,293 @@ def get_element_properties(floorplan_id: int, element_id: str):
         return Div(f"Fehler beim Laden der Eigenschaften: {str(e)}", cls="error-message")
 
 
+def _bump_revision(floorplan_id, timestamp, base_revision=None):
+    """Advance the revision of a floor plan. Returns the new revision, or None if the
+    floor plan is missing or no longer at ``base_revision``. Call inside write_transaction()."""
+    sql = "UPDATE floorplans SET updated_at=?, revision=revision+1 WHERE id=?"
+    args = [timestamp, floorplan_id]
+    if base_revision is not None:
+        sql += " AND revision=?"
+        args.append(base_revision)
+    row = db.execute(sql + " RETURNING revision", args).fetchall()
+    return row[0][0] if row else None
+
+def write_floorplan(floorplan_id, elements_data, base_revision=None):
+    """Replace all elements of a floor plan and reconcile the element rows in one transaction.
+    Returns the new revision, or None if the floor plan is missing or no longer at
+    ``base_revision`` (when given)."""
+    current_time = datetime.datetime.now().isoformat()
+    with write_transaction():
+        revision = _bump_revision(floorplan_id, current_time, base_revision)
+        if revision is None: return None
+        before = load_elements(db, floorplan_id)
+        replace_elements(db, floorplan_id, elements_data)
+        # Diff what is actually stored, so history matches what the plan loads as
+        after = load_elements(db, floorplan_id)
+        upserts, deletes, order = diff_elements(before, after)
+        record_revision(db, floorplan_id, revision, current_time, upserts, deletes, order, current=after)
+        # Process special elements (machine, closet, emergency-kit)
+        save_special_elements(floorplan_id, elements_data, current_time)
+    return revision
+
+def write_floorplan_patch(floorplan_id, patch, base_revision, merge_into=None):
+    """Apply ``{"add": [...], "update": [...], "delete": [ids]}`` element operations in one transaction.
+    Only the touched rows are written. Returns the new revision, or None if the floor plan
+    is missing or no longer at ``base_revision``. With ``merge_into``, the history row of
+    that revision is replaced by one covering both, if nothing was saved in between."""
+    changed = patch.get("add", []) + patch.get("update", [])
+    if any(not element.get("id") for element in changed):
+        raise ValueError("Element ohne ID im Patch")
+    current_time = datetime.datetime.now().isoformat()
+    with write_transaction():
+        revision = _bump_revision(floorplan_id, current_time, base_revision)
+        if revision is None: return None
+        delete_elements(db, floorplan_id, patch.get("delete", []))
+        upsert_elements(db, floorplan_id, changed)
+        changed_ids = list(dict.fromkeys(element["id"] for element in changed))
+        stored = load_elements_by_id(db, floorplan_id, changed_ids)
+        record_revision(db, floorplan_id, revision, current_time,
+                        [stored[element_id] for element_id in changed_ids], patch.get("delete", []),
+                        merge_into=merge_into)
+        # Only the touched elements' rows can have changed
+        save_special_elements(floorplan_id, changed, current_time, changed_ids + patch.get("delete", []))
+    return revision
+
+# Concurrent edits: a save based on an older revision is merged element by element
+# with what was saved since, as long as both sides did not change the same element.
+def merge_floorplan(floorplan_id, elements_data, base_revision):
+    """Full-document save written against ``base_revision``.
+    Returns ``(revision, merged, conflicts)``: the new revision or None, whether later saves
+    were merged in, and the conflicting element ids (None if ``base_revision`` is no longer
+    in the history, so nothing could be merged)."""
+    with write_transaction():
+        row = db.execute("SELECT revision FROM floorplans WHERE id=?", (floorplan_id,)).fetchone()
+        if not row: return None, False, []
+        if row[0] == base_revision:
+            return write_floorplan(floorplan_id, elements_data, base_revision), False, []
+        base = load_revision(db, floorplan_id, base_revision)
+        if base is None: return None, False, None
+        merged, conflicts = three_way_merge(base, elements_data, load_elements(db, floorplan_id))
+        if conflicts: return None, False, conflicts
+        return write_floorplan(floorplan_id, merged, row[0]), True, []
+
+def merge_floorplan_patch(floorplan_id, patch, base_revision):
+    """Apply a patch written against an older ``base_revision`` on top of the current plan.
+    Returns ``(revision, changes, conflicts)``: the new revision or None, the
+    ``{"upsert", "delete"}`` changes saved by others since ``base_revision`` for the client
+    to catch up with, and the conflicting element ids (None if ``base_revision`` is no longer
+    in the history)."""
+    with write_transaction():
+        row = db.execute("SELECT revision FROM floorplans WHERE id=?", (floorplan_id,)).fetchone()
+        if not row: return None, None, []
+        base = load_revision(db, floorplan_id, base_revision)
+        if base is None: return None, None, None
+        current = load_elements(db, floorplan_id)
+        conflicts = patch_conflicts(base, current, patch.get("add", []) + patch.get("update", []),
+                                    patch.get("delete", []))
+        if conflicts: return None, None, conflicts
+        revision = write_floorplan_patch(floorplan_id, patch, row[0])
+        upserts, deletes, _ = diff_elements(base, current)
+        return revision, {"upsert": upserts, "delete": deletes}, []
+
 # Save floor plan
 @ar.post("/save_floorplan/{floorplan_id}")
-def save_floorplan(floorplan_id: int, elements: str = "[]"):
+def save_floorplan(floorplan_id: int, elements: str = "[]", base_revision: int = None):
+    """Full-document save; the editor falls back to this when a patch cannot be applied.
+    Without ``base_revision`` the stored plan is overwritten unconditionally."""
     try:
-        # Get the current floorplan
-        print(f'saving floorplan {floorplan_id} with elements: {elements}')
-        db_floorplan = floorplans(where='id=?', where_args=(floorplan_id,))
-        if not db_floorplan:
+        print(f'saving floorplan {floorplan_id} ({len(elements)} bytes)')
+        merged = False
+        if base_revision is None:
+            revision = write_floorplan(floorplan_id, json.loads(elements))
+        else:
+            revision, merged, conflicts = merge_floorplan(floorplan_id, json.loads(elements), base_revision)
+            if conflicts is None:
+                raise ValueError("Der Grundriss wurde zwischenzeitlich geändert, bitte neu laden")
+            if conflicts:
+                raise ValueError(f"{len(conflicts)} Element(e) wurden zwischenzeitlich anderweitig geändert, bitte neu laden")
+        if revision is None:
             raise ValueError("Floorplan not found")
-        else: db_floorplan = db_floorplan[0]
-        # Update elements and timestamp
-        current_time = datetime.datetime.now().isoformat()
-        db_floorplan.data = elements
-        db_floorplan.updated_at = current_time
-        floorplans.update(db_floorplan)
-        print(f'floorplan {floorplan_id} updated')
-        # Process special elements (machine, closet, emergency-kit)
-        save_special_elements(floorplan_id, json.loads(elements), current_time)
+        print(f'floorplan {floorplan_id} updated to revision {revision}{" (merged)" if merged else ""}')
         
-        return Div("Grundriss erfolgreich gespeichert", cls="success-message", id='save-status', hx_swap="delete", hx_target='save-status', hx_trigger='every 20s')
+        return (Div("Grundriss erfolgreich gespeichert", cls="success-message", id='save-status', hx_swap="delete", hx_target='save-status', hx_trigger='every 20s'),
+                HttpHeader('X-Floorplan-Revision', str(revision)),
+                BackgroundTask(refresh_thumbnails, floorplan_id),
+                *([HttpHeader('X-Floorplan-Merged', '1')] if merged else []))
     except Exception as e:
         return Div(f"Fehler beim Speichern des Grundrisses: {str(e)}", cls="error-message", id='save-status', hx_swap="delete", hx_target='save-status', hx_trigger='every 20s')
 
-def save_special_elements(floorplan_id, elements_data, timestamp):
-    # Types that require special safety handling
-    special_types = ["machine", "closet", "emergency-kit"]
-    
+@ar.post("/save_floorplan/{floorplan_id}/patch")
+def patch_floorplan(floorplan_id: int, patch: str, base_revision: int):
+    """Apply element add/update/delete operations to the stored plan and return the new revision"""
+    try:
+        patch_data = json.loads(patch)
+        revision = write_floorplan_patch(floorplan_id, patch_data, base_revision)
+        if revision is not None:
+            print(f'floorplan {floorplan_id} patched to revision {revision}')
+            return JSONResponse({"revision": revision}, background=BackgroundTask(refresh_thumbnails, floorplan_id))
+        # Someone else saved in the meantime
+        revision, changes, conflicts = merge_floorplan_patch(floorplan_id, patch_data, base_revision)
+        if revision is not None:
+            print(f'floorplan {floorplan_id} patched to revision {revision} (merged)')
+            return JSONResponse({"revision": revision, "changes": changes},
+                                background=BackgroundTask(refresh_thumbnails, floorplan_id))
+        row = db.execute("SELECT revision FROM floorplans WHERE id=?", (floorplan_id,)).fetchone()
+        if not row:
+            return JSONResponse({"error": "Floorplan not found"}, status_code=404)
+        return JSONResponse({"error": "Revision conflict", "revision": row[0], "conflicts": conflicts}, status_code=409)
+    except CodecUnavailable as e:
+        return JSONResponse({"error": str(e)}, status_code=501)
+    except Exception as e:
+        return JSONResponse({"error": f"Fehler beim Speichern des Grundrisses: {str(e)}"}, status_code=400)
+
+# Revision history ("Versionen" on the edit page)
+@ar.get('/floorplan_editor/{floorplan_id}/revisions')
+def revision_history(floorplan_id: int):
+    revisions = list_revisions(db, floorplan_id)
+    if not revisions:
+        return Div("Keine früheren Versionen vorhanden", id="revision-history")
+    rows = [Tr(
+                Td(f"Version {r['revision']}"),
+                Td(datetime.datetime.fromisoformat(r['created_at']).strftime("%d.%m.%Y %H:%M")),
+                Td(f"{r['changes']} Elemente" if r['kind'] == 'keyframe' else f"{r['changes']} Änderungen"),
+                Td(Button("Wiederherstellen",
+                          hx_post=f"/floorplan_editor/{floorplan_id}/revisions/{r['revision']}/restore",
+                          hx_confirm=f"Version {r['revision']} wiederherstellen? Nicht gespeicherte Änderungen gehen verloren.",
+                          hx_target="#save-status", hx_swap="outerHTML", cls=ButtonT.default))
+            ) for r in revisions]
+    return Div(
+        Table(
+            Thead(Tr(Th("Version"), Th("Gespeichert"), Th("Umfang"), Th("Aktionen"))),
+            Tbody(*rows)
+        ),
+        id="revision-history")
+
+@ar.post('/floorplan_editor/{floorplan_id}/revisions/{revision}/restore')
+def restore_revision(floorplan_id: int, revision: int):
+    """Save a past revision as the newest one; the history itself is kept"""
+    try:
+        elements_data = load_revision(db, floorplan_id, revision)
+        if elements_data is None:
+            return Div(f"Version {revision} ist nicht mehr verfügbar", cls="error-message", id='save-status')
+        new_revision = write_floorplan(floorplan_id, elements_data)
+        if new_revision is None:
+            return Div("Grundriss nicht gefunden", cls="error-message", id='save-status')
+        print(f'floorplan {floorplan_id} restored revision {revision} as revision {new_revision}')
+        return Redirect(f"/edit-floorplan/{floorplan_id}")
+    except Exception as e:
+        return Div(f"Fehler beim Wiederherstellen: {str(e)}", cls="error-message", id='save-status')
+
+# Types that require special safety handling
+SPECIAL_TYPES = ["machine", "closet", "emergency-kit"]
+
+# Tables holding rows that belong to an elements row (keyed by elements.id)
+ELEMENT_DEPENDENT_TABLES = ["risk_assessments", "operating_instructions", "training_records"]
+
+def save_special_elements(floorplan_id, elements_data, timestamp, element_ids=None):
+    """Reconcile the elements table with the special elements of a saved plan.
+
+    Existing rows are loaded with one query and diffed against the submitted
+    plan; inserts, updates and deletes are then applied with executemany.
+    Elements removed from the canvas are deleted together with their risk
+    assessments, operating instructions and training records. With
+    ``element_ids`` (the elements a patch touched) only their rows are
+    reconciled and ``elements_data`` holds those still on the canvas. Callers
+    are expected to wrap this in write_transaction().
+    """
+    submitted = {}
     for element in elements_data:
-        if element.get("element_type") not in special_types:
-            print(f'not saving element {element.get("id")} {element.get("element_type")}')
-            continue
-        element_id = element.get("id")
-        element_type = element.get("element_type")
-        
-        # Check if element already exists in the elements table
-        existing = elements(
-            where="floorplan_id=? AND element_id=?",
-            where_args=(floorplan_id, element_id)
+        if element.get("element_type") in SPECIAL_TYPES and element.get("id"):
+            submitted[element["id"]] = element["element_type"]
+    
+    sql, args = "SELECT element_id, id FROM elements WHERE floorplan_id=?", [floorplan_id]
+    if element_ids is not None:
+        element_ids = list(dict.fromkeys(element_ids))
+        if not element_ids: return
+        sql += f" AND element_id IN ({', '.join('?' * len(element_ids))})"
+        args += element_ids
+    existing = dict(db.execute(sql, args).fetchall())
+    
+    to_insert = [
+        (floorplan_id, element_id, element_type, f"New {element_type.title()}",
+         "", "", "", "[]", "", None, timestamp, timestamp)
+        for element_id, element_type in submitted.items() if element_id not in existing
+    ]
+    to_update = [(timestamp, existing[element_id]) for element_id in submitted if element_id in existing]
+    to_delete = [(row_id,) for element_id, row_id in existing.items() if element_id not in submitted]
+    
+    if to_insert:
+        db.conn.executemany(
+            """INSERT INTO elements (floorplan_id, element_id, element_type, name, description, dangers,
+               safety_instructions, trained_employees, maintenance_schedule, last_maintenance,
+               created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            to_insert
         )
-        
-        if existing:
-            # Element exists, just update the timestamp
-            existing = existing[0]
-            print(f"Updating existing element: {element_id}, {element_type}")
-            existing.updated_at = timestamp
-            elements.update(existing)
-        else:
-            # Create new element with default values
-            print(f"Creating new element: {element_id}, {element_type}")
-            elements.insert(
-                floorplan_id=floorplan_id,
-                element_id=element_id,
-                element_type=element_type,
-                name=f"New {element_type.title()}",
-                description="",
-                dangers="",
-                safety_instructions="",
-                trained_employees="[]",
-                maintenance_schedule="",
-                last_maintenance=None,
-                created_at=timestamp,
-                updated_at=timestamp
-            )
+        # New elements get their search index rows
+        for element_id, row_id in db.execute(sql, args).fetchall():
+            if element_id not in existing: index_element(db, row_id)
+    if to_update:
+        db.conn.executemany("UPDATE elements SET updated_at=? WHERE id=?", to_update)
+    if to_delete:
+        for (row_id,) in to_delete:
+            unindex_element(db, row_id)
+        for table in ELEMENT_DEPENDENT_TABLES:
+            db.conn.executemany(f"DELETE FROM {table} WHERE element_id=?", to_delete)
+        db.conn.executemany("DELETE FROM elements WHERE id=?", to_delete)
+    print(f"floorplan {floorplan_id} elements: {len(to_insert)} new, {len(to_update)} updated, {len(to_delete)} deleted")
             
 
-@ar.delete("/delete-floorplan/{floorplan_id}")
-def delete_floorplan(floorplan_id: int):
+# Spatial queries, answered from the floorplan_elements R-tree
+def elements_in_bbox(floorplan_id, min_x, min_y, max_x, max_y, element_types=None):
+    """Elements whose bounding box intersects the given box (e.g. a viewport), in drawing order"""
+    return [element for element, _ in query_bbox(db, floorplan_id, min_x, min_y, max_x, max_y)
+            if not element_types or element.get("element_type") in element_types]
+
+def _bbox_distance(a, b):
+    dx = max(0.0, a[0] - b[2], b[0] - a[2])
+    dy = max(0.0, a[1] - b[3], b[1] - a[3])
+    return math.hypot(dx, dy)
+
+def elements_within(floorplan_id, element_id, distance, element_types=None):
+    """``(element, distance)`` for elements whose bounding box lies within ``distance`` metres of
+    the given element's bounding box, nearest first. The element itself is not included."""
+    bbox = element_bbox(db, floorplan_id, element_id)
+    if bbox is None: return []
+    candidates = query_bbox(db, floorplan_id, bbox[0] - distance, bbox[1] - distance,
+                            bbox[2] + distance, bbox[3] + distance)
+    found = []
+    for element, other in candidates:
+        if element["id"] == element_id: continue
+        if element_types and element.get("element_type") not in element_types: continue
+        gap = _bbox_distance(bbox, other)
+        if gap <= distance: found.append((element, gap))
+    return sorted(found, key=lambda pair: pair[1])
+
+def elements_touching(floorplan_id, element_id, element_types=None, tolerance=0.05):
+    """Elements whose bounding box touches the given element's, e.g. doors on a wall"""
+    return [element for element, _ in elements_within(floorplan_id, element_id, tolerance, element_types)]
+
+def delete_floorplan_rows(floorplan_id):
+    """Delete a floor plan with its elements, their records, search entries and notifications.
+    Callers are expected to wrap this in write_transaction()."""
+    element_rows = "SELECT id FROM elements WHERE floorplan_id=?"
+    for (row_id,) in db.execute(element_rows, (floorplan_id,)).fetchall():
+        unindex_element(db, row_id)
+    for table in [*ELEMENT_DEPENDENT_TABLES, "notifications"]:
+        db.execute(f"DELETE FROM {table} WHERE element_id IN ({element_rows})", (floorplan_id,))
+    db.execute("DELETE FROM elements WHERE floorplan_id=?", (floorplan_id,))
+    # The R-tree triggers remove the elements' boxes
+    db.execute("DELETE FROM floorplan_elements WHERE floorplan_id=?", (floorplan_id,))
+    db.execute("DELETE FROM floorplan_revisions WHERE floorplan_id=?", (floorplan_id,))
+    db.execute("DELETE FROM floorplan_thumbnails WHERE floorplan_id=?", (floorplan_id,))
     floorplans.delete(floorplan_id)
 
+@ar.delete("/delete-floorplan/{floorplan_id}")
+async def delete_floorplan(floorplan_id: int):
+    # The documents are released in the transaction deleting the plan
+    await delete_floorplan_documents(floorplan_id, lambda: delete_floorplan_rows(floorplan_id))
+    clear_cache(floorplan_id)
+
 
 @ar.get("/edit-floorplan/{floorplan_id}")
 def edit_floorplan_page(sess, floorplan_id: int):
@@ -269,10 +548,14 @@ def edit_floorplan_page(sess, floorplan_id: int):
     return Main(
         Head(
             Title(f"Grundriss bearbeiten: {floorplan.name}"),
+            Script(src="/static/js/floorplanner/tiles.js"),
             Script(src="/static/js/floorplanner/core.js"),
             Script(src="/static/js/floorplanner/elements.js"),
             Script(src="/static/js/floorplanner/ui.js"),
-            Script(src="/static/js/floorplanner/render.js")
+            Script(src="/static/js/floorplanner/render.js"),
+            Script(src="/static/js/floorplanner/heatmap.js"),
+            Script(src="/static/js/floorplanner/documents.js"),
+            Script(src="/static/js/floorplanner/collab.js")
         ),
         Body(
             NavBar(
@@ -286,12 +569,13 @@ def edit_floorplan_page(sess, floorplan_id: int):
                     DivHStacked(
                         tools(),
                         Div(
-                            editor(floorplan_id, floorplan.width, floorplan.height, floorplan.data),
+                            editor(floorplan_id, floorplan.width, floorplan.height, editor_data(floorplan_id), floorplan.revision),
                             Div(id="status-message", style="display:none;position:absolute;top:10px;right:10px;padding:5px 10px;background-color:rgba(0,0,0,0.6);color:white;border-radius:3px;"), 
                             cls="position-relative"
                         ),
                         floorplan_properties()
                     ),
+                    Div(id="revision-history"),
                     cls="floorplan-editor",
                     id="floorplan-editor-container",
                     data_mode="edit"
@@ -301,8 +585,34 @@ def edit_floorplan_page(sess, floorplan_id: int):
         )
     )
 
+# Conditional GET for responses derived from a floor plan. Every save bumps
+# floorplans.revision, so the revision identifies the stored content.
+def cache_headers(floorplan, variant):
+    """Validators for the ``variant`` representation of a floor plan at its current revision"""
+    headers = {"ETag": f'"fp{floorplan.id}-r{floorplan.revision}-{variant}"',
+               # Clients may keep a copy but must revalidate it on every use
+               "Cache-Control": "private, no-cache"}
+    if floorplan.updated_at:
+        modified = datetime.datetime.fromisoformat(floorplan.updated_at).astimezone(datetime.timezone.utc)
+        headers["Last-Modified"] = format_datetime(modified, usegmt=True)
+    return headers
+
+def not_modified(request, headers):
+    """Whether the request's If-None-Match / If-Modified-Since validators still match"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or headers["ETag"] in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and "Last-Modified" in headers:
+        try:
+            return parsedate_to_datetime(headers["Last-Modified"]) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
 @ar.get("/show-floorplan/{floorplan_id}")
-def show_floorplan_page(floorplan_id: int):
+def show_floorplan_page(request, floorplan_id: int):
     try:
         floorplan = floorplans(where='id=?', where_args=(floorplan_id,))
         if not floorplan:
@@ -319,16 +629,23 @@ def show_floorplan_page(floorplan_id: int):
                 )
             )
         )
-    print(floorplan.height)
+    # htmx swaps get a partial page, so the two representations need their own tags
+    headers = cache_headers(floorplan, "show-htmx" if request.headers.get("hx-request") else "show")
+    headers["Vary"] = "HX-Request"
+    if not_modified(request, headers): return Response(status_code=304, headers=headers)
     return Main(
         Head(
             Title(f"Grundriss anzeigen: {floorplan.name}"),
+            Script(src="/static/js/floorplanner/tiles.js"),
+            Script(src="/static/js/floorplanner/heatmap.js"),
+            Script(src="/static/js/floorplanner/documents.js"),
             Script(src="/static/js/floorplanner/show.js")
         ),
         Body(
             NavBar(
                 H3("Safety Floor Planner"),
                 A('Wechseln zu Bearbeiten', href=f'/edit-floorplan/{floorplan_id}', cls="uk-button uk-button-default"),
+                Button("Risiko-Heatmap", id="heatmap-toggle", onclick="toggleHeatmap()", cls="uk-button uk-button-default"),
                 A("Zurück zur Übersicht", href="/", cls="uk-button uk-button-default")
             ),
             Container(
@@ -338,7 +655,7 @@ def show_floorplan_page(floorplan_id: int):
                         cls="view-header"
                     ),
                     DivHStacked(
-                        editor(floorplan_id, floorplan.width, floorplan.height, floorplan.data),
+                        editor(floorplan_id, floorplan.width, floorplan.height, editor_data(floorplan_id), floorplan.revision),
                         floorplan_properties(), 
                         cls="uk-grid uk-child-width-expand"
                     ),
@@ -348,21 +665,117 @@ def show_floorplan_page(floorplan_id: int):
                 cls=("mt-5", "uk-container-xl")
             )
         )
-    )
+    ), *[HttpHeader(name, value) for name, value in headers.items()]
 
 @ar.get('/floorplan_editor/{floorplan_id}/elements')
-def get_floorplan_elements(floorplan_id: int):
+def get_floorplan_elements(request, floorplan_id: int):
     try:
         # Get the floorplan from database
         db_floorplan = floorplans(where='id=?', where_args=(floorplan_id,))
         if not db_floorplan:
-            return {"error": "Floorplan not found"}, 404
-        else: db_floorplan = db_floorplan[0]
-        print(db_floorplan.data)
-        # Parse and return the elements
-        return db_floorplan.data
+            return JSONResponse({"error": "Floorplan not found"}, status_code=404)
+        headers = cache_headers(db_floorplan[0], "elements")
+        if not_modified(request, headers): return Response(status_code=304, headers=headers)
+        # Rebuild the element list from floorplan_elements
+        return JSONResponse(load_elements(db, floorplan_id), headers=headers)
+    except Exception as e:
+        return JSONResponse({"error": f"Error loading elements: {str(e)}"}, status_code=500)
+
+@ar.get('/floorplan_editor/{floorplan_id}/tiles/{zoom}/{tx}/{ty}')
+def get_floorplan_tile(request, floorplan_id: int, zoom: int, tx: int, ty: int):
+    """Elements intersecting one tile, with their drawing order"""
+    if not 0 <= zoom <= MAX_TILE_ZOOM:
+        return JSONResponse({"error": f"Zoom must be between 0 and {MAX_TILE_ZOOM}"}, status_code=400)
+    try:
+        db_floorplan = floorplans(where='id=?', where_args=(floorplan_id,))
+        if not db_floorplan:
+            return JSONResponse({"error": "Floorplan not found"}, status_code=404)
+        headers = cache_headers(db_floorplan[0], f"tile-{zoom}-{tx}-{ty}")
+        if not_modified(request, headers): return Response(status_code=304, headers=headers)
+        size = TILE_SIZE / 2 ** zoom
+        rows = query_tile(db, floorplan_id, tx * size, ty * size, (tx + 1) * size, (ty + 1) * size,
+                          min_extent=size / TILE_PIXELS)
+        return JSONResponse({"elements": [element for _, element in rows], "seq": [seq for seq, _ in rows]},
+                            headers=headers)
+    except Exception as e:
+        return JSONResponse({"error": f"Error loading elements: {str(e)}"}, status_code=500)
+
+@ar.get('/floorplan/{floorplan_id}/render/{fmt}')
+def render_floorplan_image(request, floorplan_id: int, fmt: str, width: int = 1200, height: int = None,
+                           grid: bool = False, revision: int = None):
+    """The plan as an SVG, PDF or PNG image, drawn like the editor's PNG export.
+    With ``revision`` the image of that revision is returned and may be cached for good."""
+    if fmt not in FORMATS:
+        return JSONResponse({"error": f"Format must be one of {', '.join(FORMATS)}"}, status_code=400)
+    try:
+        db_floorplan = floorplans(where='id=?', where_args=(floorplan_id,))
+        if not db_floorplan:
+            return JSONResponse({"error": "Floorplan not found"}, status_code=404)
+        floorplan = db_floorplan[0]
+        # Keep the plan's aspect ratio unless both sides are given
+        if height is None: height = max(1, round(width * floorplan.height / floorplan.width))
+        variant = f"{fmt}-{width}x{height}{'-grid' if grid else ''}"
+        if revision is None or revision == floorplan.revision:
+            headers = cache_headers(floorplan, variant)
+            if revision is not None:
+                # A pinned revision never changes
+                headers["Cache-Control"] = "private, max-age=31536000, immutable"
+            revision = floorplan.revision
+            load = lambda: load_elements(db, floorplan_id)
+        else:
+            if not db.execute("SELECT 1 FROM floorplan_revisions WHERE floorplan_id=? AND revision=?",
+                              (floorplan_id, revision)).fetchall():
+                return JSONResponse({"error": f"Revision {revision} is no longer available"}, status_code=404)
+            headers = {"ETag": f'"fp{floorplan_id}-r{revision}-{variant}"',
+                       "Cache-Control": "private, max-age=31536000, immutable"}
+            def load():
+                past = load_revision(db, floorplan_id, revision)
+                if past is None: raise RenderError(f"Revision {revision} is no longer available")
+                return past
+        if not_modified(request, headers): return Response(status_code=304, headers=headers)
+        image, _ = cached_render(floorplan_id, revision, fmt, load, floorplan.width, floorplan.height,
+                                 width, height, grid)
+        headers["Content-Disposition"] = f'inline; filename="floorplan-{floorplan_id}-r{revision}.{fmt}"'
+        return Response(image, media_type=FORMATS[fmt], headers=headers)
+    except RenderUnavailable as e:
+        return JSONResponse({"error": str(e)}, status_code=501)
+    except RenderError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"error": f"Error rendering floorplan: {str(e)}"}, status_code=500)
+
+@ar.get('/floorplan/{floorplan_id}/heatmap')
+def get_risk_heatmap(request, floorplan_id: int):
+    """PNG overlay of the plan's risk density, covering the plan area"""
+    try:
+        floorplan = floorplans.fetchone(where='id=?', where_args=(floorplan_id,))
+        if not floorplan:
+            return JSONResponse({"error": "Floorplan not found"}, status_code=404)
+        stamp = risk_stamp(db, floorplan_id)
+        # Risk assessments change without a new plan revision, so the tag names their state too
+        headers = {"ETag": f'"fp{floorplan_id}-r{floorplan.revision}-heatmap-{stamp}"',
+                   "Cache-Control": "private, no-cache"}
+        if not_modified(request, headers): return Response(status_code=304, headers=headers)
+        return Response(cached_heatmap(db, floorplan, stamp), media_type=FORMATS['png'], headers=headers)
+    except RenderUnavailable as e:
+        return JSONResponse({"error": str(e)}, status_code=501)
     except Exception as e:
-        return {"error": f"Error loading elements: {str(e)}"}, 500
+        return JSONResponse({"error": f"Error rendering risk heatmap: {str(e)}"}, status_code=500)
+
+@ar.get('/floorplan/{floorplan_id}/thumbnail/{revision}')
+def get_floorplan_thumbnail(request, floorplan_id: int, revision: int):
+    """Overview thumbnail; the URL names the revision, so the image never changes"""
+    row = db.execute("SELECT revision, media_type, image FROM floorplan_thumbnails WHERE floorplan_id=?",
+                     (floorplan_id,)).fetchone()
+    if not row:
+        return JSONResponse({"error": "Thumbnail not found"}, status_code=404)
+    if row[0] != revision:
+        # Only the newest thumbnail is kept
+        return Redirect(thumbnail_url(floorplan_id, row[0]))
+    headers = {"ETag": f'"fp{floorplan_id}-r{revision}-thumbnail"',
+               "Cache-Control": "private, max-age=31536000, immutable"}
+    if not_modified(request, headers): return Response(status_code=304, headers=headers)
+    return Response(row[2], media_type=row[1], headers=headers)
 
 @ar.get('/element/{floorplan_id}/{element_id}/safety')
 def element_safety_form(floorplan_id: int, element_id: str):
@@ -398,11 +811,33 @@ def element_safety_form(floorplan_id: int, element_id: str):
                                 LabelTextArea("Sicherheitshinweise", name="safety_instructions", value=element.safety_instructions),
                                 LabelInput("Geschulte Mitarbeiter (Namen, durch Komma getrennt)", name="trained_employees", 
                                            value=", ".join(json.loads(element.trained_employees)) if element.trained_employees else ""),
-                                LabelInput("Wartungsplan", name="maintenance_schedule", value=element.maintenance_schedule),
+                                LabelInput("Wartungsplan", name="maintenance_schedule", value=element.maintenance_schedule,
+                                           placeholder="z.B. jährlich oder alle 6 Monate"),
+                                # The recurrence is taken from the schedule text if no interval is given
+                                Grid(
+                                    LabelInput("Wartungsintervall", name="maintenance_interval", type="number", min="1",
+                                               max=str(MAX_INTERVAL), value=element.maintenance_interval or ""),
+                                    Div(
+                                        FormLabel("Einheit"),
+                                        Select(
+                                            *[Option(plural, value=unit, selected=(unit == (element.maintenance_unit or 'months')))
+                                              for unit, (_, plural) in UNITS.items()],
+                                            name="maintenance_unit",
+                                            cls="uk-select"
+                                        )
+                                    ),
+                                    LabelInput("Erste Wartung fällig am", name="maintenance_anchor", type="date",
+                                               value=element.maintenance_anchor or ""),
+                                    cols=3
+                                ),
                                 LabelInput("Letzte Wartung", name="last_maintenance", type="date", 
                                            value=element.last_maintenance.split("T")[0] if element.last_maintenance else ""),
+                                P(f"Nächste Wartung fällig: {to_date(element.next_maintenance_due).strftime('%d.%m.%Y')}"
+                                  if element.next_maintenance_due else "Kein Wartungsintervall festgelegt", cls="text-muted"),
+                                Div(id="safety-form-errors"),
                                 Button("Speichern", type="submit", cls="uk-button uk-button-primary"),
                                 hx_post=f"/element/{floorplan_id}/{element_id}/safety/save",
+                                hx_target="#safety-form-errors",
                             )
                         )
                     ),
@@ -415,8 +850,9 @@ def element_safety_form(floorplan_id: int, element_id: str):
 
 @ar.post('/element/{floorplan_id}/{element_id}/safety/save')
 def save_element_safety(floorplan_id: int, element_id: str, name: str, description: str, dangers: str, 
-                         safety_instructions: str, trained_employees: str, maintenance_schedule: str, 
-                         last_maintenance: str = ""):
+                         safety_instructions: str, trained_employees: str, maintenance_schedule: str = "", 
+                         last_maintenance: str = "", maintenance_interval: str = "", maintenance_unit: str = "months",
+                         maintenance_anchor: str = ""):
     try:
         # Get the element
         element = elements.fetchone(
@@ -430,6 +866,18 @@ def save_element_safety(floorplan_id: int, element_id: str, name: str, descripti
         # Format employees as JSON list
         employees_list = [emp.strip() for emp in trained_employees.split(',') if emp.strip()]
         
+        # A schedule written as text ("jährlich") fills in a missing interval
+        if not maintenance_interval.strip() and parse_schedule(maintenance_schedule):
+            maintenance_interval, maintenance_unit = map(str, parse_schedule(maintenance_schedule))
+        try:
+            recurrence = validate_recurrence(maintenance_interval, maintenance_unit, maintenance_anchor, last_maintenance)
+        except RecurrenceError as e:
+            return Div(str(e), cls="error-message")
+        # Keep the schedule text in line with the interval unless it is a note of its own
+        written = parse_schedule(maintenance_schedule)
+        if recurrence[0] and (not maintenance_schedule.strip() or (written and written != recurrence[:2])):
+            maintenance_schedule = schedule_label(*recurrence[:2])
+        
         # Update element
         element.name = name
         element.description = description
@@ -440,9 +888,12 @@ def save_element_safety(floorplan_id: int, element_id: str, name: str, descripti
         
         if last_maintenance:
             element.last_maintenance = f"{last_maintenance}T00:00:00"
+        apply_recurrence(element, *recurrence)
             
         element.updated_at = datetime.datetime.now().isoformat()
         elements.update(element)
+        index_element(db, element.id)
+        refresh_element_notifications(element.id)
         
         return Redirect(f"/show-floorplan/{floorplan_id}")
     except Exception as e:
@@ -465,6 +916,7 @@ def update_element_basic(floorplan_id: int, element_id: str, name: str, descript
         element.description = description
         element.updated_at = datetime.datetime.now().isoformat()
         elements.update(element)
+        index_element(db, element.id)
         
         # Return the updated properties view
         return get_element_properties(floorplan_id, element_id)
@@ -0,0 +1,91 @@
+"""
+Maintenance recurrence of elements.
+
+An element's recurrence is stored as ``maintenance_interval`` and
+``maintenance_unit`` ("alle 6 Monate") plus ``maintenance_anchor``, the date
+the first maintenance is due. ``maintenance_schedule`` keeps the readable
+text. ``next_maintenance_due`` is denormalized from these and
+``last_maintenance`` by ``apply_recurrence`` whenever an element is saved, so
+"what is due by date X" is a range scan on ``idx_elements_next_maintenance``.
+
+The next maintenance is due one interval after the last one, or on the anchor
+date if the element has not been maintained since.
+"""
+import calendar
+import datetime
+import re
+
+UNITS = {'days': ("Tag", "Tage"), 'weeks': ("Woche", "Wochen"), 'months': ("Monat", "Monate"), 'years': ("Jahr", "Jahre")}
+MAX_INTERVAL = 1000
+
+_SCHEDULE_WORDS = [
+    ('zweijährlich', (2, 'years')), ('halbjährlich', (6, 'months')), ('vierteljährlich', (3, 'months')),
+    ('quartalsweise', (3, 'months')), ('jährlich', (1, 'years')), ('monatlich', (1, 'months')),
+    ('wöchentlich', (1, 'weeks')), ('täglich', (1, 'days')),
+]
+_SCHEDULE_RE = re.compile(r'(\d+)\s*(tag|woche|monat|jahr)', re.IGNORECASE)
+_UNIT_WORDS = {'tag': 'days', 'woche': 'weeks', 'monat': 'months', 'jahr': 'years'}
+
+class RecurrenceError(ValueError): pass
+
+def parse_schedule(text):
+    """``(count, unit)`` of a free-text maintenance schedule, None if it names no interval"""
+    text = (text or '').strip().lower()
+    match = _SCHEDULE_RE.search(text)
+    if match and int(match.group(1)) > 0:
+        return int(match.group(1)), _UNIT_WORDS[match.group(2)]
+    for word, interval in _SCHEDULE_WORDS:
+        if word in text: return interval
+    return None
+
+_SINGLE = {'days': "täglich", 'weeks': "wöchentlich", 'months': "monatlich", 'years': "jährlich"}
+
+def schedule_label(count, unit):
+    """Readable schedule such as "alle 6 Monate", stored in maintenance_schedule"""
+    return _SINGLE[unit] if count == 1 else f"alle {count} {UNITS[unit][1]}"
+
+def shift(date, count, unit):
+    """``date`` moved by ``count`` days/weeks/months/years; month ends are clamped"""
+    if unit == 'days': return date + datetime.timedelta(days=count)
+    if unit == 'weeks': return date + datetime.timedelta(weeks=count)
+    months = date.month - 1 + count * (12 if unit == 'years' else 1)
+    year, month = date.year + months // 12, months % 12 + 1
+    return date.replace(year=year, month=month, day=min(date.day, calendar.monthrange(year, month)[1]))
+
+def to_date(value):
+    """Date of an ISO date or datetime string, None if empty"""
+    return datetime.date.fromisoformat(value[:10]) if value else None
+
+def next_due(interval, unit, anchor, last_maintenance):
+    """Date the next maintenance is due, None without a recurrence"""
+    if not interval or unit not in UNITS: return None
+    anchor, last = to_date(anchor), to_date(last_maintenance)
+    if last and (anchor is None or last >= anchor): return shift(last, interval, unit)
+    return anchor
+
+def validate_recurrence(interval, unit, anchor, last_maintenance):
+    """``(interval, unit, anchor)`` from the safety form, or RecurrenceError with a message for the user.
+    An empty interval removes the recurrence."""
+    try:
+        anchor_date, last = to_date(anchor), to_date(last_maintenance)
+    except ValueError:
+        raise RecurrenceError("Ungültiges Datum")
+    if last and last > datetime.date.today():
+        raise RecurrenceError("Die letzte Wartung darf nicht in der Zukunft liegen")
+    if not str(interval or '').strip(): return None, None, None
+    try:
+        interval = int(interval)
+    except ValueError:
+        raise RecurrenceError("Das Wartungsintervall muss eine ganze Zahl sein")
+    if not 1 <= interval <= MAX_INTERVAL:
+        raise RecurrenceError(f"Das Wartungsintervall muss zwischen 1 und {MAX_INTERVAL} liegen")
+    if unit not in UNITS: raise RecurrenceError("Unbekannte Einheit des Wartungsintervalls")
+    # Without a start date the recurrence starts at the last maintenance, or is due right away
+    return interval, unit, (anchor_date or last or datetime.date.today()).isoformat()
+
+def apply_recurrence(element, interval, unit, anchor):
+    """Set the recurrence of an ``Element`` and recompute its ``next_maintenance_due``"""
+    element.maintenance_interval, element.maintenance_unit, element.maintenance_anchor = interval, unit, anchor
+    due = next_due(interval, unit, anchor, element.last_maintenance)
+    element.next_maintenance_due = due.isoformat() if due else None
+    return element
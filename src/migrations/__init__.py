@@ -0,0 +1,181 @@
+"""
+Versioned schema migrations.
+
+Migration scripts live next to this file as ``mNNNN_<name>.py`` modules and
+expose an ``up(db)`` function. They are applied in version order, each inside
+its own transaction, and recorded in the ``schema_migrations`` table. Scripts
+do not import app modules: helpers they need are copied into the script, so
+a migration keeps doing what it did when the app code changes.
+
+Secondary indexes are declared in src/db.py (``INDEXES``) rather than in
+migration scripts. ``sync_indexes`` creates missing or changed ``idx_*``
+indexes and drops ones that are no longer declared.
+
+At boot ``ensure_current`` only reads the recorded version and the index
+list; the schema is touched only when something is actually out of date. Use
+``python -m src.migrations`` to inspect or apply migrations offline.
+"""
+import apsw
+import datetime
+import importlib
+import pkgutil
+import re
+from pathlib import Path
+
+_MODULE_RE = re.compile(r'^m(\d{4})_(\w+)$')
+
+_INDEX_PREFIX = 'idx_'
+
+# Set by the offline CLI so importing src.db does not run the boot-time check
+OFFLINE = False
+
+class MigrationError(RuntimeError): pass
+
+def discover():
+    """Return ``(version, name, module)`` for every migration script, ordered by version"""
+    found = []
+    for info in pkgutil.iter_modules([str(Path(__file__).parent)]):
+        match = _MODULE_RE.match(info.name)
+        if not match: continue
+        module = importlib.import_module(f"{__name__}.{info.name}")
+        found.append((int(match.group(1)), match.group(2), module))
+    found.sort(key=lambda m: m[0])
+    versions = [v for v, _, _ in found]
+    if len(versions) != len(set(versions)):
+        raise MigrationError(f"Duplicate migration versions: {versions}")
+    return found
+
+def latest_version():
+    migrations = discover()
+    return migrations[-1][0] if migrations else 0
+
+def _ensure_version_table(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )""")
+
+def current_version(db):
+    """Highest applied migration version, 0 for a database that was never migrated"""
+    if 'schema_migrations' not in db.table_names(): return 0
+    row = db.execute("SELECT MAX(version) FROM schema_migrations").fetchone()
+    return row[0] or 0
+
+def pending(db):
+    version = current_version(db)
+    return [m for m in discover() if m[0] > version]
+
+def migrate(db, target=None, verbose=False):
+    """Apply pending migrations up to ``target`` (default: latest). Returns the applied versions."""
+    _ensure_version_table(db)
+    applied = []
+    for version, name, module in discover():
+        if target is not None and version > target: break
+        # BEGIN IMMEDIATE takes the write lock up front so concurrent workers
+        # booting against the same file serialize here instead of racing.
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(db) >= version:
+                db.execute("ROLLBACK")
+                continue
+            if verbose: print(f"Applying migration {version:04d} {name}")
+            module.up(db)
+            db.execute(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.datetime.now().isoformat())
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        applied.append(version)
+    return applied
+
+def index_sql(name, table, columns):
+    return f"CREATE INDEX [{name}] ON [{table}] ({', '.join(f'[{c}]' for c in columns)})"
+
+def index_changes(db, indexes):
+    """Compare declared ``{name: (table, columns)}`` indexes with the database.
+    Returns ``(to_create, to_drop)`` as lists of index names."""
+    existing = {name: sql for name, sql in db.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='index' AND name LIKE ?", (_INDEX_PREFIX + '%',))}
+    to_create = [name for name, (table, columns) in indexes.items()
+                 if existing.get(name) != index_sql(name, table, columns)]
+    to_drop = [name for name in existing if name not in indexes or name in to_create]
+    return to_create, to_drop
+
+def sync_indexes(db, indexes, verbose=False):
+    """Bring ``idx_*`` indexes in line with the declarations in one transaction"""
+    if index_changes(db, indexes) == ([], []): return []
+    # Like migrate: the changes are computed again under the write lock, so a
+    # worker that booted at the same time and synced first leaves nothing to do
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        to_create, to_drop = index_changes(db, indexes)
+        for name in to_drop:
+            if verbose: print(f"Dropping index {name}")
+            db.execute(f"DROP INDEX IF EXISTS [{name}]")
+        for name in to_create:
+            if verbose: print(f"Creating index {name}")
+            table, columns = indexes[name]
+            db.execute(index_sql(name, table, columns))
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return to_create
+
+def explain(db, sql, params=()):
+    """``EXPLAIN QUERY PLAN`` detail lines for ``sql``"""
+    return [row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+_VTAB_RE = re.compile(r'VIRTUAL TABLE INDEX (\d+):(\S*)')
+
+def _is_full_scan(step):
+    if not step.startswith('SCAN'): return False
+    # Virtual tables (rtree, fts5) report every access as SCAN; a constrained
+    # access has an idxStr, or is the rowid lookup (idxNum 1 for rtree)
+    match = _VTAB_RE.search(step)
+    if match: return not (match.group(2) or match.group(1) == '1')
+    return True
+
+def scanning_queries(db, queries):
+    """Return ``(sql, plan)`` for every query whose plan contains a full table SCAN.
+
+    Plans are taken against an empty in-memory copy of the schema, without
+    ``sqlite_stat1``, so the result only depends on the declared tables and
+    indexes and not on how many rows a particular database happens to hold."""
+    empty = apsw.Connection(":memory:")
+    schema = db.execute("SELECT name, sql FROM sqlite_master WHERE sql IS NOT NULL "
+                        "AND name NOT LIKE 'sqlite_%' ORDER BY type='index', rowid").fetchall()
+    virtual = [name for name, sql in schema if sql.upper().startswith('CREATE VIRTUAL TABLE')]
+    for name, sql in schema:
+        # Shadow tables of virtual tables are created together with the virtual table
+        if any(name.startswith(v + '_') for v in virtual): continue
+        empty.execute(sql)
+    failures = []
+    for sql in queries:
+        plan = explain(empty, sql, (None,) * sql.count('?'))
+        if any(_is_full_scan(step) for step in plan):
+            failures.append((sql, plan))
+    return failures
+
+def ensure_current(db, indexes=None, apply=True):
+    """Boot-time check. Cheap when the schema is current; applies or rejects pending changes otherwise."""
+    if OFFLINE: return []
+    indexes = indexes or {}
+    applied = []
+    if current_version(db) < latest_version():
+        if not apply:
+            missing = ", ".join(f"{v:04d}_{n}" for v, n, _ in pending(db))
+            raise MigrationError(f"Database schema is out of date (pending: {missing}). "
+                                 f"Run `python -m src.migrations upgrade`.")
+        applied = migrate(db)
+    to_create, to_drop = index_changes(db, indexes)
+    if to_create or to_drop:
+        if not apply:
+            raise MigrationError(f"Database indexes are out of date (create: {to_create}, drop: {to_drop}). "
+                                 f"Run `python -m src.migrations upgrade`.")
+        sync_indexes(db, indexes)
+    return applied
@@ -0,0 +1,57 @@
+"""
+Offline migration CLI.
+
+    python -m src.migrations status [--db PATH]
+    python -m src.migrations upgrade [--db PATH] [--target VERSION]
+    python -m src.migrations check-plans [--db PATH]
+    python -m src.migrations rebuild-search [--db PATH]
+"""
+import argparse
+import os
+import src.migrations as migrations
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.migrations", description="Manage the database schema")
+    parser.add_argument("command", choices=["status", "upgrade", "check-plans", "rebuild-search"])
+    parser.add_argument("--db", default=os.getenv("EASE_DB_PATH", "data/floorplan.db"), help="SQLite database file")
+    parser.add_argument("--target", type=int, default=None, help="Stop after this migration version")
+    args = parser.parse_args(argv)
+
+    # Import the app's schema declarations without triggering the boot-time check
+    os.environ["EASE_DB_PATH"] = args.db
+    migrations.OFFLINE = True
+    from src.db import db, write_transaction, INDEXES, HOT_QUERIES
+
+    if args.command == "status":
+        version = migrations.current_version(db)
+        for v, name, _ in migrations.discover():
+            print(f"[{'x' if v <= version else ' '}] {v:04d} {name}")
+        to_create, to_drop = migrations.index_changes(db, INDEXES)
+        for name in to_create: print(f"[ ] index {name}")
+        for name in to_drop: print(f"[-] index {name}")
+        return 0
+
+    if args.command == "check-plans":
+        failures = migrations.scanning_queries(db, HOT_QUERIES)
+        for sql, plan in failures:
+            print(f"SCAN: {sql}\n    " + "\n    ".join(plan))
+        print(f"{len(HOT_QUERIES) - len(failures)}/{len(HOT_QUERIES)} queries use an index")
+        return 1 if failures else 0
+
+    if args.command == "rebuild-search":
+        if migrations.current_version(db) < max(v for v, _, _ in migrations.discover()):
+            print("Schema is not up to date; run upgrade first")
+            return 1
+        from src.search_index import rebuild_index
+        with write_transaction():
+            rebuild_index(db)
+        print(f"Indexed {db.execute('SELECT COUNT(*) FROM search_index').fetchone()[0]} record(s)")
+        return 0
+
+    applied = migrations.migrate(db, target=args.target, verbose=True)
+    if args.target is None: migrations.sync_indexes(db, INDEXES, verbose=True)
+    print(f"Applied {len(applied)} migration(s); schema at version {migrations.current_version(db)}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,40 @@
+"""
+Initial schema: the seven tables previously created at import time in src/db.py.
+
+Column sets are frozen here rather than read from the dataclasses so the
+migration keeps producing the same schema when the models change later.
+``transform=True`` reconciles databases created by the old import-time code.
+"""
+
+TABLES = {
+    'users': dict(
+        username=str, email=str, password_hash=str, company_name=str,
+        created_at=str, id=int),
+    'floorplans': dict(
+        user_id=int, name=str, width=float, height=float, data=str,
+        created_at=str, updated_at=str, id=int),
+    'documents': dict(
+        floorplan_id=int, element_id=str, filename=str, s3_key=str,
+        upload_date=str, id=int),
+    'elements': dict(
+        floorplan_id=int, element_id=str, element_type=str, name=str,
+        description=str, dangers=str, safety_instructions=str,
+        trained_employees=str, maintenance_schedule=str, last_maintenance=str,
+        created_at=str, updated_at=str, id=int),
+    'risk_assessments': dict(
+        element_id=int, description=str, frequency=int, severity=int,
+        probability=int, risk_score=int, technical_measures=str,
+        organizational_measures=str, personal_measures=str,
+        created_at=str, updated_at=str, id=int),
+    'operating_instructions': dict(
+        element_id=int, hazard_symbols=str, protection_measures=str,
+        first_aid=str, emergency_procedures=str, maintenance_disposal=str,
+        created_at=str, updated_at=str, id=int),
+    'training_records': dict(
+        element_id=int, employee_name=str, training_name=str,
+        training_date=str, document_ids=str, created_at=str, id=int),
+}
+
+def up(db):
+    for name, columns in TABLES.items():
+        db.create_table(name, columns, pk='id', transform=True)
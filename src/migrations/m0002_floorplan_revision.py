@@ -0,0 +1,7 @@
+"""
+Add a per-floorplan revision counter, bumped on every save.
+"""
+
+def up(db):
+    if 'revision' not in db.t.floorplans.columns_dict:
+        db.execute("ALTER TABLE floorplans ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
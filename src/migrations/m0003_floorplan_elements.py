@@ -0,0 +1,91 @@
+"""
+Move element geometry out of the ``floorplans.data`` JSON blob into the
+typed ``floorplan_elements`` table.
+
+Every plan is converted, read back and compared with the original document
+before its blob is cleared, so a plan that does not round-trip aborts the
+migration instead of losing data.
+
+The conversion is a copy of src/plan_elements.py as of this migration, so
+later changes to the app cannot change what it does.
+"""
+import json
+from src.migrations import MigrationError
+
+COLUMNS = ('floorplan_id', 'element_id', 'element_type', 'seq',
+           'start_x', 'start_y', 'end_x', 'end_y', 'width', 'properties', 'extra')
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _is_point(value):
+    return isinstance(value, dict) and set(value) == {'x', 'y'} and all(_is_number(v) for v in value.values())
+
+def element_to_row(floorplan_id, element, seq):
+    """Split an editor element into a row (tuple in ``COLUMNS`` order); unknown fields go to ``extra``"""
+    extra = {k: v for k, v in element.items()
+             if k not in ('id', 'element_type', 'start', 'end', 'width', 'properties')}
+    start, end, width = element.get('start'), element.get('end'), element.get('width')
+    if 'start' in element and not _is_point(start): extra['start'], start = start, None
+    if 'end' in element and not _is_point(end): extra['end'], end = end, None
+    if 'width' in element and not _is_number(width): extra['width'], width = width, None
+    if 'element_type' in element and not isinstance(element['element_type'], str):
+        extra['element_type'] = element['element_type']
+    properties = element.get('properties')
+    if 'properties' in element and not isinstance(properties, dict):
+        extra['properties'], properties = properties, None
+    return (
+        floorplan_id, element['id'],
+        element.get('element_type') if 'element_type' not in extra else None,
+        seq,
+        start['x'] if start else None, start['y'] if start else None,
+        end['x'] if end else None, end['y'] if end else None,
+        width,
+        json.dumps(properties, separators=(',', ':')) if properties is not None else None,
+        json.dumps(extra, separators=(',', ':')) if extra else None,
+    )
+
+def row_to_element(row):
+    """Rebuild an editor element from a row tuple in ``COLUMNS`` order"""
+    row = dict(zip(COLUMNS, row))
+    element = {'id': row['element_id']}
+    if row['element_type'] is not None: element['element_type'] = row['element_type']
+    if row['start_x'] is not None: element['start'] = {'x': row['start_x'], 'y': row['start_y']}
+    if row['end_x'] is not None: element['end'] = {'x': row['end_x'], 'y': row['end_y']}
+    if row['width'] is not None: element['width'] = row['width']
+    if row['properties'] is not None: element['properties'] = json.loads(row['properties'])
+    if row['extra']: element.update(json.loads(row['extra']))
+    return element
+
+def up(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS floorplan_elements (
+        id INTEGER PRIMARY KEY,
+        floorplan_id INTEGER NOT NULL,
+        element_id TEXT NOT NULL,
+        element_type TEXT,
+        seq INTEGER NOT NULL,
+        start_x REAL,
+        start_y REAL,
+        end_x REAL,
+        end_y REAL,
+        width REAL,
+        properties TEXT,
+        extra TEXT,
+        UNIQUE (floorplan_id, element_id)
+    )""")
+    for floorplan_id, data in db.execute("SELECT id, data FROM floorplans WHERE data IS NOT NULL").fetchall():
+        try:
+            elements_data = json.loads(data) if data.strip() else []
+        except ValueError as e:
+            raise MigrationError(f"Floorplan {floorplan_id}: data is not valid JSON ({e})")
+        if not isinstance(elements_data, list) or not all(isinstance(e, dict) and 'id' in e for e in elements_data):
+            raise MigrationError(f"Floorplan {floorplan_id}: data is not a list of elements with ids")
+        db.execute("DELETE FROM floorplan_elements WHERE floorplan_id=?", (floorplan_id,))
+        db.conn.executemany(
+            f"INSERT INTO floorplan_elements ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            [element_to_row(floorplan_id, element, seq) for seq, element in enumerate(elements_data)])
+        stored = [row_to_element(row) for row in db.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM floorplan_elements WHERE floorplan_id=? ORDER BY seq", (floorplan_id,))]
+        if stored != elements_data:
+            raise MigrationError(f"Floorplan {floorplan_id}: elements do not round-trip through floorplan_elements")
+    db.execute("UPDATE floorplans SET data=NULL")
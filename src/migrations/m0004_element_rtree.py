@@ -0,0 +1,43 @@
+"""
+R-tree index of element bounding boxes for spatial queries.
+
+``floorplan_elements_rtree`` holds one box per ``floorplan_elements`` row
+(same id). The floor plan id is stored as an extra, degenerate dimension so a
+query for one plan never has to visit boxes of other plans that happen to
+overlap in plan coordinates (float32 keeps ids exact up to 2**24).
+
+Boxes span start, end and any ``properties.points`` (emergency routes),
+padded by half the element width. Triggers keep the index in sync with every
+write to ``floorplan_elements``.
+"""
+
+def _extent(row, agg, axis, sign):
+    return (f"(SELECT {agg}(v) FROM (SELECT {row}start_{axis} AS v UNION ALL SELECT {row}end_{axis} "
+            f"UNION ALL SELECT json_extract(p.value, '$.{axis}') FROM json_each(COALESCE({row}properties, '{{}}'), '$.points') p))"
+            f" {sign} COALESCE({row}width, 0) / 2.0")
+
+def _bbox_select(row, source=""):
+    """SELECT producing (id, min_fp, max_fp, min_x, max_x, min_y, max_y) for ``row`` ('NEW.' or 'fe.')"""
+    return (f"SELECT id, fp, fp, min_x, max_x, min_y, max_y FROM (SELECT {row}id AS id, {row}floorplan_id AS fp, "
+            f"{_extent(row, 'MIN', 'x', '-')} AS min_x, {_extent(row, 'MAX', 'x', '+')} AS max_x, "
+            f"{_extent(row, 'MIN', 'y', '-')} AS min_y, {_extent(row, 'MAX', 'y', '+')} AS max_y{source}) "
+            f"WHERE min_x IS NOT NULL AND min_y IS NOT NULL")
+
+def up(db):
+    db.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS floorplan_elements_rtree
+        USING rtree(id, min_fp, max_fp, min_x, max_x, min_y, max_y)""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS floorplan_elements_rtree_insert
+        AFTER INSERT ON floorplan_elements BEGIN
+            INSERT INTO floorplan_elements_rtree {_bbox_select('NEW.')};
+        END""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS floorplan_elements_rtree_update
+        AFTER UPDATE ON floorplan_elements BEGIN
+            DELETE FROM floorplan_elements_rtree WHERE id = OLD.id;
+            INSERT INTO floorplan_elements_rtree {_bbox_select('NEW.')};
+        END""")
+    db.execute("""CREATE TRIGGER IF NOT EXISTS floorplan_elements_rtree_delete
+        AFTER DELETE ON floorplan_elements BEGIN
+            DELETE FROM floorplan_elements_rtree WHERE id = OLD.id;
+        END""")
+    db.execute("DELETE FROM floorplan_elements_rtree")
+    db.execute(f"INSERT INTO floorplan_elements_rtree {_bbox_select('fe.', ' FROM floorplan_elements fe')}")
@@ -0,0 +1,54 @@
+"""
+Revision history of floor plans (see src/plan_revisions.py).
+
+Existing plans get a keyframe of their current state, so the state before
+the first save after this migration can still be restored.
+
+Keyframes are written in the ``json-gzip`` format of src/plan_codec.py
+(header ``FPC`` and codec id 2), with a copy of the element loading of
+src/plan_elements.py as of this migration.
+"""
+import datetime
+import gzip
+import json
+
+COLUMNS = ('element_id', 'element_type', 'start_x', 'start_y', 'end_x', 'end_y', 'width', 'properties', 'extra')
+
+def load_elements(db, floorplan_id):
+    elements_data = []
+    for row in db.execute(f"SELECT {', '.join(COLUMNS)} FROM floorplan_elements WHERE floorplan_id=? ORDER BY seq",
+                          (floorplan_id,)):
+        row = dict(zip(COLUMNS, row))
+        element = {'id': row['element_id']}
+        if row['element_type'] is not None: element['element_type'] = row['element_type']
+        if row['start_x'] is not None: element['start'] = {'x': row['start_x'], 'y': row['start_y']}
+        if row['end_x'] is not None: element['end'] = {'x': row['end_x'], 'y': row['end_y']}
+        if row['width'] is not None: element['width'] = row['width']
+        if row['properties'] is not None: element['properties'] = json.loads(row['properties'])
+        if row['extra']: element.update(json.loads(row['extra']))
+        elements_data.append(element)
+    return elements_data
+
+def encode(elements_data):
+    body = json.dumps(elements_data, separators=(',', ':')).encode('utf-8')
+    return b'FPC' + bytes([2]) + gzip.compress(body, compresslevel=6, mtime=0)
+
+def up(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS floorplan_revisions (
+        id INTEGER PRIMARY KEY,
+        floorplan_id INTEGER NOT NULL,
+        revision INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        elements BLOB NOT NULL,
+        deleted TEXT,
+        ordering TEXT,
+        changes INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        UNIQUE (floorplan_id, revision)
+    )""")
+    now = datetime.datetime.now().isoformat()
+    for floorplan_id, revision, updated_at in db.execute("SELECT id, revision, updated_at FROM floorplans").fetchall():
+        current = load_elements(db, floorplan_id)
+        db.execute("""INSERT OR IGNORE INTO floorplan_revisions (floorplan_id, revision, kind, elements, changes, created_at)
+                      VALUES (?, ?, 'keyframe', ?, ?, ?)""",
+                   (floorplan_id, revision, encode(current), len(current), updated_at or now))
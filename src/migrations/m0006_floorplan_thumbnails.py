@@ -0,0 +1,15 @@
+"""
+Overview thumbnails of floor plans (see src/thumbnails.py).
+
+Thumbnails of existing plans are rendered the first time the overview page
+lists them, not here.
+"""
+
+def up(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS floorplan_thumbnails (
+        floorplan_id INTEGER PRIMARY KEY,
+        revision INTEGER NOT NULL,
+        media_type TEXT NOT NULL,
+        image BLOB NOT NULL,
+        created_at TEXT NOT NULL
+    )""")
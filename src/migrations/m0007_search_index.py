@@ -0,0 +1,60 @@
+"""
+Full-text search index over elements, risk assessments, operating
+instructions and training records (see src/search_index.py), filled from
+the existing rows.
+
+Table, rowids (``id * 4 + kind``) and texts are those of src/search_index.py
+as of this migration, copied here so later changes to the app cannot change
+what it does.
+"""
+import json
+
+KINDS = ('element', 'risk', 'instructions', 'training')
+
+CREATE_SQL = """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+    title, body, kind UNINDEXED, record_id UNINDEXED, element_id UNINDEXED, floorplan_id UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+)"""
+
+# Source rows per kind: (record id, floorplan id, client element id, element name, *texts)
+SOURCES = {
+    'element': """SELECT e.id, e.floorplan_id, e.element_id, e.name,
+                         e.description, e.dangers, e.safety_instructions, e.trained_employees
+                  FROM elements e JOIN floorplans f ON f.id = e.floorplan_id""",
+    'risk': """SELECT r.id, e.floorplan_id, e.element_id, e.name, r.description,
+                      r.technical_measures, r.organizational_measures, r.personal_measures
+               FROM risk_assessments r JOIN elements e ON e.id = r.element_id
+               JOIN floorplans f ON f.id = e.floorplan_id""",
+    'instructions': """SELECT o.id, e.floorplan_id, e.element_id, e.name, o.hazard_symbols,
+                              o.protection_measures, o.first_aid, o.emergency_procedures, o.maintenance_disposal
+                       FROM operating_instructions o JOIN elements e ON e.id = o.element_id
+                       JOIN floorplans f ON f.id = e.floorplan_id""",
+    'training': """SELECT t.id, e.floorplan_id, e.element_id, t.training_name, t.employee_name, e.name
+                   FROM training_records t JOIN elements e ON e.id = t.element_id
+                   JOIN floorplans f ON f.id = e.floorplan_id""",
+}
+
+def _text(value):
+    """Searchable text of a column; JSON lists and objects contribute their strings"""
+    if not value: return ''
+    if isinstance(value, str):
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            return value
+        if not isinstance(parsed, (list, dict)): return value
+        value = parsed
+    if isinstance(value, str): return value
+    if isinstance(value, dict): return ' '.join(_text(v) for v in value.values())
+    if isinstance(value, list): return ' '.join(_text(v) for v in value)
+    return ''
+
+def up(db):
+    db.execute(CREATE_SQL)
+    db.execute("DELETE FROM search_index")
+    for kind, sql in SOURCES.items():
+        db.conn.executemany(
+            "INSERT INTO search_index (rowid, title, body, kind, record_id, element_id, floorplan_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(record_id * len(KINDS) + KINDS.index(kind), _text(title) or '', ' '.join(filter(None, map(_text, texts))),
+              kind, record_id, element_id, floorplan_id)
+             for record_id, floorplan_id, element_id, title, *texts in db.execute(sql).fetchall()])
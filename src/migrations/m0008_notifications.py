@@ -0,0 +1,20 @@
+"""
+Materialized notifications about due maintenance and expiring training
+records (see src/notifications.py). Filled by the scheduler on startup.
+"""
+
+def up(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS notifications (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        record_id INTEGER NOT NULL,
+        element_id INTEGER NOT NULL,
+        floorplan_id INTEGER NOT NULL,
+        subject TEXT NOT NULL,
+        detail TEXT NOT NULL,
+        due_date TEXT,
+        created_at TEXT NOT NULL,
+        refreshed_at TEXT NOT NULL,
+        UNIQUE (kind, record_id)
+    )""")
@@ -0,0 +1,72 @@
+"""
+Structured maintenance recurrence and the denormalized next due date of
+elements (see src/maintenance.py), parsed from the free-text schedules.
+
+Schedules naming no interval keep their text and get no recurrence. Elements
+never maintained start at their creation date, so they are due right away.
+
+Parsing and due dates are copies of src/maintenance.py as of this migration,
+so later changes to the app cannot change what it does.
+"""
+import calendar
+import datetime
+import re
+
+COLUMNS = {
+    'maintenance_interval': 'INTEGER',
+    'maintenance_unit': 'TEXT',
+    'maintenance_anchor': 'TEXT',
+    'next_maintenance_due': 'TEXT',
+}
+
+_SCHEDULE_WORDS = [
+    ('zweijährlich', (2, 'years')), ('halbjährlich', (6, 'months')), ('vierteljährlich', (3, 'months')),
+    ('quartalsweise', (3, 'months')), ('jährlich', (1, 'years')), ('monatlich', (1, 'months')),
+    ('wöchentlich', (1, 'weeks')), ('täglich', (1, 'days')),
+]
+_SCHEDULE_RE = re.compile(r'(\d+)\s*(tag|woche|monat|jahr)', re.IGNORECASE)
+_UNIT_WORDS = {'tag': 'days', 'woche': 'weeks', 'monat': 'months', 'jahr': 'years'}
+
+def parse_schedule(text):
+    """``(count, unit)`` of a free-text maintenance schedule, None if it names no interval"""
+    text = (text or '').strip().lower()
+    match = _SCHEDULE_RE.search(text)
+    if match and int(match.group(1)) > 0:
+        return int(match.group(1)), _UNIT_WORDS[match.group(2)]
+    for word, interval in _SCHEDULE_WORDS:
+        if word in text: return interval
+    return None
+
+def shift(date, count, unit):
+    """``date`` moved by ``count`` days/weeks/months/years; month ends are clamped"""
+    if unit == 'days': return date + datetime.timedelta(days=count)
+    if unit == 'weeks': return date + datetime.timedelta(weeks=count)
+    months = date.month - 1 + count * (12 if unit == 'years' else 1)
+    year, month = date.year + months // 12, months % 12 + 1
+    return date.replace(year=year, month=month, day=min(date.day, calendar.monthrange(year, month)[1]))
+
+def to_date(value):
+    return datetime.date.fromisoformat(value[:10]) if value else None
+
+def next_due(interval, unit, anchor, last_maintenance):
+    """Date the next maintenance is due: one interval after the last one, or the anchor"""
+    anchor, last = to_date(anchor), to_date(last_maintenance)
+    if last and (anchor is None or last >= anchor): return shift(last, interval, unit)
+    return anchor
+
+def up(db):
+    existing = db.t.elements.columns_dict
+    for name, kind in COLUMNS.items():
+        if name not in existing:
+            db.execute(f"ALTER TABLE elements ADD COLUMN {name} {kind}")
+    updates = []
+    for row_id, schedule, last_maintenance, created_at in db.execute(
+            "SELECT id, maintenance_schedule, last_maintenance, created_at FROM elements").fetchall():
+        interval = parse_schedule(schedule)
+        if not interval: continue
+        anchor = (last_maintenance or created_at or '')[:10] or None
+        due = next_due(*interval, anchor, last_maintenance)
+        updates.append((*interval, anchor, due and due.isoformat(), row_id))
+    db.conn.executemany(
+        """UPDATE elements SET maintenance_interval=?, maintenance_unit=?, maintenance_anchor=?,
+           next_maintenance_due=? WHERE id=?""", updates)
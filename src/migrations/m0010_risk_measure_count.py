@@ -0,0 +1,14 @@
+"""
+Number of measures recorded for a risk assessment, so the risk dashboard can
+count unmitigated risks from an index (see src/risk_dashboard.py).
+"""
+
+def _count(column):
+    return (f"(CASE WHEN json_valid({column}) AND json_type({column}) = 'array' THEN "
+            f"(SELECT COUNT(*) FROM json_each({column}) WHERE trim(value) != '') ELSE 0 END)")
+
+def up(db):
+    if 'measure_count' not in db.t.risk_assessments.columns_dict:
+        db.execute("ALTER TABLE risk_assessments ADD COLUMN measure_count INTEGER NOT NULL DEFAULT 0")
+    db.execute(f"""UPDATE risk_assessments SET measure_count = {_count('technical_measures')}
+                   + {_count('organizational_measures')} + {_count('personal_measures')}""")
@@ -0,0 +1,18 @@
+"""
+Sessions of resumable document uploads (see src/document_uploads.py): the S3
+multipart upload and the ETags of the parts stored so far.
+"""
+
+def up(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS document_uploads (
+        id TEXT PRIMARY KEY,
+        floorplan_id INTEGER NOT NULL,
+        element_id TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        s3_key TEXT NOT NULL,
+        upload_id TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        parts TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )""")
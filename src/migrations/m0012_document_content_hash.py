@@ -0,0 +1,9 @@
+"""
+Content hash and size of documents, for content-addressed storage (see
+src/document_uploads.py). Existing documents keep their keys and no hash.
+"""
+
+def up(db):
+    columns = db.t.documents.columns_dict
+    if 'sha256' not in columns: db.execute("ALTER TABLE documents ADD COLUMN sha256 TEXT")
+    if 'size' not in columns: db.execute("ALTER TABLE documents ADD COLUMN size INTEGER")
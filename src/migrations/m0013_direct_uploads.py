@@ -0,0 +1,16 @@
+"""
+Keys issued for direct uploads to the bucket (see src/document_uploads.py).
+Only a key recorded here can be registered as a document, and it is deleted
+with its object when the upload is not completed in time.
+"""
+
+def up(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS direct_uploads (
+        id TEXT PRIMARY KEY,
+        floorplan_id INTEGER NOT NULL,
+        element_id TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        s3_key TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at TEXT NOT NULL
+    )""")
@@ -0,0 +1,177 @@
+"""
+Notifications about due maintenance and expiring training records.
+
+The scheduler materializes everything that is due within ``NOTICE_DAYS``
+into the ``notifications`` table, one row per element (maintenance) or
+training record, so the notifications page only reads that table. Candidates
+are found with range queries on indexed columns:
+
+- maintenance: elements whose ``next_maintenance_due`` lies before the
+  horizon (see src/maintenance.py)
+- training: the latest record per employee and training whose
+  ``training_date`` is older than ``TRAINING_VALID_DAYS`` before the horizon
+
+``refresh_notifications`` runs every ``EASE_NOTIFICATION_INTERVAL`` seconds
+(default one hour) and for a single element after its maintenance or training
+data changed. Rows of deleted elements and plans are hidden by the page's
+joins and removed by the next full refresh.
+"""
+import asyncio
+import datetime
+import os
+from fasthtml.common import *
+from monsterui.all import *
+from urllib.parse import urlencode
+from src.db import db, write_lock
+from src.maintenance import to_date
+
+nr = APIRouter()
+
+NOTICE_DAYS = int(os.getenv('EASE_NOTICE_DAYS', '14'))
+# Safety instructions are repeated at least once a year (§ 12 ArbSchG)
+TRAINING_VALID_DAYS = int(os.getenv('EASE_TRAINING_VALID_DAYS', '365'))
+REFRESH_INTERVAL = float(os.getenv('EASE_NOTIFICATION_INTERVAL', '3600'))
+PAGE_LIMIT = 500
+
+KIND_LABELS = {'maintenance': "Wartung", 'training': "Schulung"}
+
+_MAINTENANCE_SQL = """SELECT e.id, e.floorplan_id, e.name, e.maintenance_schedule, e.last_maintenance,
+                             e.next_maintenance_due, f.user_id
+                      FROM elements e JOIN floorplans f ON f.id = e.floorplan_id"""
+
+def _maintenance_due(db, horizon, element_pk=None):
+    sql = f"{_MAINTENANCE_SQL} WHERE e.next_maintenance_due <= ?"
+    args = [horizon.isoformat()]
+    if element_pk is not None:
+        sql += " AND e.id=?"
+        args.append(element_pk)
+    for element_pk, floorplan_id, name, schedule, last_maintenance, due, user_id in db.execute(sql, args).fetchall():
+        last = to_date(last_maintenance)
+        parts = [schedule, f"zuletzt {last.strftime('%d.%m.%Y')}" if last else "noch keine Wartung erfasst"]
+        detail = ", ".join(part for part in parts if part)
+        yield user_id, 'maintenance', element_pk, element_pk, floorplan_id, name, detail, due
+
+def _trainings_expiring(db, horizon, element_pk=None):
+    cutoff = (horizon - datetime.timedelta(days=TRAINING_VALID_DAYS - 1)).isoformat()
+    sql = """SELECT t.id, t.element_id, e.floorplan_id, e.name, t.employee_name, t.training_name, t.training_date, f.user_id
+             FROM training_records t JOIN elements e ON e.id = t.element_id JOIN floorplans f ON f.id = e.floorplan_id
+             WHERE t.training_date < ?"""
+    args = [cutoff]
+    if element_pk is not None:
+        sql += " AND t.element_id=?"
+        args.append(element_pk)
+    # A newer record of the same training replaces an expiring one
+    sql += """ AND NOT EXISTS (SELECT 1 FROM training_records n WHERE n.element_id = t.element_id
+                  AND n.employee_name = t.employee_name AND n.training_name = t.training_name
+                  AND n.training_date > t.training_date)"""
+    for record_id, element_pk, floorplan_id, name, employee, training, training_date, user_id in db.execute(sql, args).fetchall():
+        due = to_date(training_date) + datetime.timedelta(days=TRAINING_VALID_DAYS)
+        yield user_id, 'training', record_id, element_pk, floorplan_id, name, f"{training}: {employee}", due.isoformat()
+
+def refresh_notifications(db, element_pk=None, today=None):
+    """Materialize the notifications of all elements, or of one element. Returns how many are due."""
+    horizon = (today or datetime.date.today()) + datetime.timedelta(days=NOTICE_DAYS)
+    # Runs on the scheduler's worker thread too; the shared write lock keeps it off
+    # the connection while a request's write transaction is using it
+    with write_lock, db.conn:
+        items = [*_maintenance_due(db, horizon, element_pk), *_trainings_expiring(db, horizon, element_pk)]
+        stamp = datetime.datetime.now().isoformat()
+        db.conn.executemany(
+            """INSERT INTO notifications (user_id, kind, record_id, element_id, floorplan_id, subject, detail,
+                   due_date, created_at, refreshed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (kind, record_id) DO UPDATE SET user_id=excluded.user_id, element_id=excluded.element_id,
+                   floorplan_id=excluded.floorplan_id, subject=excluded.subject, detail=excluded.detail,
+                   due_date=excluded.due_date, refreshed_at=excluded.refreshed_at""",
+            [(*item, stamp, stamp) for item in items])
+        # Whatever was not found again is no longer due
+        if element_pk is None:
+            db.execute("DELETE FROM notifications WHERE refreshed_at < ?", (stamp,))
+        else:
+            db.execute("DELETE FROM notifications WHERE element_id=? AND refreshed_at < ?", (element_pk, stamp))
+    return len(items)
+
+def refresh_element_notifications(element_pk):
+    """Update one element's notifications after its maintenance or training data changed"""
+    try:
+        refresh_notifications(db, element_pk)
+    except Exception as e:
+        print(f"Error updating notifications of element {element_pk}: {str(e)}")
+
+async def _refresh_periodically():
+    while True:
+        try:
+            count = await asyncio.to_thread(refresh_notifications, db)
+            print(f"notifications refreshed: {count} due")
+        except Exception as e:
+            print(f"Error refreshing notifications: {str(e)}")
+        await asyncio.sleep(REFRESH_INTERVAL)
+
+_scheduler = None
+
+def start_scheduler():
+    """Startup hook: refresh the notifications now and then every REFRESH_INTERVAL seconds"""
+    global _scheduler
+    if _scheduler is None: _scheduler = asyncio.get_running_loop().create_task(_refresh_periodically())
+
+def list_notifications(user_id, limit=PAGE_LIMIT):
+    """The user's notifications, most urgent first"""
+    return db.q(
+        """SELECT n.kind, n.subject, n.detail, n.due_date, n.floorplan_id, e.element_id, f.name AS floorplan_name
+           FROM notifications n JOIN elements e ON e.id = n.element_id JOIN floorplans f ON f.id = n.floorplan_id
+           WHERE n.user_id=? ORDER BY n.due_date LIMIT ?""",
+        (user_id, limit))
+
+def notification_table(items, today):
+    rows = []
+    for n in items:
+        href = f"/show-floorplan/{n['floorplan_id']}?{urlencode(dict(element=n['element_id']))}"
+        due = to_date(n['due_date'])
+        rows.append(Tr(
+            Td(Span(KIND_LABELS.get(n['kind'], n['kind']), cls="uk-label")),
+            Td(A(n['subject'], href=href)),
+            Td(n['detail']),
+            Td(n['floorplan_name']),
+            Td(due.strftime("%d.%m.%Y"), cls="text-red-600 font-bold" if due < today else None)
+        ))
+    return Table(
+        Thead(Tr(Th("Art"), Th("Element"), Th("Details"), Th("Grundriss"), Th("Fällig"))),
+        Tbody(*rows),
+        cls="uk-table uk-table-divider uk-table-hover"
+    )
+
+@nr.post('/notifications/refresh')
+def refresh_notifications_now():
+    try:
+        refresh_notifications(db)
+        return Redirect("/notifications")
+    except Exception as e:
+        return Div(f"Fehler beim Aktualisieren der Benachrichtigungen: {str(e)}", cls="error-message")
+
+@nr.get('/notifications')
+def notifications_page():
+    today = datetime.date.today()
+    # Assuming user_id = 1 for now, like the floor plan overview
+    items = list_notifications(1)
+    overdue = [n for n in items if to_date(n['due_date']) < today]
+    upcoming = [n for n in items if n not in overdue]
+
+    def section(title, items, empty):
+        return Card(
+            CardHeader(H3(f"{title} ({len(items)})")),
+            CardBody(notification_table(items, today) if items else P(empty, cls="text-muted"))
+        )
+
+    return Titled(
+        "Benachrichtigungen",
+        NavBar(
+            A("Home", href="/"),
+            A("Grundrisse", href="/floorplans"),
+            Button("Jetzt aktualisieren", hx_post="/notifications/refresh", cls="uk-button uk-button-default"),
+        ),
+        Container(
+            section("Überfällig", overdue, "Keine überfälligen Wartungen oder Schulungen."),
+            section(f"In den nächsten {NOTICE_DAYS} Tagen fällig", upcoming, "Nichts in den nächsten Tagen fällig."),
+            P(f"Es werden höchstens {PAGE_LIMIT} Einträge angezeigt.", cls="text-muted") if len(items) == PAGE_LIMIT else None,
+            cls=("mt-5", "uk-container-xl", "space-y-4")
+        )
+    )
@@ -0,0 +1,181 @@
+"""
+Storage codecs for serialized floor plan documents (element lists).
+
+``encode`` prefixes every blob with ``FPC`` and a one-byte codec id, so
+``decode`` never needs to be told the format. Anything without the prefix is
+taken to be a legacy JSON document (``floorplans.data`` rows, old S3 objects).
+
+Codecs, selected per deployment with ``EASE_PLAN_CODEC``:
+
+- ``json``: compact JSON text
+- ``json-gzip``: compact JSON, gzip compressed (default, standard library only)
+- ``json-zstd``: compact JSON, zstd compressed (needs ``zstandard``)
+- ``msgpack``: msgpack with coordinates and widths of regular elements
+  quantized to millimetres (needs ``msgpack``). Lossy below 1 mm; irregular
+  elements and all other fields round-trip unchanged.
+
+``zstandard`` and ``msgpack`` are the ``codecs`` extra. They are imported when
+a codec first needs them; without them that codec raises ``CodecUnavailable``.
+
+``python -m src.plan_codec [--elements N]`` compares the codecs on a
+synthetic plan.
+"""
+import gzip
+import importlib
+import json
+import os
+from src.plan_elements import _is_number, _is_point
+
+_MAGIC = b'FPC'
+
+# Fixed ids stored in the blob header; never renumber
+CODEC_IDS = {'json': 1, 'json-gzip': 2, 'json-zstd': 3, 'msgpack': 4}
+CODEC_NAMES = {v: k for k, v in CODEC_IDS.items()}
+
+# Optional package per codec, from the ``codecs`` extra
+PACKAGES = {'json-zstd': 'zstandard', 'msgpack': 'msgpack'}
+
+DEFAULT_CODEC = os.getenv('EASE_PLAN_CODEC', 'json-gzip')
+
+# Codecs that round-trip every element exactly
+LOSSLESS_CODECS = ('json', 'json-gzip', 'json-zstd')
+
+# msgpack stores coordinates as integer millimetres
+_QUANTUM = 1000
+
+class CodecError(ValueError): pass
+class CodecUnavailable(CodecError): pass  # The optional package of a codec is missing
+
+def _json_bytes(elements):
+    return json.dumps(elements, separators=(',', ':')).encode('utf-8')
+
+_STANDARD_KEYS = {'id', 'element_type', 'start', 'end', 'width', 'properties'}
+
+def _pack_element(element):
+    # Regular editor elements become a flat array of integers; anything else is stored as is
+    start, end, width, properties = (element.get(k) for k in ('start', 'end', 'width', 'properties'))
+    if not (element.keys() == _STANDARD_KEYS and isinstance(element['element_type'], str)
+            and _is_point(start) and _is_point(end) and _is_number(width) and isinstance(properties, dict)):
+        return element
+    points = properties.get('points')
+    if isinstance(points, list) and all(_is_point(p) for p in points):
+        properties = {k: v for k, v in properties.items() if k != 'points'}
+        points = [round(v * _QUANTUM) for p in points for v in (p['x'], p['y'])]
+    else:
+        points = None
+    return [element['id'], element['element_type'],
+            round(start['x'] * _QUANTUM), round(start['y'] * _QUANTUM),
+            round(end['x'] * _QUANTUM), round(end['y'] * _QUANTUM),
+            round(width * _QUANTUM), properties, points]
+
+def _unpack_element(packed):
+    if isinstance(packed, dict): return packed
+    element_id, element_type, sx, sy, ex, ey, width, properties, points = packed
+    if points is not None:
+        properties['points'] = [{'x': x / _QUANTUM, 'y': y / _QUANTUM} for x, y in zip(points[::2], points[1::2])]
+    return {'id': element_id, 'element_type': element_type,
+            'start': {'x': sx / _QUANTUM, 'y': sy / _QUANTUM}, 'end': {'x': ex / _QUANTUM, 'y': ey / _QUANTUM},
+            'width': width / _QUANTUM, 'properties': properties}
+
+def _require(codec):
+    """The optional package of ``codec``, imported on first use"""
+    try:
+        return importlib.import_module(PACKAGES[codec])
+    except ImportError:
+        raise CodecUnavailable(f"Codec {codec!r} needs the {PACKAGES[codec]} package "
+                               f"(pip install 'ease-hs[codecs]')") from None
+
+def available(codec):
+    """Whether ``codec`` can be used in this installation"""
+    if codec not in PACKAGES: return codec in CODEC_IDS
+    try:
+        _require(codec)
+        return True
+    except CodecUnavailable:
+        return False
+
+def encode(elements, codec=None):
+    """Serialize an element list to bytes with ``codec`` (default: ``EASE_PLAN_CODEC``)"""
+    codec = codec or DEFAULT_CODEC
+    if codec not in CODEC_IDS: raise CodecError(f"Unknown plan codec {codec!r}")
+    if codec == 'json': body = _json_bytes(elements)
+    elif codec == 'json-gzip': body = gzip.compress(_json_bytes(elements), compresslevel=6, mtime=0)
+    elif codec == 'json-zstd': body = _require(codec).ZstdCompressor(level=3).compress(_json_bytes(elements))
+    else: body = _require(codec).packb([_pack_element(e) for e in elements], use_bin_type=True)
+    return _MAGIC + bytes([CODEC_IDS[codec]]) + body
+
+def codec_of(blob):
+    """Name of the codec a blob was written with; ``None`` for legacy JSON"""
+    if isinstance(blob, (bytes, bytearray, memoryview)) and bytes(blob[:3]) == _MAGIC:
+        return CODEC_NAMES.get(blob[3])
+    return None
+
+def decode(blob):
+    """Element list from ``encode`` output or a legacy JSON document (str or bytes)"""
+    if isinstance(blob, str): return json.loads(blob)
+    blob = bytes(blob)
+    if blob[:3] != _MAGIC: return json.loads(blob.decode('utf-8'))
+    codec, body = CODEC_NAMES.get(blob[3]), blob[4:]
+    if codec == 'json': return json.loads(body)
+    if codec == 'json-gzip': return json.loads(gzip.decompress(body))
+    if codec == 'json-zstd': return json.loads(_require(codec).ZstdDecompressor().decompress(body))
+    if codec == 'msgpack': return [_unpack_element(p) for p in _require(codec).unpackb(body, raw=False)]
+    raise CodecError(f"Unknown plan codec id {blob[3]}")
+
+def synthetic_plan(count, seed=0):
+    """Element list resembling an editor plan: walls, doors, windows, routes and equipment"""
+    import random
+    rng = random.Random(seed)
+    coord = lambda: rng.uniform(0, 1000)
+    kinds = ['wall'] * 5 + ['door-standard', 'door-emergency', 'window', 'emergency-route',
+                            'machine', 'closet', 'emergency-kit']
+    plan = []
+    for i in range(count):
+        kind = rng.choice(kinds)
+        x, y = coord(), coord()
+        element = {'id': f'element_{1700000000000 + i}_{rng.randrange(1000)}', 'element_type': kind,
+                   'start': {'x': x, 'y': y}, 'end': {'x': x + rng.uniform(-10, 10), 'y': y + rng.uniform(-10, 10)},
+                   'width': rng.choice([0.1, 0.15, 0.2, 0.3]), 'properties': {}}
+        if kind == 'emergency-route':
+            element['properties']['points'] = [{'x': coord(), 'y': coord()} for _ in range(rng.randint(2, 6))]
+        if kind in ('machine', 'closet', 'emergency-kit'):
+            element['properties']['name'] = f'{kind} {i}'
+        plan.append(element)
+    return plan
+
+def benchmark(count=50_000, repeat=3):
+    """Size and encode/decode time of every available codec on a synthetic plan"""
+    import time
+    plan = synthetic_plan(count)
+    legacy = json.dumps(plan, indent=2)
+    start = time.perf_counter()
+    for _ in range(repeat): json.loads(legacy)
+    results = [('legacy json (indent=2)', len(legacy.encode('utf-8')), None, (time.perf_counter() - start) / repeat)]
+    for codec in CODEC_IDS:
+        try:
+            start = time.perf_counter()
+            for _ in range(repeat): blob = encode(plan, codec)
+            encoded = time.perf_counter()
+            for _ in range(repeat): decode(blob)
+            results.append((codec, len(blob), (encoded - start) / repeat, (time.perf_counter() - encoded) / repeat))
+        except CodecError as e:
+            print(f"skipping {codec}: {e}")
+    return results
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m src.plan_codec", description="Benchmark the floor plan codecs")
+    parser.add_argument("--elements", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    results = benchmark(args.elements, args.repeat)
+    baseline = results[0][1]
+    print(f"{args.elements} elements")
+    print(f"{'codec':<24}{'bytes':>12}{'ratio':>8}{'encode ms':>11}{'decode ms':>11}")
+    for name, size, encode_s, decode_s in results:
+        encode_ms = f"{encode_s * 1000:.1f}" if encode_s is not None else '-'
+        print(f"{name:<24}{size:>12}{size / baseline:>8.2f}{encode_ms:>11}{decode_s * 1000:>11.1f}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
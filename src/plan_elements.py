@@ -0,0 +1,140 @@
+"""
+Per-element storage of floor plan geometry in the ``floorplan_elements`` table.
+
+Editor elements look like ``{"id", "element_type", "start": {"x", "y"},
+"end": {"x", "y"}, "width", "properties"}``; machines, closets and kits use
+start/end as opposite corners. Those fields map to typed columns, anything
+else is kept verbatim in the ``extra`` JSON column so conversion is lossless.
+
+Functions take the database as their first argument, so they can run on
+any connection without importing src.db.
+"""
+import json
+
+COLUMNS = ('floorplan_id', 'element_id', 'element_type', 'seq',
+           'start_x', 'start_y', 'end_x', 'end_y', 'width', 'properties', 'extra')
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _is_point(value):
+    return isinstance(value, dict) and set(value) == {'x', 'y'} and all(_is_number(v) for v in value.values())
+
+def element_to_row(floorplan_id, element, seq):
+    """Split an editor element into a ``floorplan_elements`` row (tuple in ``COLUMNS`` order)"""
+    extra = {k: v for k, v in element.items()
+             if k not in ('id', 'element_type', 'start', 'end', 'width', 'properties')}
+    start, end, width = element.get('start'), element.get('end'), element.get('width')
+    if 'start' in element and not _is_point(start): extra['start'], start = start, None
+    if 'end' in element and not _is_point(end): extra['end'], end = end, None
+    if 'width' in element and not _is_number(width): extra['width'], width = width, None
+    if 'element_type' in element and not isinstance(element['element_type'], str):
+        extra['element_type'] = element['element_type']
+    properties = element.get('properties')
+    if 'properties' in element and not isinstance(properties, dict):
+        extra['properties'], properties = properties, None
+    return (
+        floorplan_id, element['id'],
+        element.get('element_type') if 'element_type' not in extra else None,
+        seq,
+        start['x'] if start else None, start['y'] if start else None,
+        end['x'] if end else None, end['y'] if end else None,
+        width,
+        json.dumps(properties, separators=(',', ':')) if properties is not None else None,
+        json.dumps(extra, separators=(',', ':')) if extra else None,
+    )
+
+def row_to_element(row):
+    """Rebuild an editor element from a row mapping with ``COLUMNS`` keys"""
+    element = {'id': row['element_id']}
+    if row['element_type'] is not None: element['element_type'] = row['element_type']
+    if row['start_x'] is not None: element['start'] = {'x': row['start_x'], 'y': row['start_y']}
+    if row['end_x'] is not None: element['end'] = {'x': row['end_x'], 'y': row['end_y']}
+    if row['width'] is not None: element['width'] = row['width']
+    if row['properties'] is not None: element['properties'] = json.loads(row['properties'])
+    if row['extra']: element.update(json.loads(row['extra']))
+    return element
+
+_SELECT = f"SELECT {', '.join(COLUMNS)} FROM floorplan_elements"
+
+def load_elements(db, floorplan_id):
+    """All elements of a floor plan in drawing order"""
+    return [row_to_element(row) for row in db.query(
+        f"{_SELECT} WHERE floorplan_id=? ORDER BY seq", (floorplan_id,))]
+
+def load_elements_by_id(db, floorplan_id, element_ids):
+    """Selected elements of a floor plan, keyed by element id"""
+    if not element_ids: return {}
+    marks = ', '.join('?' * len(element_ids))
+    return {row['element_id']: row_to_element(row) for row in db.query(
+        f"{_SELECT} WHERE floorplan_id=? AND element_id IN ({marks})", (floorplan_id, *element_ids))}
+
+_UPSERT = f"""INSERT INTO floorplan_elements ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})
+    ON CONFLICT (floorplan_id, element_id) DO UPDATE SET
+    {', '.join(f'{c}=excluded.{c}' for c in COLUMNS[2:])}"""
+
+def replace_elements(db, floorplan_id, elements_data):
+    """Make the stored elements match ``elements_data`` exactly (full-document save)"""
+    rows = [element_to_row(floorplan_id, element, seq) for seq, element in enumerate(elements_data)]
+    submitted = {row[1] for row in rows}
+    existing = [r[0] for r in db.execute(
+        "SELECT element_id FROM floorplan_elements WHERE floorplan_id=?", (floorplan_id,))]
+    delete_elements(db, floorplan_id, [e for e in existing if e not in submitted])
+    if rows: db.conn.executemany(_UPSERT, rows)
+
+def upsert_elements(db, floorplan_id, elements_data):
+    """Insert or replace individual elements; new elements are appended after the last one"""
+    if not elements_data: return
+    existing = {r[0]: r[1] for r in db.execute(
+        f"SELECT element_id, seq FROM floorplan_elements WHERE floorplan_id=? AND element_id IN ({', '.join('?' * len(elements_data))})",
+        (floorplan_id, *[e['id'] for e in elements_data]))}
+    next_seq = db.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM floorplan_elements WHERE floorplan_id=?",
+                          (floorplan_id,)).fetchone()[0]
+    rows = []
+    for element in elements_data:
+        seq = existing.get(element['id'])
+        if seq is None:
+            seq, next_seq = next_seq, next_seq + 1
+            existing[element['id']] = seq
+        rows.append(element_to_row(floorplan_id, element, seq))
+    db.conn.executemany(_UPSERT, rows)
+
+def delete_elements(db, floorplan_id, element_ids):
+    if not element_ids: return
+    db.conn.executemany("DELETE FROM floorplan_elements WHERE floorplan_id=? AND element_id=?",
+                        [(floorplan_id, element_id) for element_id in element_ids])
+
+_RTREE_SELECT = (f"SELECT {', '.join('fe.' + c for c in COLUMNS)}, r.min_x AS bbox_min_x, r.min_y AS bbox_min_y, "
+                 f"r.max_x AS bbox_max_x, r.max_y AS bbox_max_y "
+                 f"FROM floorplan_elements_rtree r JOIN floorplan_elements fe ON fe.id = r.id")
+
+def _with_bbox(row):
+    return row_to_element(row), (row['bbox_min_x'], row['bbox_min_y'], row['bbox_max_x'], row['bbox_max_y'])
+
+def query_bbox(db, floorplan_id, min_x, min_y, max_x, max_y):
+    """``(element, bbox)`` pairs whose bounding box intersects the given box, in drawing order.
+    Boxes are ``(min_x, min_y, max_x, max_y)`` as stored in the R-tree."""
+    return [_with_bbox(row) for row in db.query(
+        f"""{_RTREE_SELECT} WHERE r.min_fp <= ? AND r.max_fp >= ?
+            AND r.max_x >= ? AND r.min_x <= ? AND r.max_y >= ? AND r.min_y <= ? ORDER BY fe.seq""",
+        (floorplan_id, floorplan_id, min_x, max_x, min_y, max_y))]
+
+def element_bbox(db, floorplan_id, element_id):
+    """Bounding box of one element, or None if it has no geometry"""
+    row = db.execute(
+        """SELECT r.min_x, r.min_y, r.max_x, r.max_y FROM floorplan_elements fe
+           JOIN floorplan_elements_rtree r ON r.id = fe.id WHERE fe.floorplan_id=? AND fe.element_id=?""",
+        (floorplan_id, element_id)).fetchall()
+    return tuple(row[0]) if row else None
+
+def query_tile(db, floorplan_id, min_x, min_y, max_x, max_y, min_extent=0.0):
+    """``(seq, element)`` pairs intersecting the box, in drawing order, skipping elements whose
+    bounding box is smaller than ``min_extent`` in both directions"""
+    return [(row['seq'], row_to_element(row)) for row in db.query(
+        f"""{_RTREE_SELECT} WHERE r.min_fp <= ? AND r.max_fp >= ?
+            AND r.max_x >= ? AND r.min_x <= ? AND r.max_y >= ? AND r.min_y <= ?
+            AND (r.max_x - r.min_x >= ? OR r.max_y - r.min_y >= ?) ORDER BY fe.seq""",
+        (floorplan_id, floorplan_id, min_x, max_x, min_y, max_y, min_extent, min_extent))]
+
+def count_elements(db, floorplan_id):
+    return db.execute("SELECT COUNT(*) FROM floorplan_elements WHERE floorplan_id=?", (floorplan_id,)).fetchone()[0]
@@ -0,0 +1,395 @@
+"""
+Server-side rendering of floor plans to SVG, PDF and PNG.
+
+The drawing follows ``renderToContext`` in static/js/floorplanner/render.js
+with ``exporting`` set: the plan is fitted into the image like the editor
+canvas (90 % of the smaller axis, centred) and the same colours, line widths
+and pixel-sized symbols are used. Selections and previews are not drawn.
+
+Elements are first turned into drawing primitives in pixel coordinates,
+which are then written out as:
+
+- ``svg``: SVG 1.1 text (standard library only)
+- ``pdf``: a one-page vector PDF, one point per pixel (standard library only)
+- ``png``: the SVG rasterized with ``cairosvg`` (the ``render`` extra,
+  imported on first use; without it PNG raises ``RenderUnavailable``)
+
+Rendered images are cached on disk under ``EASE_RENDER_CACHE``, keyed by
+floor plan, revision and render parameters, so a plan is drawn once per
+revision and parameter set.
+"""
+import functools
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import zlib
+
+FORMATS = {'svg': 'image/svg+xml', 'pdf': 'application/pdf', 'png': 'image/png'}
+
+CACHE_DIR = os.getenv('EASE_RENDER_CACHE', 'data/render_cache')
+# Cached images kept per plan; the least recently written are dropped first
+CACHE_PER_PLAN = int(os.getenv('EASE_RENDER_CACHE_PER_PLAN', '32'))
+
+MAX_PIXELS = 8192
+GRID_SIZE = 0.5  # Metres, like currentState.gridSize
+
+class RenderError(ValueError): pass
+class RenderUnavailable(RenderError): pass  # The optional dependency of a format is missing
+
+def _cairosvg():
+    try:
+        import cairosvg
+    except (ImportError, OSError):  # OSError: the cairo library itself is missing
+        raise RenderUnavailable("PNG rendering needs the cairosvg package (pip install 'ease-hs[render]')") from None
+    return cairosvg
+
+@functools.cache
+def png_available():
+    """Whether PNG images can be rendered in this installation"""
+    try:
+        _cairosvg()
+        return True
+    except RenderUnavailable:
+        return False
+
+def _color(value):
+    """``(r, g, b, alpha)`` of a canvas colour string"""
+    if value.startswith('rgba('):
+        r, g, b, a = (float(v) for v in value[5:-1].split(','))
+        return int(r), int(g), int(b), a
+    if value == 'white': value = '#fff'
+    value = value.lstrip('#')
+    if len(value) == 3: value = ''.join(c * 2 for c in value)
+    return int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16), 1.0
+
+# Drawing primitives, in pixels:
+#   ('path', points, closed, fill, stroke, line_width, cap, dash)
+#   ('arc', cx, cy, radius, start_angle, end_angle, stroke, line_width, dash)  clockwise on screen
+#   ('circle', cx, cy, radius, fill, stroke, line_width)
+#   ('text', x, y, text, size, fill, bold)  centred on x, y
+
+def _line(a, b, stroke, line_width, cap='butt', dash=None):
+    return ('path', [a, b], False, None, stroke, line_width, cap, dash)
+
+def _rect(x, y, w, h, fill, stroke, line_width):
+    return ('path', [(x, y), (x + w, y), (x + w, y + h), (x, y + h)], True, fill, stroke, line_width, 'butt', None)
+
+def _line_width(value):
+    # The canvas ignores line widths that are not positive and keeps its default of 1
+    return value if value > 0 else 1
+
+def _door_swing(start, end, kind):
+    length = math.dist(start, end)
+    if not length: return []
+    dir_x, dir_y = (end[0] - start[0]) / length, (end[1] - start[1]) / length
+    perp_x, perp_y = -dir_y, dir_x
+    center_x, center_y = (start[0] + end[0]) / 2, (start[1] + end[1]) / 2
+    color = '#d9534f' if kind == 'emergency' else '#666'
+    shapes = [('arc', center_x, center_y, length / 2, math.atan2(-perp_y, -perp_x), math.atan2(perp_y, perp_x),
+               color, 1, (3, 3))]
+    if kind == 'emergency':
+        shapes.append(('text', center_x + perp_x * 15, center_y + perp_y * 15, 'EXIT', 10, '#d9534f', False))
+    return shapes
+
+def _window_markers(start, end):
+    length = math.dist(start, end)
+    if not length: return []
+    dir_x, dir_y = (end[0] - start[0]) / length, (end[1] - start[1]) / length
+    count = max(2, math.floor(length / 15))
+    spacing = length / count
+    shapes = []
+    for i in range(1, count):
+        x, y = start[0] + dir_x * spacing * i, start[1] + dir_y * spacing * i
+        shapes.append(_line((x - dir_y * 5, y + dir_x * 5), (x + dir_y * 5, y - dir_x * 5), '#5bc0de', 1))
+    return shapes
+
+def _route_arrows(start, end):
+    length = math.dist(start, end)
+    if length < 10: return []
+    dir_x, dir_y = (end[0] - start[0]) / length, (end[1] - start[1]) / length
+    count = max(1, math.floor(length / 50))
+    shapes = []
+    for i in range(1, count + 1):
+        pos = i / (count + 1)
+        tip_x, tip_y = start[0] + dir_x * length * pos + dir_x * 10, start[1] + dir_y * length * pos + dir_y * 10
+        shapes.append(('path', [(tip_x, tip_y),
+                                (tip_x - dir_x * 15 + dir_y * 5, tip_y - dir_y * 15 - dir_x * 5),
+                                (tip_x - dir_x * 15 - dir_y * 5, tip_y - dir_y * 15 + dir_x * 5)],
+                       True, '#28a745', None, 0, 'butt', None))
+    return shapes
+
+def _machine_symbol(center, size):
+    shapes = [('circle', center[0], center[1], size * 0.3, None, '#333', 2)]
+    for i in range(8):
+        angle = i * math.pi * 2 / 8
+        shapes.append(_line((center[0] + math.cos(angle) * size * 0.3, center[1] + math.sin(angle) * size * 0.3),
+                            (center[0] + math.cos(angle) * size * 0.5, center[1] + math.sin(angle) * size * 0.5),
+                            '#333', 2))
+    return shapes
+
+def _warning_symbol(center, size):
+    half = size / 2
+    return [('path', [(center[0], center[1] - half), (center[0] + half, center[1] + half),
+                      (center[0] - half, center[1] + half)], True, None, '#333', 2, 'butt', None),
+            ('text', center[0], center[1] + size * 0.1, '!', size * 0.5, '#333', True)]
+
+def element_shapes(element, scale, offset):
+    """Drawing primitives for one element, like drawElement in render.js"""
+    to_px = lambda p: (p['x'] * scale + offset[0], p['y'] * scale + offset[1])
+    start, end = to_px(element['start']), to_px(element['end'])
+    kind = element['element_type']
+    width = element.get('width') or 0
+    if kind == 'wall':
+        return [_line(start, end, '#333', _line_width(width * scale), 'round')]
+    if kind in ('door-standard', 'door-emergency'):
+        color = '#666' if kind == 'door-standard' else '#d9534f'
+        return [_line(start, end, color, _line_width(width * scale)),
+                *_door_swing(start, end, kind.removeprefix('door-'))]
+    if kind == 'window':
+        return [_line(start, end, '#5bc0de', _line_width(width * scale)), *_window_markers(start, end)]
+    if kind == 'emergency-route':
+        points = [to_px(p) for p in (element.get('properties') or {}).get('points') or [element['start'], element['end']]]
+        shapes = [('path', points, False, None, 'rgba(40, 167, 69, 0.5)', _line_width((width or 1) * scale),
+                   'round', None)]
+        for a, b in zip(points, points[1:]):
+            shapes.extend(_route_arrows(a, b))
+        return shapes
+    if kind in ('machine', 'closet'):
+        w, h = abs(end[0] - start[0]), abs(end[1] - start[1])
+        x, y = min(start[0], end[0]), min(start[1], end[1])
+        center = (x + w / 2, y + h / 2)
+        if kind == 'machine':
+            return [_rect(x, y, w, h, '#f0ad4e', '#333', 1), *_machine_symbol(center, w * 0.7)]
+        return [_rect(x, y, w, h, 'rgba(217, 83, 79, 0.6)', '#333', 1), *_warning_symbol(center, min(w, h) * 0.6)]
+    if kind == 'emergency-kit':
+        radius = 0.5 * scale
+        cx, cy = (start[0] + end[0]) / 2, (start[1] + end[1]) / 2
+        return [('circle', cx, cy, radius, 'rgba(220, 53, 69, 0.8)', '#dc3545', 1),
+                _line((cx - radius * 0.7, cy), (cx + radius * 0.7, cy), '#fff', 2),
+                _line((cx, cy - radius * 0.7), (cx, cy + radius * 0.7), '#fff', 2)]
+    return []
+
+def plan_shapes(elements, plan_width, plan_height, width, height, grid=False):
+    """Drawing primitives for a plan fitted into a ``width`` x ``height`` pixel image"""
+    scale = min(width / plan_width, height / plan_height) * 0.9
+    offset = ((width - plan_width * scale) / 2, (height - plan_height * scale) / 2)
+    shapes = [_rect(0, 0, width, height, '#fff', None, 0)]
+    if grid:
+        spacing = GRID_SIZE * scale
+        x = offset[0] % spacing
+        while x < width:
+            shapes.append(_line((x, 0), (x, height), '#ddd', 0.5))
+            x += spacing
+        y = offset[1] % spacing
+        while y < height:
+            shapes.append(_line((0, y), (width, y), '#ddd', 0.5))
+            y += spacing
+    for element in elements:
+        shapes.extend(element_shapes(element, scale, offset))
+    return shapes
+
+def _arc_sweep(start_angle, end_angle):
+    # Canvas arcs run clockwise from start to end, wrapping around once
+    return (end_angle - start_angle) % (2 * math.pi) or 2 * math.pi
+
+# SVG
+
+def _svg_paint(attr, color):
+    if color is None: return f'{attr}="none"'
+    r, g, b, a = _color(color)
+    return f'{attr}="rgb({r},{g},{b})"' + (f' {attr}-opacity="{a:g}"' if a < 1 else '')
+
+def _svg_stroke(stroke, line_width, cap='butt', dash=None):
+    if stroke is None: return 'stroke="none"'
+    attrs = f'{_svg_paint("stroke", stroke)} stroke-width="{line_width:g}"'
+    if cap != 'butt': attrs += f' stroke-linecap="{cap}"'
+    if dash: attrs += f' stroke-dasharray="{",".join(f"{d:g}" for d in dash)}"'
+    return attrs
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def to_svg(shapes, width, height):
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+           f'viewBox="0 0 {width} {height}">']
+    for shape in shapes:
+        if shape[0] == 'path':
+            _, points, closed, fill, stroke, line_width, cap, dash = shape
+            d = 'M' + ' L'.join(f'{x:.2f} {y:.2f}' for x, y in points) + (' Z' if closed else '')
+            out.append(f'<path d="{d}" {_svg_paint("fill", fill)} {_svg_stroke(stroke, line_width, cap, dash)}/>')
+        elif shape[0] == 'arc':
+            _, cx, cy, r, a0, a1, stroke, line_width, dash = shape
+            sweep = _arc_sweep(a0, a1)
+            if sweep >= 2 * math.pi - 1e-9:
+                out.append(f'<circle cx="{cx:.2f}" cy="{cy:.2f}" r="{r:.2f}" fill="none" '
+                           f'{_svg_stroke(stroke, line_width, dash=dash)}/>')
+                continue
+            x0, y0 = cx + r * math.cos(a0), cy + r * math.sin(a0)
+            x1, y1 = cx + r * math.cos(a0 + sweep), cy + r * math.sin(a0 + sweep)
+            out.append(f'<path d="M{x0:.2f} {y0:.2f} A{r:.2f} {r:.2f} 0 {int(sweep > math.pi)} 1 {x1:.2f} {y1:.2f}" '
+                       f'fill="none" {_svg_stroke(stroke, line_width, dash=dash)}/>')
+        elif shape[0] == 'circle':
+            _, cx, cy, r, fill, stroke, line_width = shape
+            out.append(f'<circle cx="{cx:.2f}" cy="{cy:.2f}" r="{r:.2f}" {_svg_paint("fill", fill)} '
+                       f'{_svg_stroke(stroke, line_width)}/>')
+        elif shape[0] == 'text':
+            _, x, y, text, size, fill, bold = shape
+            weight = ' font-weight="bold"' if bold else ''
+            # Centred like textBaseline 'middle': the baseline sits about a third of the size lower
+            out.append(f'<text x="{x:.2f}" y="{y + size * 0.35:.2f}" font-family="Arial, Helvetica, sans-serif" '
+                       f'font-size="{size:g}"{weight} text-anchor="middle" '
+                       f'{_svg_paint("fill", fill)}>{_escape(text)}</text>')
+    out.append('</svg>')
+    return '\n'.join(out).encode('utf-8')
+
+# PDF
+
+# Advance widths (1/1000 em) of the characters the renderer writes; others use the average
+_HELVETICA_WIDTHS = {'E': 667, 'X': 667, 'I': 278, 'T': 611, '!': 278}
+_HELVETICA_BOLD_WIDTHS = {'!': 333}
+
+def _pdf_color(color, op):
+    r, g, b, _ = _color(color)
+    return f'{r / 255:.3f} {g / 255:.3f} {b / 255:.3f} {op}'
+
+def _pdf_arc(cx, cy, r, start, sweep, move=True):
+    # Bezier approximation in segments of at most 90 degrees
+    count = max(1, math.ceil(sweep / (math.pi / 2) - 1e-9))
+    step = sweep / count
+    k = 4 / 3 * math.tan(step / 4)
+    ops = [f'{cx + r * math.cos(start):.2f} {cy + r * math.sin(start):.2f} m'] if move else []
+    for i in range(count):
+        a0, a1 = start + i * step, start + (i + 1) * step
+        c0, s0, c1, s1 = math.cos(a0), math.sin(a0), math.cos(a1), math.sin(a1)
+        ops.append(f'{cx + r * (c0 - k * s0):.2f} {cy + r * (s0 + k * c0):.2f} '
+                   f'{cx + r * (c1 + k * s1):.2f} {cy + r * (s1 - k * c1):.2f} '
+                   f'{cx + r * c1:.2f} {cy + r * s1:.2f} c')
+    return ops
+
+def to_pdf(shapes, width, height):
+    alphas = {}  # (fill alpha, stroke alpha) -> graphics state name
+
+    def style(fill, stroke, line_width, cap='butt', dash=None):
+        ops = []
+        fill_alpha = _color(fill)[3] if fill else 1.0
+        stroke_alpha = _color(stroke)[3] if stroke else 1.0
+        if (fill_alpha, stroke_alpha) != (1.0, 1.0):
+            ops.append(f'/{alphas.setdefault((fill_alpha, stroke_alpha), f"GS{len(alphas)}")} gs')
+        if fill: ops.append(_pdf_color(fill, 'rg'))
+        if stroke:
+            ops += [_pdf_color(stroke, 'RG'), f'{line_width:.2f} w', f'{1 if cap == "round" else 0} J']
+            if dash: ops.append(f'[{" ".join(f"{d:g}" for d in dash)}] 0 d')
+        return ops
+
+    def paint(fill, stroke):
+        return 'B' if fill and stroke else 'f' if fill else 'S' if stroke else 'n'
+
+    # Flip the y axis so pixel coordinates can be used unchanged
+    ops = [f'1 0 0 -1 0 {height} cm']
+    for shape in shapes:
+        ops.append('q')
+        if shape[0] == 'path':
+            _, points, closed, fill, stroke, line_width, cap, dash = shape
+            ops += style(fill, stroke, line_width, cap, dash)
+            ops.append(f'{points[0][0]:.2f} {points[0][1]:.2f} m')
+            ops += [f'{x:.2f} {y:.2f} l' for x, y in points[1:]]
+            if closed: ops.append('h')
+            ops.append(paint(fill, stroke))
+        elif shape[0] == 'arc':
+            _, cx, cy, r, a0, a1, stroke, line_width, dash = shape
+            ops += style(None, stroke, line_width, dash=dash)
+            ops += _pdf_arc(cx, cy, r, a0, _arc_sweep(a0, a1))
+            ops.append('S')
+        elif shape[0] == 'circle':
+            _, cx, cy, r, fill, stroke, line_width = shape
+            ops += style(fill, stroke, line_width)
+            ops += _pdf_arc(cx, cy, r, 0, 2 * math.pi)
+            ops += ['h', paint(fill, stroke)]
+        elif shape[0] == 'text':
+            _, x, y, text, size, fill, bold = shape
+            widths = _HELVETICA_BOLD_WIDTHS if bold else _HELVETICA_WIDTHS
+            text_width = sum(widths.get(c, 556) for c in text) * size / 1000
+            escaped = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            ops += style(fill, None, 0)
+            # The text matrix flips the glyphs back upright
+            ops.append(f'BT /{"F2" if bold else "F1"} {size:.2f} Tf 1 0 0 -1 {x - text_width / 2:.2f} '
+                       f'{y + size * 0.35:.2f} Tm ({escaped}) Tj ET')
+        ops.append('Q')
+    content = zlib.compress('\n'.join(ops).encode('latin-1', 'replace'))
+
+    states = ' '.join(f'/{name} << /ca {fill:g} /CA {stroke:g} >>' for (fill, stroke), name in alphas.items())
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        (f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] /Contents 4 0 R '
+         f'/Resources << /Font << /F1 5 0 R /F2 6 0 R >> /ExtGState << {states} >> >> >>').encode(),
+        f'<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n'.encode() + content + b'\nendstream',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+    ]
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    out += b''.join(f'{offset:010d} 00000 n \n'.encode() for offset in offsets)
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    return bytes(out)
+
+def render_plan(elements, plan_width, plan_height, fmt, width, height, grid=False):
+    """Image of a plan in ``fmt`` ('svg', 'pdf' or 'png') of ``width`` x ``height`` pixels"""
+    if fmt not in FORMATS: raise RenderError(f"Unknown image format {fmt!r}")
+    if not (0 < width <= MAX_PIXELS and 0 < height <= MAX_PIXELS):
+        raise RenderError(f"Image size must be between 1 and {MAX_PIXELS} pixels")
+    if plan_width <= 0 or plan_height <= 0: raise RenderError("Floor plan has no area")
+    shapes = plan_shapes(elements, plan_width, plan_height, width, height, grid)
+    if fmt == 'pdf': return to_pdf(shapes, width, height)
+    svg = to_svg(shapes, width, height)
+    if fmt == 'svg': return svg
+    return _cairosvg().svg2png(bytestring=svg, output_width=width, output_height=height)
+
+# Cache
+
+def cache_path(floorplan_id, revision, fmt, **params):
+    """File a rendering of ``revision`` with ``params`` is cached in"""
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, str(floorplan_id), f'r{revision}-{key}.{fmt}')
+
+def cached_render(floorplan_id, revision, fmt, load, plan_width, plan_height, width, height, grid=False):
+    """Rendered image from the cache, or rendered with the elements returned by ``load()``
+    and stored. Returns ``(image, path)``."""
+    path = cache_path(floorplan_id, revision, fmt, plan_width=plan_width, plan_height=plan_height,
+                      width=width, height=height, grid=grid)
+    try:
+        with open(path, 'rb') as f: return f.read(), path
+    except FileNotFoundError:
+        pass
+    image = render_plan(load(), plan_width, plan_height, fmt, width, height, grid)
+    store_cached(path, image)
+    return image, path
+
+def store_cached(path, image):
+    """Write an image to its ``cache_path`` and drop the plan's oldest cached images"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first so concurrent readers never see a partial image
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f: f.write(image)
+    os.replace(tmp, path)
+    _trim_cache(directory)
+
+def _trim_cache(directory):
+    entries = sorted((e for e in os.scandir(directory) if not e.name.endswith('.tmp')),
+                     key=lambda e: e.stat().st_mtime, reverse=True)
+    for entry in entries[CACHE_PER_PLAN:]:
+        try: os.remove(entry.path)
+        except FileNotFoundError: pass
+
+def clear_cache(floorplan_id):
+    """Drop every cached rendering of a plan"""
+    shutil.rmtree(os.path.join(CACHE_DIR, str(floorplan_id)), ignore_errors=True)
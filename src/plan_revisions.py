@@ -0,0 +1,157 @@
+"""
+Floor plan revision history in the ``floorplan_revisions`` table.
+
+Every save records one row for the revision it created. Every
+``KEYFRAME_INTERVAL`` revisions that row is a keyframe with the complete
+element list; otherwise it is a delta against the previous revision: the
+upserted elements, the deleted element ids and, only when it changed beyond
+appending, the new element order. Element lists are stored with plan_codec,
+always with a lossless codec: merges and restores compare history with the
+stored plan element by element, so a lossy ``EASE_PLAN_CODEC`` (msgpack) is
+only used for exports.
+
+A past revision is rebuilt from the nearest keyframe at or before it plus the
+deltas after that keyframe, i.e. one keyframe and at most
+``KEYFRAME_INTERVAL - 1`` deltas. History older than the newest
+``KEEP_REVISIONS`` revisions is pruned, always cutting at a keyframe so what
+remains can still be rebuilt.
+
+A save may be merged into the revision just before it (``merge_into``), as
+collaborative batches are: the row of that revision is replaced by one delta
+covering both saves, so history keeps one revision per editing window instead
+of one per batch. Revision numbers merged away leave gaps; every delta applies
+to the row before it.
+
+Functions take the database as their first argument, like src.plan_elements.
+"""
+import json
+import os
+from src import plan_codec
+from src.plan_elements import load_elements
+
+KEYFRAME_INTERVAL = int(os.getenv('EASE_REVISION_KEYFRAME_INTERVAL', '20'))
+KEEP_REVISIONS = int(os.getenv('EASE_REVISION_KEEP', '200'))
+
+def history_codec():
+    """Codec of new history rows: the deployment's codec if it is lossless, else json-gzip"""
+    return plan_codec.DEFAULT_CODEC if plan_codec.DEFAULT_CODEC in plan_codec.LOSSLESS_CODECS else 'json-gzip'
+
+def diff_elements(before, after):
+    """``(upserts, deletes, order)`` turning element list ``before`` into ``after``.
+    ``order`` is None when applying upserts and deletes already yields the order of ``after``."""
+    previous = {element['id']: element for element in before}
+    current_ids = {element['id'] for element in after}
+    upserts = [element for element in after if previous.get(element['id']) != element]
+    deletes = [element_id for element_id in previous if element_id not in current_ids]
+    expected = apply_delta(before, upserts, deletes)
+    order = None if [e['id'] for e in expected] == [e['id'] for e in after] else [e['id'] for e in after]
+    return upserts, deletes, order
+
+def apply_delta(elements, upserts, deletes, order=None):
+    """Element list after deleting ``deletes``, then replacing or appending ``upserts``
+    (the same semantics as delete_elements/upsert_elements), then reordering by ``order``"""
+    deleted = set(deletes)
+    by_id = {element['id']: element for element in elements if element['id'] not in deleted}
+    for element in upserts:
+        by_id[element['id']] = element
+    if order is None: return list(by_id.values())
+    return [by_id[element_id] for element_id in order if element_id in by_id]
+
+def compose_deltas(first, second):
+    """``(upserts, deletes)`` of applying delta ``first`` and then ``second``, both
+    ``(upserts, deletes)`` without a new order"""
+    (upserts1, deletes1), (upserts2, deletes2) = first, second
+    # An element deleted by the second delta loses its place, even if it is upserted again
+    dropped = set(deletes2)
+    upserts = {element['id']: element for element in upserts1 if element['id'] not in dropped}
+    for element in upserts2:
+        upserts[element['id']] = element
+    return list(upserts.values()), list(dict.fromkeys([*deletes1, *deletes2]))
+
+def record_revision(db, floorplan_id, revision, timestamp, upserts=(), deletes=(), order=None, current=None,
+                    merge_into=None):
+    """Store the history row for ``revision``, just written to floorplan_elements.
+    Writes a keyframe when one is due or the previous revision is not in the history;
+    pass the plan's elements as ``current`` if they are at hand. With ``merge_into``, a
+    delta is merged into that revision's row if it is the previous one and a delta as well."""
+    previous = db.execute("""SELECT kind, elements, deleted, ordering FROM floorplan_revisions
+                             WHERE floorplan_id=? AND revision=?""", (floorplan_id, revision - 1)).fetchall()
+    if revision % KEYFRAME_INTERVAL == 0 or not previous:
+        if current is None: current = load_elements(db, floorplan_id)
+        db.execute("""INSERT INTO floorplan_revisions (floorplan_id, revision, kind, elements, changes, created_at)
+                      VALUES (?, ?, 'keyframe', ?, ?, ?)""",
+                   (floorplan_id, revision, plan_codec.encode(current, history_codec()), len(current), timestamp))
+        prune_revisions(db, floorplan_id, revision)
+        return
+    kind, blob, deleted, ordering = previous[0]
+    if merge_into == revision - 1 and kind == 'delta' and ordering is None and order is None:
+        upserts, deletes = compose_deltas((plan_codec.decode(blob), json.loads(deleted)), (upserts, deletes))
+        db.execute("DELETE FROM floorplan_revisions WHERE floorplan_id=? AND revision=?", (floorplan_id, merge_into))
+    db.execute("""INSERT INTO floorplan_revisions (floorplan_id, revision, kind, elements, deleted, ordering, changes, created_at)
+                  VALUES (?, ?, 'delta', ?, ?, ?, ?, ?)""",
+               (floorplan_id, revision, plan_codec.encode(list(upserts), history_codec()), json.dumps(list(deletes)),
+                json.dumps(order) if order is not None else None, len(upserts) + len(deletes), timestamp))
+
+def prune_revisions(db, floorplan_id, revision, keep=None):
+    """Drop history older than the newest ``keep`` revisions, cutting at a keyframe"""
+    keep = keep or KEEP_REVISIONS
+    cutoff = db.execute(
+        """SELECT MAX(revision) FROM floorplan_revisions
+           WHERE floorplan_id=? AND kind='keyframe' AND revision<=?""",
+        (floorplan_id, revision - keep + 1)).fetchone()[0]
+    if cutoff is not None:
+        db.execute("DELETE FROM floorplan_revisions WHERE floorplan_id=? AND revision<?", (floorplan_id, cutoff))
+
+def list_revisions(db, floorplan_id):
+    """Revisions available for restoring, newest first"""
+    return db.q("""SELECT revision, kind, changes, created_at FROM floorplan_revisions
+                   WHERE floorplan_id=? ORDER BY revision DESC""", (floorplan_id,))
+
+def load_revision(db, floorplan_id, revision):
+    """Element list of a past revision, or None if it is no longer in the history"""
+    rows = db.execute(
+        """SELECT revision, kind, elements, deleted, ordering FROM floorplan_revisions
+           WHERE floorplan_id=? AND revision<=? AND revision>=(
+               SELECT MAX(revision) FROM floorplan_revisions
+               WHERE floorplan_id=? AND kind='keyframe' AND revision<=?)
+           ORDER BY revision""",
+        (floorplan_id, revision, floorplan_id, revision)).fetchall()
+    # Each delta applies to the row before it; gaps are revisions merged into a later one
+    if not rows or rows[-1][0] != revision: return None
+    elements = plan_codec.decode(rows[0][2])
+    for _, _, blob, deleted, ordering in rows[1:]:
+        elements = apply_delta(elements, plan_codec.decode(blob), json.loads(deleted),
+                               json.loads(ordering) if ordering is not None else None)
+    return elements
+
+def _merge_element(base, ours, theirs):
+    """``(element, conflict)`` for one element id; None stands for absent or deleted"""
+    if ours == base: return theirs, False
+    if theirs == base or theirs == ours: return ours, False
+    return theirs, True
+
+def three_way_merge(base, ours, theirs):
+    """Merge two element lists derived from ``base`` element by element.
+    Returns ``(merged, conflicts)``: ``merged`` keeps the order of ``theirs`` with elements
+    only ``ours`` added appended; ids changed differently on both sides are listed in
+    ``conflicts`` (and keep their version in ``merged``)."""
+    base_by_id = {element['id']: element for element in base}
+    ours_by_id = {element['id']: element for element in ours}
+    theirs_by_id = {element['id']: element for element in theirs}
+    merged, conflicts = [], []
+    for element_id in [*theirs_by_id, *(i for i in ours_by_id if i not in theirs_by_id)]:
+        element, conflict = _merge_element(base_by_id.get(element_id), ours_by_id.get(element_id),
+                                           theirs_by_id.get(element_id))
+        if conflict: conflicts.append(element_id)
+        if element is not None: merged.append(element)
+    return merged, conflicts
+
+def patch_conflicts(base, theirs, upserts, deletes):
+    """Ids a patch written against ``base`` changes differently than ``theirs`` already did"""
+    base_by_id = {element['id']: element for element in base}
+    theirs_by_id = {element['id']: element for element in theirs}
+    ours = apply_delta([e for e in base if e['id'] in {*deletes, *(u['id'] for u in upserts)}], upserts, deletes)
+    ours_by_id = {element['id']: element for element in ours}
+    return [element_id for element_id in dict.fromkeys([*deletes, *(u['id'] for u in upserts)])
+            if _merge_element(base_by_id.get(element_id), ours_by_id.get(element_id),
+                              theirs_by_id.get(element_id))[1]]
@@ -0,0 +1,117 @@
+"""
+Risk dashboard: the highest risk assessments across all floor plans of a user
+and per-plan aggregates, for management reviews.
+
+Both are single joins over ``risk_assessments``, ``elements`` and
+``floorplans``. The top list walks ``idx_risk_assessments_score`` from the
+highest score and stops after ``limit`` rows of the user's plans, so it does
+not sort all assessments. The aggregates are read from the covering
+``idx_risk_assessments_element`` (element, score, ``measure_count``); an
+assessment without measures counts as unmitigated.
+"""
+from fasthtml.common import *
+from monsterui.all import *
+from urllib.parse import urlencode
+from src.db import db
+
+dr = APIRouter()
+
+TOP_LIMIT = 50
+
+def top_risks(user_id, limit=TOP_LIMIT, floorplan_id=None):
+    """The user's risk assessments with the highest scores, optionally of one plan"""
+    sql = """SELECT r.id, r.description, r.risk_score, r.frequency, r.severity, r.probability,
+                     r.measure_count = 0 AS unmitigated, e.element_id, e.name AS element_name,
+                     f.id AS floorplan_id, f.name AS floorplan_name
+              FROM risk_assessments r {join} elements e ON e.id = r.element_id
+              {join} floorplans f ON f.id = e.floorplan_id
+              WHERE f.user_id=?"""
+    args = [user_id]
+    if floorplan_id is None:
+        # CROSS JOIN keeps risk_assessments outermost, so the score index is read from the top
+        # and the walk stops after ``limit`` matches instead of sorting every assessment
+        sql = sql.format(join="CROSS JOIN")
+    else:
+        sql = sql.format(join="JOIN") + " AND f.id=?"
+        args.append(floorplan_id)
+    return db.q(sql + " ORDER BY r.risk_score DESC, r.id DESC LIMIT ?", (*args, limit))
+
+def plan_risk_summary(user_id):
+    """Per plan of the user: number of assessments, highest and mean score and how many have no measures"""
+    return db.q(
+        """SELECT f.id AS floorplan_id, f.name AS floorplan_name, COUNT(r.id) AS count,
+                   MAX(r.risk_score) AS max_score, AVG(r.risk_score) AS mean_score,
+                   SUM(r.measure_count = 0) AS unmitigated
+            FROM floorplans f JOIN elements e ON e.floorplan_id = f.id
+            JOIN risk_assessments r ON r.element_id = e.id
+            WHERE f.user_id=? GROUP BY f.id ORDER BY max_score DESC, mean_score DESC""",
+        (user_id,))
+
+def score_cls(score):
+    """Text colour of a risk score (frequency × severity × probability, 1-125)"""
+    if score >= 60: return "text-red-600 font-bold"
+    if score >= 27: return "text-orange-500 font-bold"
+    return None
+
+def top_risks_table(risks):
+    rows = []
+    for rank, risk in enumerate(risks, 1):
+        href = f"/show-floorplan/{risk['floorplan_id']}?{urlencode(dict(element=risk['element_id']))}"
+        rows.append(Tr(
+            Td(rank),
+            Td(f"{risk['risk_score']} ({risk['frequency']}×{risk['severity']}×{risk['probability']})",
+               cls=score_cls(risk['risk_score'])),
+            Td(risk['description']),
+            Td(A(risk['element_name'], href=href)),
+            Td(risk['floorplan_name']),
+            Td(Span("Keine Maßnahmen", cls="uk-label uk-label-danger") if risk['unmitigated'] else "")
+        ))
+    return Table(
+        Thead(Tr(Th("#"), Th("Risiko"), Th("Beschreibung"), Th("Element"), Th("Grundriss"), Th("Maßnahmen"))),
+        Tbody(*rows),
+        cls="uk-table uk-table-divider uk-table-hover uk-table-small"
+    )
+
+def plan_summary_table(plans):
+    return Table(
+        Thead(Tr(Th("Grundriss"), Th("Beurteilungen"), Th("Höchstes Risiko"), Th("Mittleres Risiko"),
+                 Th("Ohne Maßnahmen"))),
+        Tbody(*[Tr(
+            Td(A(plan['floorplan_name'], href=f"/risks?{urlencode(dict(floorplan_id=plan['floorplan_id']))}")),
+            Td(plan['count']),
+            Td(plan['max_score'], cls=score_cls(plan['max_score'])),
+            Td(f"{plan['mean_score']:.1f}".replace('.', ',')),
+            Td(plan['unmitigated'], cls="text-red-600 font-bold" if plan['unmitigated'] else None)
+        ) for plan in plans]),
+        cls="uk-table uk-table-divider uk-table-hover"
+    )
+
+@dr.get('/risks')
+def risk_dashboard(floorplan_id: int = None):
+    try:
+        # Assuming user_id = 1 for now, like the floor plan overview
+        risks = top_risks(1, floorplan_id=floorplan_id)
+        plans = plan_risk_summary(1)
+    except Exception as e:
+        return Div(f"Fehler beim Laden der Risikoübersicht: {str(e)}", cls="error-message")
+    plan_name = next((plan['floorplan_name'] for plan in plans if plan['floorplan_id'] == floorplan_id), None)
+    title = f"Top {TOP_LIMIT} Risiken: {plan_name}" if plan_name else f"Top {TOP_LIMIT} Risiken aller Grundrisse"
+    return Titled(
+        "Risikoübersicht",
+        NavBar(
+            A("Home", href="/"),
+            A("Grundrisse", href="/floorplans"),
+            A("Alle Grundrisse", href="/risks") if floorplan_id is not None else None,
+        ),
+        Container(
+            Card(
+                CardHeader(H3("Risiken je Grundriss")),
+                CardBody(plan_summary_table(plans) if plans else P("Noch keine Gefährdungsbeurteilungen erfasst.", cls="text-muted"))
+            ),
+            Card(
+                CardHeader(H3(title)),
+                CardBody(top_risks_table(risks) if risks else P("Keine Gefährdungsbeurteilungen gefunden.", cls="text-muted"))
+            ),
+            cls=("mt-5", "uk-container-xl", "space-y-4")
+        )
+    )
@@ -0,0 +1,110 @@
+"""
+Risk heatmap of a floor plan: a kernel density raster over the elements with
+risk assessments, weighted by each element's summed ``risk_score``.
+
+Every element contributes a Gaussian around the centre of its bounding box
+(from ``floorplan_elements_rtree``) with a spread of ``BANDWIDTH`` metres, or
+half its size for larger elements. The Gaussian is separable, so the raster
+of a plan is a single matrix product of the per-element x and y profiles,
+computed with NumPy (the ``heatmap`` extra, imported on first use; without
+it rendering raises ``RenderUnavailable``).
+
+Densities are scaled absolutely (``MAX_RISK_SCORE`` at an element's centre
+is full intensity), so colours mean the same on every plan. The image is a
+PNG covering the plan area, transparent where there is no risk, and cached
+with the plan renderings per revision and state of the plan's risks.
+"""
+import hashlib
+import math
+import os
+import struct
+import zlib
+from src.plan_render import RenderUnavailable, cache_path, store_cached
+
+BANDWIDTH = float(os.getenv('EASE_HEATMAP_BANDWIDTH', '2.0'))  # Metres
+CELL_SIZE = 0.25  # Metres per pixel, coarser for plans over MAX_CELLS
+MAX_CELLS = 1024
+MAX_RISK_SCORE = 125  # Frequency × severity × probability, each 1-5
+MAX_ALPHA = 0.6
+
+# Colour ramp from low to high risk: green, yellow, red
+_RAMP = ((0.0, (34, 197, 94)), (0.5, (250, 204, 21)), (1.0, (220, 38, 38)))
+
+_POINTS_SQL = """SELECT (b.min_x + b.max_x) / 2, (b.min_y + b.max_y) / 2,
+                        MAX(b.max_x - b.min_x, b.max_y - b.min_y), SUM(r.risk_score)
+                 FROM elements e
+                 JOIN risk_assessments r ON r.element_id = e.id
+                 JOIN floorplan_elements fe ON fe.floorplan_id = e.floorplan_id AND fe.element_id = e.element_id
+                 JOIN floorplan_elements_rtree b ON b.id = fe.id
+                 WHERE e.floorplan_id=? GROUP BY e.id"""
+
+def risk_points(db, floorplan_id):
+    """``(x, y, size, score)`` of every placed element of the plan with risk assessments"""
+    return db.execute(_POINTS_SQL, (floorplan_id,)).fetchall()
+
+def risk_stamp(db, floorplan_id):
+    """Short key changing whenever a risk assessment of the plan is added, changed or removed"""
+    row = db.execute(
+        """SELECT COUNT(*), MAX(r.id), SUM(r.risk_score), MAX(r.updated_at) FROM risk_assessments r
+           JOIN elements e ON e.id = r.element_id WHERE e.floorplan_id=?""",
+        (floorplan_id,)).fetchone()
+    return hashlib.sha1(repr(row).encode()).hexdigest()[:12]
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RenderUnavailable("The risk heatmap needs the numpy package (pip install 'ease-hs[heatmap]')") from None
+    return numpy
+
+def raster_size(plan_width, plan_height):
+    """``(columns, rows, cell size)`` of the raster of a plan"""
+    cell = max(CELL_SIZE, max(plan_width, plan_height) / MAX_CELLS)
+    return max(1, math.ceil(plan_width / cell)), max(1, math.ceil(plan_height / cell)), cell
+
+def density(points, plan_width, plan_height):
+    """Risk density per raster cell, rows top to bottom"""
+    np = _numpy()
+    columns, rows, cell = raster_size(plan_width, plan_height)
+    if not points: return np.zeros((rows, columns))
+    x, y, size, score = np.array(points, dtype=float).T
+    sigma = np.maximum(BANDWIDTH, np.nan_to_num(size) / 2)[:, None]
+    # Per-element profiles along each axis at the cell centres, shape (elements, cells)
+    profile_x = np.exp(-0.5 * (((np.arange(columns) + 0.5) * cell - x[:, None]) / sigma) ** 2)
+    profile_y = np.exp(-0.5 * (((np.arange(rows) + 0.5) * cell - y[:, None]) / sigma) ** 2)
+    return (profile_y * score[:, None]).T @ profile_x
+
+def colorize(values):
+    """RGBA pixels of a density raster on the green-yellow-red ramp"""
+    np = _numpy()
+    level = np.clip(values / MAX_RISK_SCORE, 0, 1)
+    stops = [stop for stop, _ in _RAMP]
+    channels = [np.interp(level, stops, [color[i] for _, color in _RAMP]) for i in range(3)]
+    alpha = level ** 0.5 * MAX_ALPHA * 255
+    return np.dstack([*channels, alpha]).round().astype(np.uint8)
+
+def to_png(pixels):
+    """PNG of an RGBA pixel array (standard library only)"""
+    np = _numpy()
+    height, width, _ = pixels.shape
+    # Every scanline starts with filter type 0 (none)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), pixels.reshape(height, width * 4)]).tobytes()
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+def render_heatmap(points, plan_width, plan_height):
+    return to_png(colorize(density(points, plan_width, plan_height)))
+
+def cached_heatmap(db, floorplan, stamp):
+    """Heatmap PNG of the plan's current revision and risks, from the cache or rendered and stored"""
+    path = cache_path(floorplan.id, floorplan.revision, 'png', heatmap=stamp, bandwidth=BANDWIDTH,
+                      plan_width=floorplan.width, plan_height=floorplan.height)
+    try:
+        with open(path, 'rb') as f: return f.read()
+    except FileNotFoundError:
+        pass
+    image = render_heatmap(risk_points(db, floorplan.id), floorplan.width, floorplan.height)
+    store_cached(path, image)
+    return image
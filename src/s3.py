@@ -1,34 +1,72 @@
+"""
+S3 storage of floor plan exports and documents.
 
+boto3 only does blocking I/O, so request handlers use the ``*_async``
+functions. These run the calls on a dedicated, bounded thread pool
+(``S3_WORKERS`` threads) and leave the event loop free. The client's
+connection pool has the same size, so every worker keeps a warm
+connection. A slow S3 round trip can then only hold up other S3 calls,
+never other requests.
 
+Presigned download URLs are cached in process per ``s3_key`` and reused
+until ``URL_MARGIN`` seconds before they expire, so a link handed out from
+the cache is always valid for at least that long. Signing is local, but
+saves the HMAC derivation per link on pages listing many documents.
+
+Set ``S3_ENDPOINT_URL`` to use an S3-compatible stand-in such as MinIO or
+``moto_server`` instead of AWS.
+"""
+import asyncio
+import base64
+import functools
+import hashlib
+import threading
+import time
 import boto3,os,json
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
 from dotenv import load_dotenv
+from src import plan_codec
 
 load_dotenv()
 
 # AWS S3 Configuration
-S3_BUCKET = "ease-hs"
-S3_REGION = "eu-central-1"
+S3_BUCKET = os.getenv("S3_BUCKET", "ease-hs")
+S3_REGION = os.getenv("S3_REGION", "eu-central-1")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_WORKERS = int(os.getenv("S3_WORKERS", "16"))
+URL_EXPIRY = 3600  # Seconds a presigned download URL is valid
+URL_MARGIN = 300  # Cached URLs are replaced this long before they expire
+URL_CACHE_SIZE = 10000
 AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY")
 AWS_SECRET_KEY = os.getenv("AWS_SECRET_KEY")
 
-# Initialize S3 client
+# Initialize S3 client; boto3 clients are thread-safe and shared by the executor's workers
 s3_client = boto3.client(
     's3',
     region_name=S3_REGION,
+    endpoint_url=S3_ENDPOINT_URL,
     aws_access_key_id=AWS_ACCESS_KEY,
-    aws_secret_access_key=AWS_SECRET_KEY
+    aws_secret_access_key=AWS_SECRET_KEY,
+    config=Config(max_pool_connections=S3_WORKERS, retries={'max_attempts': 3, 'mode': 'standard'})
 )
 
+_executor = ThreadPoolExecutor(max_workers=S3_WORKERS, thread_name_prefix="s3")
+
+async def run_s3(func, *args, **kwargs):
+    """Run a blocking S3 call on the S3 executor and wait for it without blocking the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
 # S3 Helper Functions
 def upload_floorplan_to_s3(floorplan_id, floorplan_data):
-    """Upload floorplan JSON to S3"""
+    """Upload floorplan elements to S3, encoded with the deployment's plan codec"""
     try:
-        s3_key = f"floorplans/{floorplan_id}.json"
+        s3_key = f"floorplans/{floorplan_id}.fpc"
         s3_client.put_object(
             Bucket=S3_BUCKET,
             Key=s3_key,
-            Body=json.dumps(floorplan_data, indent=2),
-            ContentType='application/json'
+            Body=plan_codec.encode(floorplan_data),
+            ContentType='application/octet-stream'
         )
         return s3_key
     except Exception as e:
@@ -36,12 +74,13 @@ def upload_floorplan_to_s3(floorplan_id, floorplan_data):
         return None
 
 def download_floorplan_from_s3(floorplan_id):
-    """Download floorplan JSON from S3"""
+    """Download floorplan elements from S3, falling back to the legacy JSON object"""
     try:
-        s3_key = f"floorplans/{floorplan_id}.json"
-        response = s3_client.get_object(Bucket=S3_BUCKET, Key=s3_key)
-        floorplan_data = json.loads(response['Body'].read().decode('utf-8'))
-        return floorplan_data
+        try:
+            response = s3_client.get_object(Bucket=S3_BUCKET, Key=f"floorplans/{floorplan_id}.fpc")
+        except s3_client.exceptions.NoSuchKey:
+            response = s3_client.get_object(Bucket=S3_BUCKET, Key=f"floorplans/{floorplan_id}.json")
+        return plan_codec.decode(response['Body'].read())
     except Exception as e:
         print(f"Error downloading floorplan from S3: {str(e)}")
         return None
@@ -71,4 +110,154 @@ def generate_s3_document_url(s3_key, expiration=3600):
         return url
     except Exception as e:
         print(f"Error generating S3 URL: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+def generate_presigned_document_post(s3_key, max_size, expiration=900, sha256=None):
+    """Presigned POST policy letting a browser upload one document of at most ``max_size`` bytes to ``s3_key``.
+    With ``sha256`` (hex) S3 rejects a file with other content. Returns ``{'url': ..., 'fields': {...}}``;
+    the file goes last in the form."""
+    fields = {'Content-Type': 'application/octet-stream'}
+    if sha256: fields['x-amz-checksum-sha256'] = base64.b64encode(bytes.fromhex(sha256)).decode()
+    return s3_client.generate_presigned_post(
+        Bucket=S3_BUCKET, Key=s3_key, Fields=fields,
+        Conditions=[*({name: value} for name, value in fields.items()), ['content-length-range', 1, max_size]],
+        ExpiresIn=expiration
+    )
+
+def document_info(s3_key):
+    """``(size, sha256 hex or None)`` of a stored object, None if it does not exist.
+    The checksum is only known for objects uploaded with one."""
+    try:
+        head = s3_client.head_object(Bucket=S3_BUCKET, Key=s3_key, ChecksumMode='ENABLED')
+    except s3_client.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'): return None
+        raise
+    checksum = head.get('ChecksumSHA256')
+    # Checksums of multipart objects are checksums of the parts' checksums ("...-3"), not of the content
+    sha256 = base64.b64decode(checksum).hex() if checksum and '-' not in checksum else None
+    return head['ContentLength'], sha256
+
+def document_sha256(s3_key):
+    """SHA-256 (hex) of a stored object, read back in chunks"""
+    digest = hashlib.sha256()
+    for chunk in s3_client.get_object(Bucket=S3_BUCKET, Key=s3_key)['Body'].iter_chunks(1024 * 1024):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def document_range(s3_key, start, end):
+    """Bytes ``start`` up to ``end`` (exclusive) of a stored object"""
+    response = s3_client.get_object(Bucket=S3_BUCKET, Key=s3_key, Range=f"bytes={start}-{end - 1}")
+    return response['Body'].read()
+
+def copy_document(source_key, s3_key):
+    """Copy an object within the bucket; S3 copies the bytes, nothing passes through this process"""
+    s3_client.copy({'Bucket': S3_BUCKET, 'Key': source_key}, S3_BUCKET, s3_key)
+    return s3_key
+
+def delete_document(s3_key):
+    try:
+        s3_client.delete_object(Bucket=S3_BUCKET, Key=s3_key)
+    except Exception as e:
+        print(f"Error deleting {s3_key} from S3: {str(e)}")
+
+# Presigned download URLs, cached per key: s3_key -> (url, monotonic time to replace it)
+_url_cache = {}
+_url_lock = threading.Lock()
+
+def document_urls(s3_keys):
+    """Presigned download URLs of many documents in one pass, ``{s3_key: url}``, from the cache
+    where still valid long enough; keys failing to sign are left out"""
+    now = time.monotonic()
+    urls = {}
+    with _url_lock:
+        for s3_key in s3_keys:
+            cached = _url_cache.get(s3_key)
+            if cached and cached[1] > now:
+                urls[s3_key] = cached[0]
+                continue
+            url = generate_s3_document_url(s3_key, URL_EXPIRY)
+            if url is None: continue
+            if len(_url_cache) >= URL_CACHE_SIZE: _trim_url_cache(now)
+            _url_cache[s3_key] = (url, now + URL_EXPIRY - URL_MARGIN)
+            urls[s3_key] = url
+    return urls
+
+def document_url(s3_key):
+    """Presigned download URL of a document, from the cache if still valid long enough; None if it cannot be signed"""
+    return document_urls([s3_key]).get(s3_key)
+
+def _trim_url_cache(now):
+    """Drop expired URLs, and the oldest if that is not enough; called with the lock held"""
+    for s3_key in [key for key, (_, valid_until) in _url_cache.items() if valid_until <= now]:
+        del _url_cache[s3_key]
+    while len(_url_cache) >= URL_CACHE_SIZE:
+        del _url_cache[next(iter(_url_cache))]
+
+# Multipart uploads; every part but the last must be at least 5 MB
+
+def create_multipart_upload(s3_key):
+    """Start a multipart upload, returns its UploadId"""
+    return s3_client.create_multipart_upload(
+        Bucket=S3_BUCKET, Key=s3_key, ContentType='application/octet-stream')['UploadId']
+
+def upload_part(s3_key, upload_id, part_number, data):
+    """Upload one part, returns its ETag"""
+    return s3_client.upload_part(
+        Bucket=S3_BUCKET, Key=s3_key, UploadId=upload_id, PartNumber=part_number, Body=data)['ETag']
+
+def complete_multipart_upload(s3_key, upload_id, parts):
+    """Assemble the object from ``{part_number: etag}``"""
+    s3_client.complete_multipart_upload(
+        Bucket=S3_BUCKET, Key=s3_key, UploadId=upload_id,
+        MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': etag} for n, etag in sorted(parts.items())]})
+    return s3_key
+
+def abort_multipart_upload(s3_key, upload_id):
+    try:
+        s3_client.abort_multipart_upload(Bucket=S3_BUCKET, Key=s3_key, UploadId=upload_id)
+    except Exception as e:
+        print(f"Error aborting multipart upload of {s3_key}: {str(e)}")
+
+# Async API for request handlers
+
+async def upload_floorplan_to_s3_async(floorplan_id, floorplan_data):
+    return await run_s3(upload_floorplan_to_s3, floorplan_id, floorplan_data)
+
+async def download_floorplan_from_s3_async(floorplan_id):
+    return await run_s3(download_floorplan_from_s3, floorplan_id)
+
+async def upload_document_to_s3_async(file_data, s3_key):
+    return await run_s3(upload_document_to_s3, file_data, s3_key)
+
+async def generate_s3_document_url_async(s3_key, expiration=3600):
+    return await run_s3(generate_s3_document_url, s3_key, expiration)
+
+async def generate_presigned_document_post_async(s3_key, max_size, expiration=900, sha256=None):
+    return await run_s3(generate_presigned_document_post, s3_key, max_size, expiration, sha256)
+
+async def document_info_async(s3_key):
+    return await run_s3(document_info, s3_key)
+
+async def document_sha256_async(s3_key):
+    return await run_s3(document_sha256, s3_key)
+
+async def document_range_async(s3_key, start, end):
+    return await run_s3(document_range, s3_key, start, end)
+
+async def copy_document_async(source_key, s3_key):
+    return await run_s3(copy_document, source_key, s3_key)
+
+async def delete_document_async(s3_key):
+    return await run_s3(delete_document, s3_key)
+
+async def create_multipart_upload_async(s3_key):
+    return await run_s3(create_multipart_upload, s3_key)
+
+async def upload_part_async(s3_key, upload_id, part_number, data):
+    return await run_s3(upload_part, s3_key, upload_id, part_number, data)
+
+async def complete_multipart_upload_async(s3_key, upload_id, parts):
+    return await run_s3(complete_multipart_upload, s3_key, upload_id, parts)
+
+async def abort_multipart_upload_async(s3_key, upload_id):
+    return await run_s3(abort_multipart_upload, s3_key, upload_id)
@@ -0,0 +1,79 @@
+"""
+Search page over elements, risk assessments, operating instructions and
+training records of all floor plans (index in src/search_index.py).
+"""
+from fasthtml.common import *
+from monsterui.all import *
+from urllib.parse import urlencode
+from src.db import db
+from src.search_index import search, HIGHLIGHT_START, HIGHLIGHT_END
+
+sr = APIRouter()
+
+KIND_LABELS = {
+    'element': "Element",
+    'risk': "Gefährdungsbeurteilung",
+    'instructions': "Betriebsanweisung",
+    'training': "Schulungsnachweis",
+}
+
+def highlighted(text):
+    """Text with the matched terms of a search result wrapped in Mark"""
+    parts = []
+    for i, chunk in enumerate((text or '').split(HIGHLIGHT_START)):
+        if i == 0:
+            parts.append(chunk)
+            continue
+        match, _, rest = chunk.partition(HIGHLIGHT_END)
+        parts += [Mark(match), rest]
+    return [part for part in parts if part != '']
+
+def search_results(q):
+    results = search(db, q) if q.strip() else []
+    if not q.strip():
+        return Div(P("Suchbegriff eingeben, z.B. eine Maschine, Gefährdung oder einen Mitarbeiter."), id="search-results")
+    if not results:
+        return Div(P(f"Keine Treffer für „{q}“"), id="search-results")
+    items = []
+    for r in results:
+        # The viewer opens the element's properties from the element parameter
+        href = f"/show-floorplan/{r['floorplan_id']}?{urlencode(dict(element=r['element_id']))}"
+        items.append(Li(
+            DivLAligned(
+                Span(KIND_LABELS.get(r['kind'], r['kind']), cls="uk-label mr-2"),
+                Strong(*highlighted(r['title'])),
+                Span(f"Grundriss: {r['floorplan_name']}", cls="text-muted ml-2")
+            ),
+            P(*highlighted(r['snippet'])) if r['snippet'] else None,
+            A("Im Grundriss anzeigen", href=href)
+        ))
+    return Div(P(f"{len(results)} Treffer"), Ul(*items, cls="uk-list uk-list-divider"), id="search-results")
+
+@sr.get('/search/results')
+def search_results_partial(q: str = ""):
+    return search_results(q)
+
+@sr.get('/search')
+def search_page(q: str = ""):
+    return Titled(
+        "Suche",
+        NavBar(
+            A("Home", href="/"),
+            A("Grundrisse", href="/floorplans"),
+        ),
+        Container(
+            Card(
+                CardHeader(H3("Sicherheitsdaten durchsuchen")),
+                CardBody(
+                    Form(
+                        Input(type="search", name="q", value=q, placeholder="z.B. Laser, Presse, Müller",
+                              hx_get="/search/results", hx_trigger="input changed delay:300ms, search",
+                              hx_target="#search-results", hx_swap="outerHTML"),
+                        action="/search", method="get", cls="mb-4"
+                    ),
+                    search_results(q)
+                )
+            ),
+            cls=("mt-5", "uk-container-xl")
+        )
+    )
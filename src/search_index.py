@@ -0,0 +1,125 @@
+"""
+Full-text search over the safety data of elements (FTS5 table ``search_index``).
+
+One index row per searchable record:
+
+- ``element``: name, description, dangers, safety instructions and trained employees
+- ``risk``: a risk assessment's description and measures
+- ``instructions``: the texts of an element's operating instructions
+- ``training``: a training record's training and employee name
+
+Rows of risks, instructions and training records repeat the element's name,
+so "Presse Müller" finds Müller's training record on the press. The rowid encodes kind
+and record id (``id * 4 + kind``), so one record is replaced or removed by
+rowid without scanning the index.
+
+Routes call ``index_record``/``index_element`` after writing and
+``unindex_record``/``unindex_element`` before deleting the source rows;
+``rebuild_index`` fills the index from scratch.
+
+Functions take the database as their first argument, like src.plan_elements.
+"""
+import json
+
+KINDS = ('element', 'risk', 'instructions', 'training')
+
+# Marks around matched terms in ``search`` results; the caller turns them into markup
+HIGHLIGHT_START, HIGHLIGHT_END = '\x02', '\x03'
+
+CREATE_SQL = """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+    title, body, kind UNINDEXED, record_id UNINDEXED, element_id UNINDEXED, floorplan_id UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+)"""
+
+# Source rows per kind: (record id, floorplan id, client element id, element name, *texts).
+# Joining floorplans leaves out elements of deleted plans.
+_SOURCES = {
+    'element': """SELECT e.id, e.floorplan_id, e.element_id, e.name,
+                         e.description, e.dangers, e.safety_instructions, e.trained_employees
+                  FROM elements e JOIN floorplans f ON f.id = e.floorplan_id""",
+    'risk': """SELECT r.id, e.floorplan_id, e.element_id, e.name, r.description,
+                      r.technical_measures, r.organizational_measures, r.personal_measures
+               FROM risk_assessments r JOIN elements e ON e.id = r.element_id
+               JOIN floorplans f ON f.id = e.floorplan_id""",
+    'instructions': """SELECT o.id, e.floorplan_id, e.element_id, e.name, o.hazard_symbols,
+                              o.protection_measures, o.first_aid, o.emergency_procedures, o.maintenance_disposal
+                       FROM operating_instructions o JOIN elements e ON e.id = o.element_id
+                       JOIN floorplans f ON f.id = e.floorplan_id""",
+    'training': """SELECT t.id, e.floorplan_id, e.element_id, t.training_name, t.employee_name, e.name
+                   FROM training_records t JOIN elements e ON e.id = t.element_id
+                   JOIN floorplans f ON f.id = e.floorplan_id""",
+}
+_ID_COLUMNS = {'element': 'e.id', 'risk': 'r.id', 'instructions': 'o.id', 'training': 't.id'}
+_DEPENDENTS = {'risk': 'risk_assessments', 'instructions': 'operating_instructions', 'training': 'training_records'}
+
+def _rowid(kind, record_id):
+    return record_id * len(KINDS) + KINDS.index(kind)
+
+def _text(value):
+    """Searchable text of a column; JSON lists and objects (measures, symbols) contribute their strings"""
+    if not value: return ''
+    if isinstance(value, str):
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            return value
+        if not isinstance(parsed, (list, dict)): return value
+        value = parsed
+    if isinstance(value, str): return value
+    if isinstance(value, dict): return ' '.join(_text(v) for v in value.values())
+    if isinstance(value, list): return ' '.join(_text(v) for v in value)
+    return ''
+
+def _insert(db, kind, rows):
+    db.conn.executemany(
+        "INSERT INTO search_index (rowid, title, body, kind, record_id, element_id, floorplan_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(_rowid(kind, record_id), _text(title) or '', ' '.join(filter(None, map(_text, texts))), kind,
+          record_id, element_id, floorplan_id)
+         for record_id, floorplan_id, element_id, title, *texts in rows])
+
+def unindex_record(db, kind, record_id):
+    db.execute("DELETE FROM search_index WHERE rowid=?", (_rowid(kind, record_id),))
+
+def index_record(db, kind, record_id):
+    """(Re)index one record after it was created or updated"""
+    unindex_record(db, kind, record_id)
+    _insert(db, kind, db.execute(f"{_SOURCES[kind]} WHERE {_ID_COLUMNS[kind]}=?", (record_id,)).fetchall())
+
+def _dependent_ids(db, element_pk):
+    return [(kind, record_id) for kind, table in _DEPENDENTS.items()
+            for (record_id,) in db.execute(f"SELECT id FROM {table} WHERE element_id=?", (element_pk,)).fetchall()]
+
+def index_element(db, element_pk):
+    """(Re)index an element and its records, which repeat the element's name"""
+    for kind, record_id in [('element', element_pk), *_dependent_ids(db, element_pk)]:
+        index_record(db, kind, record_id)
+
+def unindex_element(db, element_pk):
+    """Remove an element and its records from the index; call before deleting them"""
+    for kind, record_id in [('element', element_pk), *_dependent_ids(db, element_pk)]:
+        unindex_record(db, kind, record_id)
+
+def rebuild_index(db):
+    """Index every record from scratch"""
+    db.execute("DELETE FROM search_index")
+    for kind, sql in _SOURCES.items():
+        _insert(db, kind, db.execute(sql).fetchall())
+
+def match_query(text):
+    """FTS5 query matching records that contain every word of ``text``, as a prefix"""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def search(db, text, limit=50):
+    """Records matching ``text``, best first. ``title`` and ``snippet`` carry
+    HIGHLIGHT_START/HIGHLIGHT_END around the matched terms."""
+    query = match_query(text)
+    if not query: return []
+    # The element name is weighted over the rest of the text
+    return db.q(
+        """SELECT s.kind, s.record_id, s.element_id, s.floorplan_id, f.name AS floorplan_name,
+                   highlight(search_index, 0, ?, ?) AS title,
+                   snippet(search_index, 1, ?, ?, '…', 16) AS snippet
+            FROM search_index s JOIN floorplans f ON f.id = s.floorplan_id
+            WHERE search_index MATCH ? ORDER BY bm25(search_index, 5.0, 1.0) LIMIT ?""",
+        (HIGHLIGHT_START, HIGHLIGHT_END, HIGHLIGHT_START, HIGHLIGHT_END, query, limit))
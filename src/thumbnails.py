@@ -0,0 +1,74 @@
+"""
+Thumbnails of floor plans for the overview page.
+
+Each plan has at most one thumbnail in ``floorplan_thumbnails``, tagged with
+the revision it shows. Saves hand ``refresh_thumbnails`` to FastHTML as a
+background task, so the image is rendered after the response has been sent.
+Elements smaller than a pixel of the thumbnail are left out, like in the
+editor's tiles.
+
+Thumbnails are PNG when ``cairosvg`` is installed and SVG otherwise. Their
+URL contains the revision, so they can be cached by browsers for good.
+
+Background tasks run in worker threads, so the queries and the insert hold
+the shared write lock; only the rendering happens outside of it.
+"""
+import datetime
+from src.db import db, write_lock, write_transaction
+from src.plan_elements import query_tile
+from src.plan_render import FORMATS, png_available, render_plan
+
+THUMBNAIL_WIDTH = 240
+THUMBNAIL_HEIGHT = 160
+
+def thumbnail_url(floorplan_id, revision):
+    return f"/floorplan/{floorplan_id}/thumbnail/{revision}"
+
+def thumbnail_revisions(floorplan_ids):
+    """``{floorplan_id: revision}`` of the stored thumbnails of the given plans"""
+    floorplan_ids = list(floorplan_ids)
+    if not floorplan_ids: return {}
+    return dict(db.execute(
+        f"SELECT floorplan_id, revision FROM floorplan_thumbnails WHERE floorplan_id IN ({', '.join('?' * len(floorplan_ids))})",
+        floorplan_ids).fetchall())
+
+def update_thumbnail(floorplan_id):
+    """Render and store the thumbnail of the plan's current revision unless it is up to date.
+    Returns the revision of the stored thumbnail, or None if the plan is missing."""
+    # Plan and elements are read together, so no save can come in between
+    with write_lock:
+        row = db.execute(
+            """SELECT f.revision, f.width, f.height, t.revision FROM floorplans f
+               LEFT JOIN floorplan_thumbnails t ON t.floorplan_id = f.id WHERE f.id=?""",
+            (floorplan_id,)).fetchone()
+        if not row: return None
+        revision, plan_width, plan_height, stored = row
+        if stored is not None and stored >= revision: return stored
+        # The area shown by the image, fitted like plan_render does
+        scale = min(THUMBNAIL_WIDTH / plan_width, THUMBNAIL_HEIGHT / plan_height) * 0.9
+        min_x = -(THUMBNAIL_WIDTH - plan_width * scale) / 2 / scale
+        min_y = -(THUMBNAIL_HEIGHT - plan_height * scale) / 2 / scale
+        elements = [element for _, element in query_tile(
+            db, floorplan_id, min_x, min_y, min_x + THUMBNAIL_WIDTH / scale, min_y + THUMBNAIL_HEIGHT / scale,
+            min_extent=1 / scale)]
+    fmt = 'png' if png_available() else 'svg'
+    image = render_plan(elements, plan_width, plan_height, fmt, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT)
+    # A slower render of an older revision must not replace a newer thumbnail
+    with write_transaction():
+        db.execute(
+            """INSERT INTO floorplan_thumbnails (floorplan_id, revision, media_type, image, created_at)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT (floorplan_id) DO UPDATE SET revision=excluded.revision,
+                   media_type=excluded.media_type, image=excluded.image, created_at=excluded.created_at
+               WHERE excluded.revision > floorplan_thumbnails.revision""",
+            (floorplan_id, revision, FORMATS[fmt], image,
+             datetime.datetime.now().isoformat()))
+    return revision
+
+def refresh_thumbnails(*floorplan_ids):
+    """Background task: bring the thumbnails of the given plans up to date"""
+    for floorplan_id in floorplan_ids:
+        try:
+            update_thumbnail(floorplan_id)
+        except Exception as e:
+            print(f"Error rendering thumbnail of floorplan {floorplan_id}: {str(e)}")
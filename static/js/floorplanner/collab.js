@@ -0,0 +1,183 @@
+// Real-time collaboration: element operations, presence and selections of the
+// other editors of this plan, exchanged over /floorplan_editor/{id}/ws (src/collab.py).
+// The server writes the operations to the database in batches.
+const collabState = {
+    socket: null,
+    clientId: null,
+    clients: [],             // Presence list from the server
+    lastLength: 0,           // Element count at the last full comparison
+    lastFullSync: 0,
+    lastSelectedId: null,
+    lastSelected: null,
+    timer: null
+};
+
+const COLLAB_SYNC_INTERVAL = 100;   // ms between checks for local changes
+const COLLAB_FULL_SYNC_INTERVAL = 2000;
+
+function initCollaboration(canvas) {
+    // Re-initialised after an htmx swap: drop the previous connection first
+    if (collabState.socket) {
+        collabState.socket.onclose = null;
+        collabState.socket.close();
+    }
+    currentState.syncedElements = snapshotElements(currentState.elements);
+    collabState.lastLength = currentState.elements.length;
+    connectCollaboration();
+    if (!collabState.timer) collabState.timer = setInterval(sendLocalOps, COLLAB_SYNC_INTERVAL);
+}
+
+function connectCollaboration() {
+    const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    const socket = new WebSocket(`${protocol}://${window.location.host}/floorplan_editor/${currentState.floorplanId}/ws`);
+    collabState.socket = socket;
+    socket.onmessage = (event) => handleCollabMessage(JSON.parse(event.data));
+    socket.onclose = (event) => {
+        collabState.socket = null;
+        collabState.clients = [];
+        renderPresence();
+        // 4404: the floor plan does not exist; anything else is retried
+        if (event.code !== 4404) setTimeout(connectCollaboration, 2000);
+    };
+}
+
+function sendCollab(message) {
+    if (collabState.socket && collabState.socket.readyState === WebSocket.OPEN) {
+        collabState.socket.send(JSON.stringify(message));
+        return true;
+    }
+    return false;
+}
+
+// Compare elements with what the other editors have and send the differences.
+// Only the selected element can change without the element count changing, so the
+// full comparison runs when the count changes and otherwise every few seconds.
+function sendLocalOps() {
+    if (!collabState.socket || collabState.socket.readyState !== WebSocket.OPEN) return;
+    const synced = currentState.syncedElements;
+    const elements = currentState.elements;
+    const now = Date.now();
+    const full = elements.length !== collabState.lastLength || now - collabState.lastFullSync > COLLAB_FULL_SYNC_INTERVAL;
+    const candidates = full ? elements : [currentState.selectedElement, collabState.lastSelected].filter(Boolean);
+
+    const upsert = [];
+    const remove = [];
+    candidates.forEach(el => {
+        const json = JSON.stringify(el);
+        if (synced.get(el.id) !== json) {
+            synced.set(el.id, json);
+            upsert.push(el);
+        }
+    });
+    if (full) {
+        const ids = new Set(elements.map(el => el.id));
+        synced.forEach((_, id) => {
+            if (!ids.has(id)) remove.push(id);
+        });
+        remove.forEach(id => synced.delete(id));
+        collabState.lastLength = elements.length;
+        collabState.lastFullSync = now;
+    }
+    if (upsert.length || remove.length) sendCollab({ type: 'ops', upsert, delete: remove });
+
+    const selectedId = currentState.selectedElement ? currentState.selectedElement.id : null;
+    if (selectedId !== collabState.lastSelectedId) {
+        sendCollab({ type: 'select', element_id: selectedId });
+        collabState.lastSelectedId = selectedId;
+    }
+    collabState.lastSelected = currentState.selectedElement;
+}
+
+// Apply operations of other editors. Existing element objects are updated in
+// place so a selection or drag in progress keeps pointing at the live element.
+function applyCollabOps(upsert, remove) {
+    const deleted = new Set(remove);
+    if (deleted.size) {
+        currentState.elements = currentState.elements.filter(el => !deleted.has(el.id));
+        if (currentState.selectedElement && deleted.has(currentState.selectedElement.id)) {
+            currentState.selectedElement = null;
+        }
+    }
+    const byId = new Map(currentState.elements.map(el => [el.id, el]));
+    upsert.forEach(el => {
+        const existing = byId.get(el.id);
+        if (existing) {
+            Object.keys(existing).forEach(key => delete existing[key]);
+            Object.assign(existing, el);
+        } else {
+            currentState.elements.push(el);
+        }
+        currentState.syncedElements.set(el.id, JSON.stringify(el));
+        tileState.seen.add(el.id);
+    });
+    remove.forEach(id => currentState.syncedElements.delete(id));
+    collabState.lastLength = currentState.elements.length;
+    render(document.getElementById('floorplan-canvas'));
+}
+
+function handleCollabMessage(message) {
+    switch (message.type) {
+        case 'sync':
+            collabState.clientId = message.client_id;
+            applyCollabOps(message.upsert, message.delete);
+            break;
+        case 'ops':
+            applyCollabOps(message.upsert, message.delete);
+            break;
+        case 'saved':
+            // The batch is in the database now, so the save button has nothing left to send for it
+            currentState.revision = message.revision;
+            message.upsert.forEach(id => {
+                const json = currentState.syncedElements.get(id);
+                if (json !== undefined) currentState.savedElements.set(id, json);
+            });
+            message.delete.forEach(id => currentState.savedElements.delete(id));
+            break;
+        case 'presence':
+            collabState.clients = message.clients;
+            renderPresence();
+            render(document.getElementById('floorplan-canvas'));
+            break;
+    }
+}
+
+function renderPresence() {
+    const container = document.getElementById('collab-presence');
+    if (!container) return;
+    container.replaceChildren(...collabState.clients.map(client => {
+        const badge = document.createElement('span');
+        badge.className = 'collab-badge';
+        badge.style.cssText = 'color: white; padding: 0.1rem 0.5rem; margin-right: 0.25rem; border-radius: 0.75rem; font-size: 0.8rem;';
+        badge.style.backgroundColor = client.color;
+        badge.textContent = client.id === collabState.clientId ? `${client.name} (Sie)` : client.name;
+        return badge;
+    }));
+}
+
+// Outline the elements other editors have selected, in their colour
+function drawRemoteSelections(ctx) {
+    if (!collabState.clients.length) return;
+    const byId = new Map(currentState.elements.map(el => [el.id, el]));
+    collabState.clients.forEach(client => {
+        if (client.id === collabState.clientId || !client.selection) return;
+        const el = byId.get(client.selection);
+        if (!el || !el.start || !el.end) return;
+        const xs = [el.start.x, el.end.x];
+        const ys = [el.start.y, el.end.y];
+        ((el.properties && el.properties.points) || []).forEach(p => { xs.push(p.x); ys.push(p.y); });
+        const pad = 0.2;
+        const x = (Math.min(...xs) - pad) * currentState.scale + currentState.panOffset.x;
+        const y = (Math.min(...ys) - pad) * currentState.scale + currentState.panOffset.y;
+        const w = (Math.max(...xs) - Math.min(...xs) + 2 * pad) * currentState.scale;
+        const h = (Math.max(...ys) - Math.min(...ys) + 2 * pad) * currentState.scale;
+        ctx.save();
+        ctx.strokeStyle = client.color;
+        ctx.lineWidth = 2;
+        ctx.setLineDash([6, 4]);
+        ctx.strokeRect(x, y, w, h);
+        ctx.fillStyle = client.color;
+        ctx.font = '12px sans-serif';
+        ctx.fillText(client.name, x, y - 4);
+        ctx.restore();
+    });
+}
@@ -11,7 +11,10 @@ let currentState = {
     gridSize: 0.5, // Grid size in meters
     isResizing: false,
     resizeHandle: null,
-    showExportGrid: false
+    showExportGrid: false,
+    revision: 0,
+    savedElements: new Map(), // element id -> JSON as last stored on the server
+    syncedElements: new Map() // element id -> JSON as last exchanged with the other editors (collab.js)
 };
 
 // Floor plan editor initialization
@@ -25,6 +28,9 @@ function initFloorPlanEditor() {
     const width = parseFloat(canvas.dataset.width);
     const height = parseFloat(canvas.dataset.height);
     
+    // Large plans are loaded per tile once the view is known (tiles.js)
+    if (initTiles(canvas)) currentState.elements = [];
+    
     // Load elements from data attribute
     try {
         if (canvas.dataset.floorplanElements) {
@@ -35,6 +41,8 @@ function initFloorPlanEditor() {
     } catch (error) {
         console.error('Error parsing floorplan elements:', error);
     }
+    currentState.revision = parseInt(canvas.dataset.revision || '0');
+    currentState.savedElements = snapshotElements(currentState.elements);
     
     // Set up 2D context
     const ctx = canvas.getContext('2d');
@@ -62,6 +70,12 @@ function initFloorPlanEditor() {
     
     // First render
     render(canvas);
+    
+    // Risk heatmap overlay (heatmap.js)
+    initHeatmap(canvas, () => render(canvas));
+    
+    // Share edits with the other editors of this plan
+    initCollaboration(canvas);
 }
 
 document.addEventListener('DOMContentLoaded', () => {
@@ -99,4 +113,142 @@ function deleteSelectedElement() {
         currentState.selectedElement = null;
         render(document.getElementById('floorplan-canvas'));
     }
-}
\ No newline at end of file
+}
+
+// Serialize elements by id so later saves can tell what changed
+function snapshotElements(elements) {
+    return new Map(elements.map(el => [el.id, JSON.stringify(el)]));
+}
+
+// Compute add/update/delete operations relative to the last saved state
+function computeElementPatch() {
+    const patch = { add: [], update: [], delete: [] };
+    const currentIds = new Set();
+    currentState.elements.forEach(el => {
+        currentIds.add(el.id);
+        const saved = currentState.savedElements.get(el.id);
+        if (saved === undefined) {
+            patch.add.push(el);
+        } else if (saved !== JSON.stringify(el)) {
+            patch.update.push(el);
+        }
+    });
+    currentState.savedElements.forEach((_, id) => {
+        if (!currentIds.has(id)) patch.delete.push(id);
+    });
+    return patch;
+}
+
+function showSaveStatus(message, isError) {
+    const status = document.getElementById('save-status');
+    if (!status) return;
+    status.className = isError ? 'error-message' : 'success-message';
+    status.textContent = message;
+}
+
+function markSaved(revision, snapshot) {
+    currentState.revision = revision;
+    currentState.savedElements = snapshot;
+}
+
+// Take over elements others saved since our base revision (merged on the server)
+function applyRemoteChanges(changes) {
+    const deleted = new Set(changes.delete);
+    currentState.elements = currentState.elements.filter(el => !deleted.has(el.id));
+    changes.delete.forEach(id => currentState.savedElements.delete(id));
+    const indexById = new Map(currentState.elements.map((el, i) => [el.id, i]));
+    changes.upsert.forEach(el => {
+        if (indexById.has(el.id)) {
+            currentState.elements[indexById.get(el.id)] = el;
+        } else {
+            indexById.set(el.id, currentState.elements.length);
+            currentState.elements.push(el);
+        }
+        currentState.savedElements.set(el.id, JSON.stringify(el));
+        currentState.syncedElements.set(el.id, JSON.stringify(el));
+        tileState.seen.add(el.id);
+    });
+    changes.delete.forEach(id => {
+        currentState.syncedElements.delete(id);
+        tileState.seen.add(id);
+    });
+    if (currentState.selectedElement) {
+        const index = indexById.get(currentState.selectedElement.id);
+        currentState.selectedElement = deleted.has(currentState.selectedElement.id) || index === undefined
+            ? null : currentState.elements[index];
+    }
+    render(document.getElementById('floorplan-canvas'));
+}
+
+// Replace the local elements with the stored plan, e.g. after a merged full save
+async function reloadElements() {
+    const response = await fetch(`/floorplan_editor/${currentState.floorplanId}/elements`);
+    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+    currentState.elements = await response.json();
+    currentState.syncedElements = snapshotElements(currentState.elements);
+    currentState.selectedElement = null;
+    render(document.getElementById('floorplan-canvas'));
+}
+
+function showConflict(result) {
+    const count = (result.conflicts || []).length;
+    showSaveStatus(count
+        ? `Konflikt: ${count} Element(e) wurden zwischenzeitlich anderweitig geändert. Bitte neu laden.`
+        : 'Der Grundriss wurde zwischenzeitlich geändert. Bitte neu laden.', true);
+}
+
+// Save the floor plan: send only the changed elements, fall back to the full document
+async function saveFloorplan() {
+    const url = `/save_floorplan/${currentState.floorplanId}`;
+    const snapshot = snapshotElements(currentState.elements);
+    const patch = computeElementPatch();
+    if (!patch.add.length && !patch.update.length && !patch.delete.length) {
+        showSaveStatus('Keine Änderungen zu speichern', false);
+        return;
+    }
+    try {
+        const response = await fetch(`${url}/patch`, {
+            method: 'POST',
+            body: new URLSearchParams({ patch: JSON.stringify(patch), base_revision: currentState.revision })
+        });
+        if (response.ok) {
+            const result = await response.json();
+            markSaved(result.revision, snapshot);
+            if (result.changes) applyRemoteChanges(result.changes);
+            showSaveStatus('Grundriss erfolgreich gespeichert', false);
+            return;
+        }
+        // Conflicting edits must not be overwritten by the full save below
+        if (response.status === 409) {
+            showConflict(await response.json());
+            return;
+        }
+        console.warn('Patch save rejected, falling back to full save:', response.status);
+    } catch (error) {
+        console.warn('Patch save failed, falling back to full save:', error);
+    }
+    // A tiled plan has to be complete before it can be saved as a whole document
+    try {
+        await loadAllTiles();
+    } catch (error) {
+        showSaveStatus('Grundriss konnte nicht vollständig geladen werden', true);
+        return;
+    }
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'HX-Request': 'true' },
+        body: new URLSearchParams({
+            elements: JSON.stringify(currentState.elements),
+            base_revision: currentState.revision
+        })
+    });
+    const revision = response.headers.get('X-Floorplan-Revision');
+    if (revision !== null) {
+        if (response.headers.get('X-Floorplan-Merged')) await reloadElements();
+        markSaved(parseInt(revision), snapshotElements(currentState.elements));
+        showSaveStatus('Grundriss erfolgreich gespeichert', false);
+    } else {
+        const status = document.getElementById('save-status');
+        if (status) status.outerHTML = await response.text();
+    }
+}
@@ -0,0 +1,152 @@
+// Document uploads from the training record form (see src/document_uploads.py).
+// If the button offers it, the file goes straight to the bucket with a
+// presigned POST policy. Otherwise, or if that fails (e.g. no CORS rule on
+// the bucket), it is uploaded resumably through the app: the file is sent
+// from the offset the server has stored; after a dropped connection the
+// upload continues from there, also after reloading the page, as the session
+// token is kept per file. Files up to hashLimit are hashed first; if the
+// server already stores that content, it asks for the hash of a random nonce
+// and part of the file to prove the file is at hand, and once that matches
+// the upload completes without sending the file.
+const documentUploadState = {
+    retries: 5,
+    backoff: 1000,  // Milliseconds before the first retry, doubled each time
+    hashLimit: 256 * 1024 * 1024  // WebCrypto hashes whole buffers, so larger files are not hashed
+};
+
+async function sha256Hex(blob) {
+    const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join('');
+}
+
+// SHA-256 of the file as hex, '' if it is too large or WebCrypto is unavailable (plain HTTP)
+async function documentHash(file) {
+    if (file.size > documentUploadState.hashLimit || !(window.crypto && crypto.subtle)) return '';
+    return sha256Hex(file);
+}
+
+// Answer the server's challenge for known content: the hash of its nonce followed by
+// the requested bytes of the file. Resolves to the new document's id, null if refused.
+async function proveDocument(challenge, file) {
+    try {
+        const nonce = Uint8Array.from(challenge.nonce.match(/../g), hex => parseInt(hex, 16));
+        const proof = await sha256Hex(new Blob([nonce, file.slice(challenge.start, challenge.end)]));
+        const response = await fetch(challenge.url, { method: 'POST', body: new URLSearchParams({ proof }) });
+        return (await documentUploadJson(response)).document_id;
+    } catch (error) {
+        console.warn('Known content not accepted, uploading the file:', error);
+        return null;
+    }
+}
+
+function uploadStatus(text, cls) {
+    const status = document.getElementById('upload-status');
+    if (!status) return;
+    status.className = `uk-alert ${cls}`;
+    status.textContent = text;
+}
+
+function documentUploadKey(file) {
+    return `document-upload:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function documentUploadJson(response) {
+    const data = await response.json().catch(() => ({}));
+    if (!response.ok) throw Object.assign(new Error(data.error || `HTTP ${response.status}`), { status: response.status });
+    return data;
+}
+
+// Session of a file: resumed if the server still knows it, otherwise started
+async function documentUploadSession(url, file, sha256) {
+    const token = localStorage.getItem(documentUploadKey(file));
+    if (token) {
+        const response = await fetch(`/document/uploads/${token}`, { cache: 'no-store' });
+        if (response.ok) return response.json();
+    }
+    const body = new URLSearchParams({ filename: file.name, size: file.size, sha256 });
+    const session = await documentUploadJson(await fetch(url, { method: 'POST', body }));
+    if (session.challenge) {
+        // The server drops the upload if the proof is accepted
+        const documentId = await proveDocument(session.challenge, file);
+        if (documentId != null) return { ...session, document_id: documentId };
+    }
+    localStorage.setItem(documentUploadKey(file), session.token);
+    return session;
+}
+
+function showUploadedDocument(button, documentId) {
+    return htmx.ajax('GET', `${button.dataset.uploaded}/${documentId}/uploaded`,
+        { target: '#upload-status', swap: 'outerHTML' });
+}
+
+// Upload straight to the bucket, then register the document with the app
+async function uploadDocumentDirect(button, file, sha256) {
+    const body = new URLSearchParams({ filename: file.name, size: file.size, sha256 });
+    const policy = await documentUploadJson(await fetch(button.dataset.presign, { method: 'POST', body }));
+    if (policy.challenge) {
+        const documentId = await proveDocument(policy.challenge, file);
+        if (documentId != null) return showUploadedDocument(button, documentId);
+    }
+    const form = new FormData();
+    Object.entries(policy.fields).forEach(([name, value]) => form.append(name, value));
+    form.append('file', file);  // Must follow the policy fields
+    const response = await fetch(policy.url, { method: 'POST', body: form });
+    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+    await htmx.ajax('POST', button.dataset.complete,
+        { target: '#upload-status', swap: 'outerHTML', values: { token: policy.token } });
+}
+
+async function uploadDocument(button) {
+    const input = document.getElementById('file-upload');
+    const file = input && input.files[0];
+    if (!file) {
+        uploadStatus('Keine Datei ausgewählt', 'uk-alert-warning');
+        return;
+    }
+    button.disabled = true;
+    uploadStatus(`Wird geprüft: ${file.name}`, 'uk-alert-primary');
+    const sha256 = await documentHash(file).catch(() => '');
+    if (button.dataset.presign) {
+        uploadStatus(`Wird hochgeladen: ${file.name}`, 'uk-alert-primary');
+        try {
+            await uploadDocumentDirect(button, file, sha256);
+            input.value = '';
+            button.disabled = false;
+            return;
+        } catch (error) {
+            console.warn('Direct upload failed, uploading through the app:', error);
+        }
+    }
+    try {
+        let session = await documentUploadSession(button.dataset.url, file, sha256);
+        let failures = 0;
+        while (session.document_id == null) {
+            uploadStatus(`Wird hochgeladen: ${file.name} (${Math.floor(100 * session.offset / file.size)} %)`, 'uk-alert-primary');
+            try {
+                const response = await fetch(`/document/uploads/${session.token}`, {
+                    method: 'PATCH',
+                    headers: { 'Upload-Offset': String(session.offset), 'Content-Type': 'application/offset+octet-stream' },
+                    body: file.slice(session.offset)
+                });
+                const previous = session.offset;
+                session = await documentUploadJson(response);
+                if (session.offset > previous) failures = 0;
+                else if (session.document_id == null && ++failures > documentUploadState.retries) throw new Error('Upload kommt nicht voran');
+            } catch (error) {
+                // Client errors are final; network and server errors are retried from the stored offset
+                if (error.status && error.status < 500 && error.status !== 409) throw error;
+                if (++failures > documentUploadState.retries) throw error;
+                await new Promise(resolve => setTimeout(resolve, documentUploadState.backoff * 2 ** (failures - 1)));
+                session = await documentUploadJson(await fetch(`/document/uploads/${session.token}`, { cache: 'no-store' }));
+            }
+        }
+        localStorage.removeItem(documentUploadKey(file));
+        input.value = '';
+        await showUploadedDocument(button, session.document_id);
+    } catch (error) {
+        console.error('Error uploading document:', error);
+        uploadStatus(`Fehler beim Hochladen: ${error.message}`, 'uk-alert-danger');
+    } finally {
+        button.disabled = false;
+    }
+}
@@ -0,0 +1,54 @@
+// Risk heatmap overlay, shared by the editor (render.js) and the viewer (show.js).
+// The server renders the risk density of the plan as a PNG covering the plan
+// area (/floorplan/{id}/heatmap); it is drawn over the elements when enabled.
+const heatmapState = {
+    enabled: false,
+    image: null,
+    width: 0,       // Plan size in metres, the area the image covers
+    height: 0,
+    onChange: null  // Redraws the canvas once the image is loaded
+};
+
+function initHeatmap(canvas, onChange) {
+    heatmapState.width = parseFloat(canvas.dataset.width);
+    heatmapState.height = parseFloat(canvas.dataset.height);
+    heatmapState.onChange = onChange;
+}
+
+// Show or hide the overlay; every time it is shown the image is revalidated
+// against the server, so it reflects the current risk assessments
+function toggleHeatmap() {
+    heatmapState.enabled = !heatmapState.enabled;
+    const button = document.getElementById('heatmap-toggle');
+    if (button) button.classList.toggle('uk-active', heatmapState.enabled);
+    if (!heatmapState.enabled) {
+        if (heatmapState.onChange) heatmapState.onChange();
+        return;
+    }
+    fetch(`/floorplan/${currentState.floorplanId}/heatmap`, { cache: 'no-cache' })
+        .then(response => {
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return response.blob();
+        })
+        .then(blob => createImageBitmap(blob))
+        .then(image => {
+            heatmapState.image = image;
+            if (heatmapState.onChange) heatmapState.onChange();
+        })
+        .catch(error => {
+            console.error('Error loading risk heatmap:', error);
+            heatmapState.enabled = false;
+            if (button) button.classList.remove('uk-active');
+        });
+}
+
+// Draw the overlay in canvas coordinates; expects an untransformed context
+function drawHeatmap(ctx) {
+    if (!heatmapState.enabled || !heatmapState.image) return;
+    ctx.save();
+    ctx.imageSmoothingEnabled = true;
+    ctx.drawImage(heatmapState.image,
+        currentState.panOffset.x, currentState.panOffset.y,
+        heatmapState.width * currentState.scale, heatmapState.height * currentState.scale);
+    ctx.restore();
+}
@@ -7,6 +7,9 @@ function render(canvas, options = {}) {
     
     // Render the floor plan
     renderToContext(ctx, canvas.width, canvas.height, options);
+    
+    // Fetch tiles that came into view (no-op unless the plan is tiled)
+    loadVisibleTiles(canvas, () => render(canvas));
 }
 
 // Render the floor plan to a specific context
@@ -19,11 +22,21 @@ function renderToContext(ctx, width, height, options = {}) {
     // Draw elements
     drawElements(ctx, options);
     
+    // Draw the risk heatmap over the elements, but not when exporting
+    if (!options.exporting) {
+        drawHeatmap(ctx);
+    }
+    
     // Draw selection
     if (currentState.selectedElement) {
         drawSelectionBox(ctx, currentState.selectedElement);
     }
     
+    // Draw what the other editors have selected
+    if (!options.exporting) {
+        drawRemoteSelections(ctx);
+    }
+    
     // Draw preview while drawing
     if (currentState.isDrawing && currentState.startPoint && options.previewEnd) {
         drawPreview(ctx, currentState.startPoint, options.previewEnd);
@@ -44,8 +44,11 @@ document.addEventListener('DOMContentLoaded', () => {
     const elementsData = canvas.dataset.floorplanElements;
     console.log('Raw elements data:', elementsData);
     
+    // Large plans are loaded per tile as the view changes (tiles.js)
+    if (initTiles(canvas)) {
+      console.log('Tiled floorplan, loading visible tiles');
     // If data attribute is empty or malformed, try fetching from API
-    if (!elementsData || elementsData === '[]') {
+    } else if (!elementsData || elementsData === '[]') {
       console.log('No elements in data attribute, fetching from API');
       fetchElementsFromAPI();
     } else {
@@ -73,10 +76,18 @@ document.addEventListener('DOMContentLoaded', () => {
   
   // Set up event listeners
   setupEventListeners();
+  initHeatmap(canvas, render);
   
   // Initial render
   render();
   
+  // Links from the search page name the element to open
+  const linkedElement = new URLSearchParams(window.location.search).get('element');
+  if (linkedElement) {
+    currentState.selectedElement = currentState.elements.find(el => el.id === linkedElement) || null;
+    fetchElementProperties(linkedElement);
+    render();
+  }
 });
 
 // Fetch elements from API
@@ -308,6 +319,12 @@ function render() {
   
   // Restore the context state
   ctx.restore();
+  
+  // Risk heatmap overlay, if enabled (heatmap.js)
+  drawHeatmap(ctx);
+  
+  // Fetch tiles that came into view (no-op unless the plan is tiled)
+  loadVisibleTiles(canvas, render);
 }
 
 // Draw grid on the canvas
@@ -0,0 +1,110 @@
+// Progressive loading of large floor plans. The page carries no elements for
+// these plans; the tiles covering the visible area are fetched as the view
+// is panned and zoomed and merged into currentState.elements.
+const tileState = {
+    enabled: false,
+    complete: false,
+    size: 4096,         // Tile edge in metres at zoom 0
+    pixels: 256,        // On-screen tile size the zoom level is chosen for
+    maxZoom: 12,
+    loaded: new Set(),  // 'zoom/x/y' keys already requested
+    seq: new Map(),     // Element id -> drawing order on the server
+    seen: new Set()     // Element ids received so far
+};
+
+// Read the tiling parameters from the canvas; returns whether the plan is tiled
+function initTiles(canvas) {
+    tileState.enabled = canvas.dataset.tiled === 'true';
+    tileState.complete = false;
+    tileState.size = parseFloat(canvas.dataset.tileSize || tileState.size);
+    tileState.pixels = parseFloat(canvas.dataset.tilePixels || tileState.pixels);
+    tileState.maxZoom = parseInt(canvas.dataset.maxTileZoom || tileState.maxZoom);
+    tileState.loaded.clear();
+    tileState.seq.clear();
+    tileState.seen.clear();
+    return tileState.enabled;
+}
+
+// Zoom level whose tiles are about tileState.pixels wide at the given scale
+function tileZoom(scale) {
+    const zoom = Math.round(Math.log2(tileState.size * scale / tileState.pixels));
+    return Math.max(0, Math.min(tileState.maxZoom, zoom));
+}
+
+// Request the tiles covering the canvas that were not requested yet, nearest to the centre first
+function loadVisibleTiles(canvas, onLoaded) {
+    if (!tileState.enabled || tileState.complete) return;
+
+    const scale = currentState.scale;
+    const zoom = tileZoom(scale);
+    const size = tileState.size / Math.pow(2, zoom);
+
+    // Visible area in metres
+    const minX = -currentState.panOffset.x / scale;
+    const minY = -currentState.panOffset.y / scale;
+    const maxX = (canvas.width - currentState.panOffset.x) / scale;
+    const maxY = (canvas.height - currentState.panOffset.y) / scale;
+    const centerX = (minX + maxX) / 2 / size;
+    const centerY = (minY + maxY) / 2 / size;
+
+    const tiles = [];
+    for (let tx = Math.floor(minX / size); tx <= Math.floor(maxX / size); tx++) {
+        for (let ty = Math.floor(minY / size); ty <= Math.floor(maxY / size); ty++) {
+            const key = `${zoom}/${tx}/${ty}`;
+            if (tileState.loaded.has(key)) continue;
+            tileState.loaded.add(key);
+            tiles.push({ key, distance: Math.hypot(tx + 0.5 - centerX, ty + 0.5 - centerY) });
+        }
+    }
+    tiles.sort((a, b) => a.distance - b.distance);
+    tiles.forEach(tile => fetchTile(tile.key, onLoaded));
+}
+
+function fetchTile(key, onLoaded) {
+    fetch(`/floorplan_editor/${currentState.floorplanId}/tiles/${key}`)
+        .then(response => {
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return response.json();
+        })
+        .then(tile => {
+            if (!tileState.complete && mergeTileElements(tile.elements, tile.seq)) onLoaded();
+        })
+        .catch(error => {
+            console.error(`Error loading tile ${key}:`, error);
+        });
+}
+
+function drawOrder(element) {
+    const seq = tileState.seq.get(element.id);
+    return seq === undefined ? Number.MAX_SAFE_INTEGER : seq;
+}
+
+// Add elements not seen before, keeping currentState.elements in drawing order.
+// Elements already present are left alone so local edits and deletions survive.
+function mergeTileElements(elements, seqs) {
+    let added = 0;
+    elements.forEach((element, i) => {
+        tileState.seq.set(element.id, seqs[i]);
+        if (tileState.seen.has(element.id)) return;
+        tileState.seen.add(element.id);
+        currentState.elements.push(element);
+        // The editor tracks what the server and the other editors have, so only changes are sent
+        if (currentState.savedElements) currentState.savedElements.set(element.id, JSON.stringify(element));
+        if (currentState.syncedElements) currentState.syncedElements.set(element.id, JSON.stringify(element));
+        added++;
+    });
+    if (added) currentState.elements.sort((a, b) => drawOrder(a) - drawOrder(b));
+    return added;
+}
+
+// Load every element of a tiled plan, e.g. before saving it as a whole document
+async function loadAllTiles() {
+    if (!tileState.enabled || tileState.complete) return;
+    const response = await fetch(`/floorplan_editor/${currentState.floorplanId}/elements`);
+    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+    const elements = await response.json();
+    // The full list is in drawing order, so its positions replace the tile seqs
+    tileState.seq.clear();
+    mergeTileElements(elements, elements.map((_, i) => i));
+    tileState.complete = true;
+}
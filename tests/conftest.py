@@ -0,0 +1,11 @@
+"""
+The app modules open the database named by ``EASE_DB_PATH`` when src.db is
+first imported, so the tests point it (and the render cache) at a fresh
+temporary directory before anything imports the app.
+"""
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="ease-hs-tests-")
+os.environ['EASE_DB_PATH'] = os.path.join(_tmp, 'floorplan.db')
+os.environ['EASE_RENDER_CACHE'] = os.path.join(_tmp, 'render_cache')
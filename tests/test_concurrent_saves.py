@@ -0,0 +1,54 @@
+import datetime
+import threading
+from src.db import db, floorplans
+from src.floorplan import write_floorplan, write_floorplan_patch, merge_floorplan
+from src.plan_elements import load_elements
+from src.thumbnails import update_thumbnail
+
+def machine(index, y=0):
+    return {'id': f'e{index}', 'element_type': 'machine', 'start': {'x': index, 'y': y},
+            'end': {'x': index + 1, 'y': y + 1}, 'width': 0.1, 'properties': {}}
+
+def run_threads(target, count=6):
+    errors = []
+    def run(index):
+        try:
+            target(index)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return errors
+
+def test_concurrent_saves_are_serialized():
+    now = datetime.datetime.now().isoformat()
+    plan = floorplans.insert(user_id=1, name="Parallel", width=20, height=15, created_at=now, updated_at=now, revision=0)
+    base = write_floorplan(plan.id, [machine(index) for index in range(6)])
+
+    def patch(index):
+        for y in range(1, 21): write_floorplan_patch(plan.id, {"update": [machine(index, y)]}, None)
+    assert run_threads(patch) == []
+
+    # Every editor loaded the same revision and moves only its own machine
+    base = db.execute("SELECT revision FROM floorplans WHERE id=?", (plan.id,)).fetchone()[0]
+    def merge(index):
+        revision, _, conflicts = merge_floorplan(plan.id, [machine(i, 30 if i == index else 20) for i in range(6)], base)
+        assert conflicts == [] and revision is not None
+    assert run_threads(merge) == []
+    assert db.execute("SELECT revision FROM floorplans WHERE id=?", (plan.id,)).fetchone()[0] == base + 6
+    assert load_elements(db, plan.id) == [machine(index, 30) for index in range(6)]
+
+def test_thumbnails_render_while_saving():
+    now = datetime.datetime.now().isoformat()
+    plan = floorplans.insert(user_id=1, name="Vorschau", width=20, height=15, created_at=now, updated_at=now, revision=0)
+    write_floorplan(plan.id, [machine(index) for index in range(6)])
+
+    # Half of the threads save, the other half render like the background task
+    def work(index):
+        for y in range(1, 11):
+            if index % 2: update_thumbnail(plan.id)
+            else: write_floorplan_patch(plan.id, {"update": [machine(index, y)]}, None)
+    assert run_threads(work) == []
+    revision = db.execute("SELECT revision FROM floorplans WHERE id=?", (plan.id,)).fetchone()[0]
+    assert update_thumbnail(plan.id) == revision
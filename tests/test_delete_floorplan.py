@@ -0,0 +1,56 @@
+import asyncio
+import datetime
+from src.db import db, floorplans, training_records, risk_assessments
+from src.document_uploads import add_document
+from src.floorplan import write_floorplan, delete_floorplan
+from src.notifications import refresh_notifications
+from src.search_index import index_element, search
+
+def machine(element_id, x):
+    return {'id': element_id, 'element_type': 'machine', 'start': {'x': x, 'y': 0}, 'end': {'x': x + 1, 'y': 1},
+            'width': 0.1, 'properties': {}}
+
+def count(sql, *args):
+    return db.execute(f"SELECT count(*) FROM {sql}", args).fetchone()[0]
+
+def rows_of(floorplan_id):
+    of_elements = "element_id IN (SELECT id FROM elements WHERE floorplan_id=?)"
+    return [count("elements WHERE floorplan_id=?", floorplan_id),
+            count(f"risk_assessments WHERE {of_elements}", floorplan_id),
+            count(f"training_records WHERE {of_elements}", floorplan_id),
+            count("documents WHERE floorplan_id=?", floorplan_id),
+            count("notifications WHERE floorplan_id=?", floorplan_id),
+            count("floorplan_elements_rtree WHERE min_fp=?", floorplan_id)]
+
+def test_delete_floorplan_removes_everything_of_the_plan():
+    now = datetime.datetime.now().isoformat()
+    plans = [floorplans.insert(user_id=1, name=name, width=20, height=15, created_at=now, updated_at=now, revision=0)
+             for name in ("Weg", "Bleibt")]
+    for plan in plans:
+        write_floorplan(plan.id, [machine('m1', 0), machine('m2', 2)])
+        pk = db.execute("SELECT id FROM elements WHERE floorplan_id=? AND element_id='m1'", (plan.id,)).fetchone()[0]
+        db.execute("UPDATE elements SET name='Drehbank', next_maintenance_due='2000-01-01' WHERE id=?", (pk,))
+        risk_assessments.insert(element_id=pk, description="Quetschen", frequency=1, severity=1, probability=1,
+                                risk_score=1, technical_measures="[]", organizational_measures="[]",
+                                personal_measures="[]")
+        training_records.insert(element_id=pk, employee_name="Müller", training_name="Unterweisung",
+                                training_date="2000-01-01", document_ids="[]")
+        add_document(plan.id, 'm1', 'anleitung.pdf', f'documents/{plan.id}/m1/anleitung.pdf', None, 3)
+        index_element(db, pk)
+    refresh_notifications(db)
+    gone, kept = plans
+    kept_rows = rows_of(kept.id)
+    assert all(kept_rows) and rows_of(gone.id) == kept_rows
+    hits = len(search(db, "Drehbank"))
+
+    asyncio.run(delete_floorplan(gone.id))
+    for table in ("elements", "notifications", "documents"):
+        assert count(f"{table} WHERE floorplan_id=?", gone.id) == 0
+    for table in ("risk_assessments", "training_records"):
+        assert count(f"{table} WHERE element_id NOT IN (SELECT id FROM elements)") == 0
+    for table in ("floorplan_elements", "floorplan_revisions", "floorplan_thumbnails"):
+        assert count(f"{table} WHERE floorplan_id=?", gone.id) == 0
+    assert count("floorplan_elements_rtree WHERE min_fp=?", gone.id) == 0
+    assert count("floorplans WHERE id=?", gone.id) == 0
+    assert rows_of(kept.id) == kept_rows
+    assert len(search(db, "Drehbank")) == hits // 2 > 0
@@ -0,0 +1,103 @@
+import asyncio
+import datetime
+import json
+import threading
+import time
+import pytest
+from fasthtml.common import to_xml
+from starlette.testclient import TestClient
+import main
+from src import s3
+from src.components.element_modals import training_record_form, training_records_modal
+from src.db import db, write_lock, floorplans, direct_uploads, documents, training_records
+from src.document_uploads import (UploadError, add_document, complete_direct_upload, store_upload,
+                                  release_documents, uploaded_document_item, _unattached_documents)
+from src.element_routes import update_training
+from src.floorplan import write_floorplan
+
+def new_machine():
+    now = datetime.datetime.now().isoformat()
+    plan = floorplans.insert(user_id=1, name="Dokumente", width=20, height=15, created_at=now, updated_at=now, revision=0)
+    write_floorplan(plan.id, [{'id': 'm1', 'element_type': 'machine', 'start': {'x': 0, 'y': 0},
+                               'end': {'x': 1, 'y': 1}, 'width': 0.1, 'properties': {}}])
+    return plan.id
+
+def test_stored_documents_cannot_be_completed_as_uploads():
+    floorplan_id = new_machine()
+    # A document stored before content addressing, under the element's upload prefix
+    legacy = add_document(floorplan_id, 'm1', 'alt.pdf', f'documents/{floorplan_id}/m1/20200101000000000000.pdf', None, 6)
+    with pytest.raises(UploadError):
+        asyncio.run(store_upload(floorplan_id, 'm1', 'x.pdf', legacy.s3_key, '0' * 64, 6))
+    # Only tokens of issued keys are accepted, and not for a key a document uses
+    assert 'Ungültiger Upload' in to_xml(asyncio.run(complete_direct_upload(floorplan_id, 'm1', 'unbekannt')))
+    direct_uploads.insert(id='issued', floorplan_id=floorplan_id, element_id='m1', filename='x.pdf',
+                          s3_key=legacy.s3_key, size=6, created_at=datetime.datetime.now().isoformat())
+    assert 'Ungültiger Upload' in to_xml(asyncio.run(complete_direct_upload(floorplan_id, 'm1', 'issued')))
+
+def test_documents_dropped_or_never_attached_are_released():
+    floorplan_id = new_machine()
+    pk = db.execute("SELECT id FROM elements WHERE floorplan_id=?", (floorplan_id,)).fetchone()[0]
+    kept, dropped, stray = [add_document(floorplan_id, 'm1', f'{name}.pdf', f'documents/sha256/{name}', None, 1)
+                            for name in ('kept', 'dropped', 'stray')]
+    record = training_records.insert(element_id=pk, employee_name="Müller", training_name="Unterweisung",
+                                     training_date="2026-01-01", document_ids=json.dumps([kept.id, dropped.id]))
+    asyncio.run(update_training(floorplan_id, 'm1', record.id, "Müller", "Unterweisung", "2026-01-01", pk, [kept.id]))
+    assert json.loads(training_records[record.id].document_ids) == [kept.id]
+    assert not documents(where="id=?", where_args=(dropped.id,))
+    # Collected once older than the upload expiry, unless a record lists them
+    db.execute("UPDATE documents SET upload_date='2000-01-01' WHERE id IN (?, ?)", (kept.id, stray.id))
+    cutoff = datetime.datetime.now().isoformat()
+    assert stray.id in _unattached_documents(cutoff) and kept.id not in _unattached_documents(cutoff)
+
+def test_posted_training_forms_keep_their_documents():
+    floorplan_id = new_machine()
+    pk = db.execute("SELECT id FROM elements WHERE floorplan_id=?", (floorplan_id,)).fetchone()[0]
+    first, second = [add_document(floorplan_id, 'm1', f'{name}.pdf', f'documents/sha256/{name}', None, 1)
+                     for name in ('form1', 'form2')]
+    assert 'name="document_ids"' in to_xml(uploaded_document_item(floorplan_id, 'm1', first))
+    client = TestClient(main.app)
+    form = dict(element_db_id=pk, employee_name="Schulz", training_name="Stapler", training_date="2026-03-01")
+    client.post(f"/element/{floorplan_id}/m1/training/create", data={**form, 'document_ids': [first.id, second.id]})
+    record = training_records(where="element_id=?", where_args=(pk,))[0]
+    assert json.loads(record.document_ids) == [first.id, second.id]
+    assert f'name="document_ids" value="{first.id}"' in to_xml(training_record_form(floorplan_id, 'm1', record.id))
+    client.post(f"/element/{floorplan_id}/m1/training/update/{record.id}", data={**form, 'document_ids': second.id})
+    assert json.loads(training_records[record.id].document_ids) == [second.id]
+    assert not documents(where="id=?", where_args=(first.id,))
+
+def test_release_waits_for_the_write_lock_off_the_event_loop():
+    floorplan_id = new_machine()
+    doc = add_document(floorplan_id, 'm1', 'warten.pdf', 'documents/sha256/warten', None, 1)
+    held, done = threading.Event(), threading.Event()
+    def hold():
+        with write_lock:
+            held.set()
+            done.wait(5)
+    threading.Thread(target=hold).start()
+    held.wait(5)
+    async def run():
+        release = asyncio.create_task(release_documents([doc.id], lambda: None))
+        # The loop keeps running while the release waits for the lock
+        start = time.monotonic()
+        await asyncio.sleep(0.05)
+        assert time.monotonic() - start < 1
+        done.set()
+        await release
+    asyncio.run(run())
+    assert not documents(where="id=?", where_args=(doc.id,))
+
+def test_listed_documents_are_signed_once_for_their_links(monkeypatch):
+    floorplan_id = new_machine()
+    pk = db.execute("SELECT id FROM elements WHERE floorplan_id=?", (floorplan_id,)).fetchone()[0]
+    docs = [add_document(floorplan_id, 'm1', f'{name}.pdf', f'documents/sha256/{name}-signed', None, 1)
+            for name in ('a', 'b')]
+    training_records.insert(element_id=pk, employee_name="Weber", training_name="Kran", training_date="2026-02-01",
+                            document_ids=json.dumps([doc.id for doc in docs]))
+    signed = []
+    monkeypatch.setattr(s3, 'generate_s3_document_url', lambda s3_key, expiration: signed.append(s3_key) or f"https://s3/{s3_key}")
+    html = to_xml(training_records_modal(floorplan_id, 'm1'))
+    assert all(f'href="/document/{doc.id}"' in html for doc in docs)
+    assert sorted(signed) == sorted(doc.s3_key for doc in docs)
+    response = TestClient(main.app, follow_redirects=False).get(f"/document/{docs[0].id}")
+    assert response.headers['location'] == f"https://s3/{docs[0].s3_key}"
+    assert len(signed) == 2
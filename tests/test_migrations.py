@@ -0,0 +1,27 @@
+import os
+from fasthtml.common import database
+from src import migrations
+
+def test_sync_indexes_recomputes_under_the_lock(tmp_path, monkeypatch):
+    path = str(tmp_path / 'workers.db')
+    first, second = database(path), database(path)
+    first.execute("CREATE TABLE parts (a, b)")
+    indexes = {'idx_parts_a': ('parts', ['a'])}
+    # The second worker looked at the schema before the first one synced it
+    stale = migrations.index_changes(second, indexes)
+    assert migrations.sync_indexes(first, indexes) == ['idx_parts_a']
+    index_changes, calls = migrations.index_changes, iter([stale])
+    monkeypatch.setattr(migrations, 'index_changes', lambda db, indexes: next(calls, None) or index_changes(db, indexes))
+    assert migrations.sync_indexes(second, indexes) == []
+    assert migrations.index_changes(second, indexes) == ([], [])
+
+def test_rebuild_search_restores_a_drifted_index():
+    from src.migrations.__main__ import main
+    from src.db import db, floorplans
+    from src.search_index import search
+    plan = floorplans.insert(user_id=1, name="Halle", width=20, height=15, created_at='', updated_at='', revision=0)
+    db.execute("INSERT INTO elements (floorplan_id, element_id, element_type, name) VALUES (?, 'm1', 'machine', 'Kantpresse')",
+               (plan.id,))
+    assert not search(db, "Kantpresse")
+    assert main(["rebuild-search", "--db", os.environ["EASE_DB_PATH"]]) == 0
+    assert [r['element_id'] for r in search(db, "Kantpresse")] == ['m1']
@@ -0,0 +1,18 @@
+import datetime
+from src.db import db, floorplans
+from src.floorplan import write_floorplan
+from src.notifications import refresh_notifications
+
+def test_maintenance_detail_leaves_out_a_missing_schedule():
+    now = datetime.datetime.now().isoformat()
+    plan = floorplans.insert(user_id=1, name="Wartung", width=20, height=15, created_at=now, updated_at=now, revision=0)
+    write_floorplan(plan.id, [{'id': f'm{i}', 'element_type': 'machine', 'start': {'x': i, 'y': 0},
+                               'end': {'x': i + 1, 'y': 1}, 'width': 0.1, 'properties': {}} for i in range(3)])
+    for element_id, schedule, last in (('m0', '', '2026-01-10'), ('m1', None, None), ('m2', 'Jährlich', '2025-01-10')):
+        db.execute("""UPDATE elements SET maintenance_schedule=?, last_maintenance=?, next_maintenance_due='2026-01-01'
+                      WHERE floorplan_id=? AND element_id=?""", (schedule, last, plan.id, element_id))
+    refresh_notifications(db, today=datetime.date(2026, 1, 1))
+    details = dict(db.execute("""SELECT e.element_id, n.detail FROM notifications n JOIN elements e ON e.id = n.element_id
+                                 WHERE n.kind='maintenance' AND n.floorplan_id=?""", (plan.id,)).fetchall())
+    assert details == {'m0': "zuletzt 10.01.2026", 'm1': "noch keine Wartung erfasst",
+                       'm2': "Jährlich, zuletzt 10.01.2025"}
@@ -0,0 +1,31 @@
+import datetime
+from starlette.testclient import TestClient
+import main
+from src import plan_render, risk_heatmap
+from src.db import floorplans
+from src.floorplan import write_floorplan
+
+def new_plan():
+    now = datetime.datetime.now().isoformat()
+    plan = floorplans.insert(user_id=1, name="Bild", width=20, height=15, created_at=now, updated_at=now, revision=0)
+    write_floorplan(plan.id, [{'id': 'w1', 'element_type': 'wall', 'start': {'x': 0, 'y': 0},
+                               'end': {'x': 5, 'y': 0}, 'width': 0.2, 'properties': {}}])
+    return plan.id
+
+def test_png_without_cairosvg_is_not_implemented(monkeypatch):
+    floorplan_id = new_plan()
+    def missing(): raise plan_render.RenderUnavailable("PNG rendering needs the cairosvg package")
+    monkeypatch.setattr(plan_render, '_cairosvg', missing)
+    client = TestClient(main.app)
+    response = client.get(f"/floorplan/{floorplan_id}/render/png")
+    assert response.status_code == 501
+    assert 'cairosvg' in response.json()['error']
+    assert client.get(f"/floorplan/{floorplan_id}/render/svg").status_code == 200
+
+def test_heatmap_without_numpy_is_not_implemented(monkeypatch):
+    floorplan_id = new_plan()
+    def missing(): raise plan_render.RenderUnavailable("The risk heatmap needs the numpy package")
+    monkeypatch.setattr(risk_heatmap, '_numpy', missing)
+    response = TestClient(main.app).get(f"/floorplan/{floorplan_id}/heatmap")
+    assert response.status_code == 501
+    assert 'numpy' in response.json()['error']
@@ -0,0 +1,74 @@
+import asyncio
+import datetime
+import json
+import pytest
+from starlette.testclient import TestClient
+import main
+from src import plan_codec
+from src.collab import Room
+from src.db import db, floorplans
+from src.floorplan import write_floorplan, merge_floorplan
+from src.plan_elements import load_elements
+from src.plan_revisions import list_revisions, load_revision
+
+CODECS = [codec for codec in plan_codec.CODEC_IDS if plan_codec.available(codec)]
+
+def wall(element_id, x):
+    # Coordinates below a millimetre, which msgpack would round
+    return {'id': element_id, 'element_type': 'wall', 'start': {'x': x + 0.12345, 'y': 1.00049},
+            'end': {'x': x + 3.98765, 'y': 1.00049}, 'width': 0.1234, 'properties': {}}
+
+def new_plan():
+    now = datetime.datetime.now().isoformat()
+    plan = floorplans.insert(user_id=1, name="Test", width=20, height=15, created_at=now, updated_at=now, revision=0)
+    base = write_floorplan(plan.id, [wall('e0', 0), wall('e1', 5)])
+    return plan.id, base
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_merge_of_separate_elements_under_every_codec(monkeypatch, codec):
+    monkeypatch.setattr(plan_codec, 'DEFAULT_CODEC', codec)
+    floorplan_id, base = new_plan()
+    assert load_revision(db, floorplan_id, base) == load_elements(db, floorplan_id)
+    ours = [wall('e0', 0.5), wall('e1', 5)]
+    revision, merged, conflicts = merge_floorplan(floorplan_id, ours, base)
+    assert (merged, conflicts) == (False, [])
+    # A second editor still at ``base`` changes the other element
+    theirs = [wall('e0', 0), wall('e1', 6)]
+    revision, merged, conflicts = merge_floorplan(floorplan_id, theirs, base)
+    assert conflicts == []
+    assert merged
+    assert load_elements(db, floorplan_id) == [wall('e0', 0.5), wall('e1', 6)]
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_restored_revision_keeps_geometry(monkeypatch, codec):
+    monkeypatch.setattr(plan_codec, 'DEFAULT_CODEC', codec)
+    floorplan_id, base = new_plan()
+    write_floorplan(floorplan_id, [wall('e0', 9)])
+    assert load_revision(db, floorplan_id, base) == [wall('e0', 0), wall('e1', 5)]
+
+def test_collaborative_batches_share_one_history_revision():
+    floorplan_id, base = new_plan()
+    room = Room(floorplan_id)
+    for x in range(3):
+        room.apply([wall('e1', x), wall(f'n{x}', x)], ['e0'] if x == 1 else [])
+        asyncio.run(room.flush())
+    revisions = [r['revision'] for r in list_revisions(db, floorplan_id)]
+    assert revisions == [base + 3, base]
+    assert load_revision(db, floorplan_id, base + 3) == load_elements(db, floorplan_id)
+    # A save in between starts a new history revision
+    write_floorplan(floorplan_id, [wall('e1', 9)])
+    room.apply([wall('n9', 9)], [])
+    asyncio.run(room.flush())
+    assert [r['revision'] for r in list_revisions(db, floorplan_id)] == [base + 5, base + 4, base + 3, base]
+    assert load_revision(db, floorplan_id, base + 3) == [wall('e1', 2), wall('n0', 0), wall('n1', 1), wall('n2', 2)]
+
+def test_missing_codec_package_is_reported(monkeypatch):
+    floorplan_id, base = new_plan()
+    monkeypatch.setattr(plan_codec, 'DEFAULT_CODEC', 'json-zstd')
+    monkeypatch.setitem(plan_codec.PACKAGES, 'json-zstd', 'zstandard_not_installed')
+    assert not plan_codec.available('json-zstd')
+    response = TestClient(main.app).post(f"/save_floorplan/{floorplan_id}/patch",
+                                         data={'patch': json.dumps({"update": [wall('e0', 7)]}), 'base_revision': base})
+    assert response.status_code == 501
+    assert 'zstandard_not_installed' in response.json()['error']
+    assert load_elements(db, floorplan_id) == [wall('e0', 0), wall('e1', 5)]
@@ -0,0 +1,55 @@
+import datetime
+from contextlib import contextmanager
+from src import migrations
+from src.db import db, floorplans, HOT_QUERIES
+from src.document_uploads import stored_document
+from src.floorplan import write_floorplan, write_floorplan_patch, list_floorplans
+from src.notifications import list_notifications
+from src.plan_elements import load_elements, query_tile
+from src.risk_dashboard import top_risks, plan_risk_summary
+from src.search_index import search
+
+def test_hot_queries_use_an_index():
+    # The test database was created by the migrations and index sync at import
+    assert migrations.scanning_queries(db, HOT_QUERIES) == []
+
+@contextmanager
+def traced():
+    """Statements run on the shared connection while the block runs"""
+    statements = []
+    def trace(cursor, sql, bindings):
+        if not sql.startswith(('SAVEPOINT', 'RELEASE', 'ROLLBACK')) and 'sqlite_master' not in sql:
+            statements.append(sql)
+        return True
+    db.conn.exec_trace = trace
+    try:
+        yield statements
+    finally:
+        db.conn.exec_trace = None
+
+def _ordered_walk(sql, plan):
+    """Reads along an index in ORDER BY order and stops at the LIMIT, like the top risks"""
+    return 'LIMIT' in sql and all('USING INDEX' in step for step in plan if step.startswith('SCAN'))
+
+def machine(x):
+    return {'id': 'm1', 'element_type': 'machine', 'start': {'x': x, 'y': 0}, 'end': {'x': x + 1, 'y': 1},
+            'width': 0.1, 'properties': {}}
+
+def test_route_queries_use_an_index():
+    now = datetime.datetime.now().isoformat()
+    plan = floorplans.insert(user_id=1, name="Plan", width=20, height=15, created_at=now, updated_at=now, revision=0)
+    with traced() as statements:
+        revision = write_floorplan(plan.id, [machine(0)])
+        write_floorplan_patch(plan.id, {"update": [machine(1)]}, revision)
+        list_floorplans(1)
+        load_elements(db, plan.id)
+        list(query_tile(db, plan.id, 0, 0, 5, 5))
+        top_risks(1)
+        top_risks(1, floorplan_id=plan.id)
+        plan_risk_summary(1)
+        list_notifications(1)
+        search(db, "Maschine")
+        stored_document("0" * 64, 1)
+    assert statements
+    failures = migrations.scanning_queries(db, list(dict.fromkeys(statements)))
+    assert [(sql, plan) for sql, plan in failures if not _ordered_walk(sql, plan)] == []
@@ -0,0 +1,57 @@
+import datetime
+import inspect
+import re
+from fasthtml.common import to_xml
+from starlette.testclient import TestClient
+import main
+from src.components.element_modals import risk_assessment_form
+from src.db import db, floorplans, risk_assessments
+from src import element_routes
+from src.element_routes import create_risk
+from src.floorplan import write_floorplan
+from src.risk_dashboard import top_risks
+
+MEASURES = ('technical_measures', 'organizational_measures', 'personal_measures')
+
+def new_machine():
+    now = datetime.datetime.now().isoformat()
+    plan = floorplans.insert(user_id=1, name="Risiken", width=20, height=15, created_at=now, updated_at=now, revision=0)
+    write_floorplan(plan.id, [{'id': 'm1', 'element_type': 'machine', 'start': {'x': 0, 'y': 0},
+                               'end': {'x': 1, 'y': 1}, 'width': 0.1, 'properties': {}}])
+    pk = db.execute("SELECT id FROM elements WHERE floorplan_id=?", (plan.id,)).fetchone()[0]
+    return plan.id, pk
+
+def test_measure_inputs_match_the_handler():
+    floorplan_id, pk = new_machine()
+    risk = risk_assessments.insert(element_id=pk, description="Quetschen", frequency=1, severity=1, probability=1,
+                                   risk_score=1, technical_measures='["Schutzgitter"]',
+                                   organizational_measures='["Unterweisung"]', personal_measures='["Handschuhe"]')
+    html = to_xml(risk_assessment_form(floorplan_id, 'm1', risk.id))
+    names = set(re.findall(r'name="(\w+_measures[^"]*)"', html))
+    assert names == set(MEASURES)
+    assert set(MEASURES) <= set(inspect.signature(create_risk).parameters)
+
+def test_risk_with_measures_is_not_unmitigated():
+    floorplan_id, pk = new_machine()
+    client = TestClient(main.app)
+    url = f"/element/{floorplan_id}/m1/risk/create"
+    form = dict(element_db_id=pk, frequency=2, severity=3, probability=2)
+    client.post(url, data={**form, 'description': "Ohne Maßnahmen", 'technical_measures': ''})
+    client.post(url, data={**form, 'description': "Eine Maßnahme", 'technical_measures': 'Schutzgitter'})
+    client.post(url, data={**form, 'description': "Mehrere Maßnahmen",
+                           'technical_measures': ['Schutzgitter', 'Lichtschranke'],
+                           'organizational_measures': 'Unterweisung', 'personal_measures': ['Handschuhe']})
+    stored = {risk.description: risk for risk in risk_assessments(where="element_id=?", where_args=(pk,))}
+    assert {description: risk.measure_count for description, risk in stored.items()} == \
+        {"Ohne Maßnahmen": 0, "Eine Maßnahme": 1, "Mehrere Maßnahmen": 4}
+    assert stored["Mehrere Maßnahmen"].technical_measures == '["Schutzgitter", "Lichtschranke"]'
+    unmitigated = {risk['description']: risk['unmitigated'] for risk in top_risks(1, floorplan_id=floorplan_id)}
+    assert unmitigated == {"Ohne Maßnahmen": 1, "Eine Maßnahme": 0, "Mehrere Maßnahmen": 0}
+
+def test_risk_is_not_saved_without_its_search_entry(monkeypatch):
+    floorplan_id, pk = new_machine()
+    def fail(*args): raise RuntimeError("Suchindex nicht verfügbar")
+    monkeypatch.setattr(element_routes, 'index_record', fail)
+    html = to_xml(create_risk(floorplan_id, 'm1', "Quetschen", 1, 1, 1, pk))
+    assert "Fehler beim Speichern" in html
+    assert not risk_assessments(where="element_id=?", where_args=(pk,))
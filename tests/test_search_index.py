@@ -0,0 +1,43 @@
+import datetime
+import json
+from starlette.testclient import TestClient
+import main
+from src.db import db, floorplans, operating_instructions
+from src.floorplan import write_floorplan
+from src.search_index import search
+
+def new_machine():
+    now = datetime.datetime.now().isoformat()
+    plan = floorplans.insert(user_id=1, name="Suche", width=20, height=15, created_at=now, updated_at=now, revision=0)
+    write_floorplan(plan.id, [{'id': 'm1', 'element_type': 'machine', 'start': {'x': 0, 'y': 0},
+                               'end': {'x': 1, 'y': 1}, 'width': 0.1, 'properties': {}}])
+    pk = db.execute("SELECT id FROM elements WHERE floorplan_id=?", (plan.id,)).fetchone()[0]
+    return plan.id, pk
+
+def test_posted_operating_instructions_are_stored_and_found():
+    floorplan_id, pk = new_machine()
+    client = TestClient(main.app)
+    # Field names as rendered by the form rows
+    for kind in ('hazard', 'protection', 'first-aid', 'emergency'):
+        html = client.get(f"/element/{floorplan_id}/m1/add-form-item/{kind}").text
+        field = kind.replace('-', '_')
+        assert f'name="{field}_symbols"' in html and f'name="{field}_texts"' in html
+    client.post(f"/element/{floorplan_id}/m1/instructions/create",
+                data={'element_db_id': pk, 'hazard_symbols': 'GHS02', 'hazard_texts': 'Lösemittel',
+                      'protection_symbols': ['P101', 'P104'], 'protection_texts': ['Schutzbrille', 'Gehörschutz'],
+                      'first_aid_symbols': 'F102', 'first_aid_texts': 'Augen spülen',
+                      'emergency_symbols': 'E101', 'emergency_texts': 'Feuerlöscher',
+                      'maintenance_disposal': 'Fachbetrieb'})
+    instruction = operating_instructions(where="element_id=?", where_args=(pk,))[0]
+    assert json.loads(instruction.hazard_symbols) == [{'symbol': 'GHS02', 'text': 'Lösemittel'}]
+    assert json.loads(instruction.protection_measures) == [{'symbol': 'P101', 'text': 'Schutzbrille'},
+                                                           {'symbol': 'P104', 'text': 'Gehörschutz'}]
+    assert json.loads(instruction.first_aid) == [{'symbol': 'F102', 'text': 'Augen spülen'}]
+    assert json.loads(instruction.emergency_procedures) == [{'symbol': 'E101', 'text': 'Feuerlöscher'}]
+    assert [r['kind'] for r in search(db, "Gehörschutz")] == ['instructions']
+    client.post(f"/element/{floorplan_id}/m1/instructions/update",
+                data={'element_db_id': pk, 'hazard_symbols': 'GHS05', 'hazard_texts': 'Natronlauge'})
+    instruction = operating_instructions[instruction.id]
+    assert json.loads(instruction.hazard_symbols) == [{'symbol': 'GHS05', 'text': 'Natronlauge'}]
+    assert [r['kind'] for r in search(db, "Natronlauge")] == ['instructions']
+    assert not search(db, "Lösemittel")
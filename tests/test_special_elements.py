@@ -0,0 +1,34 @@
+import datetime
+from src.db import db, floorplans, risk_assessments
+from src.floorplan import write_floorplan, write_floorplan_patch
+
+def element(element_id, element_type, x=0):
+    return {'id': element_id, 'element_type': element_type, 'start': {'x': x, 'y': 0},
+            'end': {'x': x + 1, 'y': 1}, 'width': 0.1, 'properties': {}}
+
+def rows(floorplan_id):
+    return dict(db.execute("SELECT element_id, updated_at FROM elements WHERE floorplan_id=?",
+                           (floorplan_id,)).fetchall())
+
+def test_patch_reconciles_only_touched_elements():
+    now = datetime.datetime.now().isoformat()
+    plan = floorplans.insert(user_id=1, name="Patch", width=20, height=15, created_at=now, updated_at=now, revision=0)
+    revision = write_floorplan(plan.id, [element('m1', 'machine'), element('m2', 'machine', 2),
+                                         element('c1', 'closet', 4), element('w1', 'wall', 6)])
+    before = rows(plan.id)
+    assert sorted(before) == ['c1', 'm1', 'm2']
+    pk = db.execute("SELECT id FROM elements WHERE floorplan_id=? AND element_id='m2'", (plan.id,)).fetchone()[0]
+    risk_assessments.insert(element_id=pk, description="Quetschen", frequency=1, severity=1, probability=1,
+                            risk_score=1, technical_measures="[]", organizational_measures="[]",
+                            personal_measures="[]")
+
+    revision = write_floorplan_patch(plan.id, {"add": [element('k1', 'emergency-kit', 8)],
+                                               "update": [element('m1', 'machine', 1)], "delete": ['m2']}, revision)
+    after = rows(plan.id)
+    assert sorted(after) == ['c1', 'k1', 'm1']
+    assert after['c1'] == before['c1'] and after['m1'] > before['m1']
+    assert db.execute("SELECT count(*) FROM risk_assessments WHERE element_id=?", (pk,)).fetchone()[0] == 0
+
+    # An element that is no longer special loses its row
+    write_floorplan_patch(plan.id, {"update": [element('c1', 'wall', 4)]}, revision)
+    assert sorted(rows(plan.id)) == ['k1', 'm1']